@@ -0,0 +1,152 @@
+'''
+Benchmark of the scheduled UPB engine against the original per-month loop.
+
+    python -m benchmarks.bench_amortization --loans 1000000 5000000 --months 60
+
+With --path the rate-path engine (a loans x months rate matrix with resets, a CPR ramp and
+curtailments) is compared with the same recurrence walked month by month.
+'''
+import argparse
+import time
+
+import numpy as np
+
+from src.utilities import (compute_amortization, compute_amortization_at, compute_amortization_path,
+                           cpr_to_smm, rate_matrix)
+
+
+def loop_amortization(principals, monthly_rates, terms, start_period=0, end_period=None):
+    '''the original month-by-month implementation, kept as the reference'''
+    num_loans = len(principals)
+    num_month = terms.max()
+    mini_term = terms.min()
+    if end_period is not None:
+        num_month = min(num_month, max(1, (end_period - start_period)))
+
+    upb_matrix = np.zeros((num_month, num_loans))
+    the_payment = principals * (monthly_rates / (1 - (1 + monthly_rates) ** (-terms)))
+
+    current_upb = principals
+    if start_period > 0:
+        for t in range(1, start_period + 1):
+            pp_payment = the_payment - current_upb * monthly_rates
+            current_upb = current_upb - pp_payment
+
+    upb_matrix[0, :] = current_upb
+    i = 1
+    for t in range(start_period + 1, start_period + num_month):
+        pp_payment = the_payment - upb_matrix[i - 1, :] * monthly_rates
+        upb_matrix[i, :] = (upb_matrix[i - 1, :] - pp_payment)
+        if t >= mini_term:
+            iswithinTerm = np.greater(terms, t).astype(int)
+            isbeyondTerm = np.greater(t, terms).astype(int)
+            upb_matrix[i, :] = upb_matrix[i, :] * np.array(iswithinTerm) + (-999) * isbeyondTerm
+        i = i + 1
+    return upb_matrix.T
+
+
+def loop_amortization_path(principals, monthly_rates, terms, smm, curtailments, num_month):
+    '''month-by-month reference of compute_amortization_path: re-amortized payment, then prepayments'''
+    upb_matrix = np.zeros((len(principals), num_month))
+    upb_matrix[:, 0] = principals
+    for k in range(num_month - 1):
+        remaining = terms - k
+        rate = monthly_rates[:, k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            payment = np.where(rate == 0, upb_matrix[:, k] / remaining,
+                               upb_matrix[:, k] * rate / (1 - (1 + rate) ** (-remaining)))
+        balance = np.where(remaining <= 1, 0, upb_matrix[:, k] * (1 + rate) - payment)
+        upb_matrix[:, k + 1] = np.maximum(balance * (1 - smm[k]) - curtailments[:, k], 0)
+    ages = np.arange(num_month)[np.newaxis, :]
+    upb_matrix[np.broadcast_to(ages == terms[:, np.newaxis], upb_matrix.shape)] = 0
+    upb_matrix[np.broadcast_to(ages > terms[:, np.newaxis], upb_matrix.shape)] = -999
+    return upb_matrix
+
+
+def synthetic_rate_path(monthly_rates, num_month, seed=0):
+    '''an ARM-like path: a reset every 12 months after month 60 for a third of the loans'''
+    rng = np.random.default_rng(seed)
+    arm = np.flatnonzero(rng.random(len(monthly_rates)) < 1 / 3)
+    resets = np.arange(60, num_month, 12)
+    loan_index = np.repeat(arm, len(resets))
+    ages = np.tile(resets, len(arm))
+    rates = monthly_rates[loan_index] + rng.normal(0, 1, len(loan_index)) / 1200
+    return rate_matrix(monthly_rates, num_month, loan_index, ages, np.maximum(rates, 0))
+
+
+def run_path(num_loans, months):
+    principals, monthly_rates, terms = synthetic_loans(num_loans)
+    rates, t_rates = timed(synthetic_rate_path, monthly_rates, months)
+    smm = cpr_to_smm(np.minimum(np.arange(months) / 30, 1) * 0.08)
+    rng = np.random.default_rng(2)
+    curtailments = np.where(rng.random((num_loans, months)) < 0.005, 1000.0, 0)
+
+    ref, t_loop = timed(loop_amortization_path, principals, rates, terms, smm, curtailments, months)
+    res64, t_64 = timed(compute_amortization_path, principals, rates, terms, 0, months, smm=smm,
+                        curtailments=curtailments)
+    res32, t_32 = timed(compute_amortization_path, principals, rates, terms, 0, months, smm=smm,
+                        curtailments=curtailments, dtype=np.float32)
+    err = np.abs(res64 - ref).max()
+    print(f"path loans={num_loans:>9,} months={months:>3} | rate matrix {t_rates:6.2f}s | "
+          f"loop {t_loop:7.2f}s | cumprod f64 {t_64:6.2f}s ({t_loop / t_64:5.1f}x) | "
+          f"cumprod f32 {t_32:6.2f}s ({t_loop / t_32:5.1f}x) | max abs err {err:.2e} | "
+          f"MB rates {rates.nbytes / 2 ** 20:,.0f} / f32 out {res32.nbytes / 2 ** 20:,.0f}")
+
+
+def synthetic_loans(num_loans, seed=0):
+    rng = np.random.default_rng(seed)
+    principals = rng.uniform(50000, 800000, num_loans).round(-3)
+    monthly_rates = rng.uniform(2.5, 8.0, num_loans).round(3) / 1200
+    terms = rng.choice([180, 240, 360], num_loans, p=[0.2, 0.1, 0.7])
+    return principals, monthly_rates, terms
+
+
+def timed(fn, *args, **kwargs):
+    ts = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - ts
+
+
+def run(num_loans, months, start_period, pairs_per_loan):
+    principals, monthly_rates, terms = synthetic_loans(num_loans)
+    end_period = start_period + months
+
+    ref, t_loop = timed(loop_amortization, principals, monthly_rates, terms, start_period, end_period)
+    res64, t_64 = timed(compute_amortization, principals, monthly_rates, terms, start_period, end_period)
+    res32, t_32 = timed(compute_amortization, principals, monthly_rates, terms, start_period, end_period,
+                        dtype=np.float32)
+    err = np.abs(res64 - ref).max()
+    dense_mb = (ref.nbytes / 2 ** 20, res32.nbytes / 2 ** 20)
+    del ref, res64, res32
+
+    rng = np.random.default_rng(1)
+    # performance rows come clustered by loan
+    loan_index = np.sort(rng.integers(0, num_loans, num_loans * pairs_per_loan))
+    ages = rng.integers(start_period, end_period, len(loan_index))
+    pairs, t_pairs = timed(compute_amortization_at, principals, monthly_rates, terms, ages,
+                           loan_index=loan_index, dtype=np.float32)
+
+    print(f"loans={num_loans:>9,} months={months:>3} start={start_period:>3} | "
+          f"loop {t_loop:7.2f}s | closed f64 {t_64:6.2f}s ({t_loop / t_64:5.1f}x) | "
+          f"closed f32 {t_32:6.2f}s ({t_loop / t_32:5.1f}x) | "
+          f"pairs f32 {t_pairs:6.2f}s ({t_loop / t_pairs:5.1f}x) | max abs err {err:.2e} | "
+          f"MB loop {dense_mb[0]:,.0f} / f32 {dense_mb[1]:,.0f} / pairs {pairs.nbytes / 2 ** 20:,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--loans", type=int, nargs="+", default=[1000000, 5000000])
+    parser.add_argument("--months", type=int, default=60)
+    parser.add_argument("--start-period", type=int, default=0)
+    parser.add_argument("--pairs-per-loan", type=int, default=24)
+    parser.add_argument("--path", action="store_true", help="benchmark the rate-path engine")
+    args = parser.parse_args()
+    for num_loans in args.loans:
+        if args.path:
+            run_path(num_loans, args.months)
+        else:
+            run(num_loans, args.months, args.start_period, args.pairs_per_loan)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+'''
+Benchmark of the pandas and pyarrow CSV engines on a synthetic Performance file.
+
+    python -m benchmarks.bench_csv_engines --folder /tmp/fnma --performance-gb 2
+
+The file is generated once into folder. By default the file is streamed in chunks so that a
+multi-GB file fits in memory; --in-memory reads it whole through read_data_performance.
+'''
+import argparse
+import os
+import time
+
+from benchmarks.synthetic import loans_for_size, write_vintage
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--acq", default="2000Q1")
+    parser.add_argument("--performance-gb", type=float, default=2.0)
+    parser.add_argument("--engines", nargs="+", default=["pandas", "pyarrow"])
+    parser.add_argument("--chunksize", type=int, default=1000000)
+    parser.add_argument("--in-memory", action="store_true")
+    parser.add_argument("--project", action="store_true", help="skip the schema 'drop' columns at parse time")
+    args = parser.parse_args()
+
+    performance_file = os.path.join(args.folder, "Performance_" + args.acq + ".txt")
+    if not os.path.exists(performance_file):
+        write_vintage(args.folder, args.acq, loans_for_size(args.performance_gb))
+    size_mb = os.path.getsize(performance_file) / 2 ** 20
+
+    fnma = PUBLIC_LOAN_FNMA(args.acq, performance_file=performance_file)
+    for engine in args.engines:
+        ts = time.perf_counter()
+        if args.in_memory:
+            fnma.read_data_performance(engine=engine, fill_upb=False, project=args.project)
+            rows = len(fnma.Performance_Data)
+            fnma.Performance_Data = None
+        else:
+            rows = 0
+            columns = PUBLIC_LOAN_FNMA.selectColumns(fnma._PerformanceSchema, args.project)
+            for df in fnma.read_csv(performance_file, fnma._PerformanceSchema, engine=engine,
+                                    chunksize=args.chunksize, columns=columns):
+                df = PUBLIC_LOAN_FNMA.fill_defaults(df, fnma._PerformanceSchema)
+                rows = rows + len(df)
+        seconds = time.perf_counter() - ts
+        print(f"{engine:>8}: {size_mb:,.0f} MB, {rows:,} rows in {seconds:7.2f}s | "
+              f"{rows / seconds:12,.0f} rows/sec | {size_mb / seconds:7.1f} MB/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+'''
+Import time of the core modules and of the backends, each in a fresh interpreter.
+
+    python -m benchmarks.bench_import --repeat 5 --check
+
+The core (src.schema, src.utilities) must not import pandas, pyarrow, pyspark or sqlalchemy;
+with --check the run fails when it does or when its median import time exceeds --max-core-ms.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+CORE = ["src.schema", "src.utilities"]
+BACKENDS = ["src.public_loan_fnma", "src.public_loan_fnma_spark"]
+HEAVY = ["pandas", "pyarrow", "pyspark", "sqlalchemy"]
+
+_PROBE = '''
+import json, sys, time
+ts = time.perf_counter()
+try:
+    import {0}
+    error = None
+except ImportError as e:
+    error = str(e)
+seconds = time.perf_counter() - ts
+print(json.dumps({{"seconds": seconds, "error": error, "heavy": [m for m in {1!r} if m in sys.modules]}}))
+'''
+
+
+def import_time(module, repeat=5):
+    '''median seconds to import module in a fresh interpreter, the heavy modules it loaded and the import error'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(module, HEAVY)], env=env, cwd=root,
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.splitlines()[-1]))
+    seconds = sorted(r["seconds"] for r in runs)[len(runs) // 2]
+    return seconds, runs[-1]["heavy"], runs[-1]["error"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-core-ms", type=float, default=500.0)
+    parser.add_argument("--check", action="store_true", help="exit 1 when the core imports a heavy module or is too slow")
+    args = parser.parse_args()
+
+    failures = []
+    for module in CORE + BACKENDS:
+        seconds, heavy, error = import_time(module, args.repeat)
+        status = "not importable: " + error if error else "loads " + (", ".join(heavy) or "no heavy module")
+        print(f"{module:28s} {seconds * 1000:8.1f} ms | {status}")
+        if module in CORE:
+            if error or heavy:
+                failures.append(f"{module}: {error or ', '.join(heavy)}")
+            elif seconds * 1000 > args.max_core_ms:
+                failures.append(f"{module}: {seconds * 1000:.0f} ms > {args.max_core_ms:.0f} ms")
+    if failures:
+        print("core import check failed: " + "; ".join(failures))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
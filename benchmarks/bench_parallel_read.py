@@ -0,0 +1,46 @@
+'''
+Scaling of the parallel byte-range parsing of one Performance file.
+
+    python -m benchmarks.bench_parallel_read --folder /tmp/fnma --performance-gb 2 --workers 1 2 4 8
+
+The file is generated once into folder and read with read_data_performance for every worker
+count (1 is the serial reader); the speedup is relative to the serial reader.
+'''
+import argparse
+import os
+import time
+
+from benchmarks.synthetic import loans_for_size, write_vintage
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--acq", default="2000Q1")
+    parser.add_argument("--performance-gb", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--engine", choices=["pandas", "pyarrow"], default="pandas")
+    parser.add_argument("--project", action="store_true", help="skip the schema 'drop' columns at parse time")
+    args = parser.parse_args()
+
+    performance_file = os.path.join(args.folder, "Performance_" + args.acq + ".txt")
+    if not os.path.exists(performance_file):
+        write_vintage(args.folder, args.acq, loans_for_size(args.performance_gb))
+    size_mb = os.path.getsize(performance_file) / 2 ** 20
+
+    fnma = PUBLIC_LOAN_FNMA(args.acq, performance_file=performance_file)
+    serial = None
+    for workers in sorted(set(args.workers)):
+        ts = time.perf_counter()
+        fnma.read_data_performance(engine=args.engine, fill_upb=False, project=args.project, workers=workers)
+        seconds = time.perf_counter() - ts
+        rows = len(fnma.Performance_Data)
+        fnma.Performance_Data = None
+        serial = serial or seconds
+        print(f"{workers:3d} workers: {size_mb:,.0f} MB, {rows:,} rows in {seconds:7.2f}s | "
+              f"{rows / seconds:12,.0f} rows/sec | speedup {serial / seconds:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''
+Stages and shuffles of the Spark read_data_performance, window pipeline against the fused pass.
+
+    python -m benchmarks.bench_spark_stages --folder /tmp/fnma --loans 20000
+
+Runs pyspark in local mode on a synthetic vintage. For each variant the loan-level and
+performance outputs are written to the "noop" sink; the number of Exchange (shuffle) nodes of
+the executed plans and the number of stages Spark ran are printed with the wall time.
+'''
+import argparse
+import os
+import re
+import time
+
+from pyspark.sql import SparkSession
+
+from benchmarks.synthetic import write_vintage
+from src.public_loan_fnma_spark import PUBLIC_LOAN_FNMA_spark
+
+
+def count_exchanges(df):
+    '''shuffle exchanges of the executed plan of df'''
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    return len(re.findall(r"Exchange (hashpartitioning|rangepartitioning|RoundRobinPartitioning|SinglePartition)", plan))
+
+
+def count_stages(spark, group):
+    tracker = spark.sparkContext.statusTracker()
+    stages = 0
+    for job_id in tracker.getJobIdsForGroup(group):
+        job = tracker.getJobInfo(job_id)
+        if job is not None:
+            stages = stages + len(job.stageIds)
+    return stages
+
+
+def run_variant(spark, folder, acq, fused, sort_output):
+    fnma = PUBLIC_LOAN_FNMA_spark(acq, acquisition_file=os.path.join(folder, "Acquisition_" + acq + ".txt"),
+                                  performance_file=os.path.join(folder, "Performance_" + acq + ".txt"))
+    fnma.read_data_acquisition(spark)
+    fnma.read_data_performance(spark, fused=fused, sort_output=sort_output)
+
+    group = "fused" if fused else "window"
+    group = group + ("-sorted" if sort_output else "")
+    spark.sparkContext.setJobGroup(group, group)
+    ts = time.perf_counter()
+    fnma.Loan_Data.write.format("noop").mode("overwrite").save()
+    fnma.Performance_Data.write.format("noop").mode("overwrite").save()
+    seconds = time.perf_counter() - ts
+    print(f"{group:>14}: {count_exchanges(fnma.Loan_Data):3d} exchanges (Loan_Data), "
+          f"{count_exchanges(fnma.Performance_Data):3d} exchanges (Performance_Data), "
+          f"{count_stages(spark, group):3d} stages, {seconds:8.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--acq", default="2000Q1")
+    parser.add_argument("--loans", type=int, default=20000)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--shuffle-partitions", type=int, default=8)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.folder, "Performance_" + args.acq + ".txt")):
+        write_vintage(args.folder, args.acq, args.loans)
+
+    spark = SparkSession.builder.master(args.master).appName("bench_spark_stages") \
+                        .config("spark.sql.shuffle.partitions", args.shuffle_partitions) \
+                        .config("spark.sql.adaptive.enabled", "false") \
+                        .getOrCreate()
+    for fused in (False, True):
+        for sort_output in (True, False):
+            run_variant(spark, args.folder, args.acq, fused, sort_output)
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
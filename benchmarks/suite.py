@@ -0,0 +1,307 @@
+'''
+Stage benchmarks of the pandas and local-Spark backends on a synthetic vintage.
+
+    python -m benchmarks.suite --folder /tmp/fnma --loans 200000 --backends pandas spark
+    python -m benchmarks.suite --folder /tmp/fnma --performance-gb 1 --dlq-rate 0.06 --term-mix 180=0.5 360=0.5
+
+The vintage is generated into folder/input (reused when present with the same options). Every
+stage (read, default_fill, schd_upb, features, parquet_write) is timed with its throughput, the
+peak RSS of the process and its children (the Spark JVM) while it ran, and the size of what it
+wrote. Each run is appended to a JSON history (folder/history.json by default) and compared with
+the last run of the same backend and options, so that regressions are visible.
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import threading
+import time
+
+from benchmarks.synthetic import loans_for_size, write_vintage
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+STAGES = ["read", "default_fill", "schd_upb", "features", "parquet_write"]
+# a stage slower than the previous run by more than this ratio is flagged
+REGRESSION_RATIO = 1.2
+
+
+def _children(pid):
+    children = []
+    try:
+        for tid in os.listdir("/proc/%d/task" % pid):
+            with open("/proc/%d/task/%s/children" % (pid, tid)) as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _rss_bytes(pid):
+    try:
+        with open("/proc/%d/statm" % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return 0
+
+
+def tree_rss(pid=None):
+    '''resident bytes of pid (default this process) and all its descendants, from /proc'''
+    pids = [os.getpid() if pid is None else pid]
+    total = 0
+    while pids:
+        p = pids.pop()
+        total = total + _rss_bytes(p)
+        pids.extend(_children(p))
+    return total
+
+
+class PeakRSS(object):
+    '''
+    peak resident bytes of the process tree while the with-block runs, sampled every interval seconds
+
+    Without /proc the lifetime maximum of getrusage is reported instead.
+    '''
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.exists("/proc/self/statm"):
+            self.peak = tree_rss()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, tree_rss())
+        else:
+            # ru_maxrss is in KiB on Linux, bytes on macOS
+            scale = 1 if platform.system() == "Darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        return False
+
+
+def folder_bytes(path):
+    '''bytes of the files under path (a file or a folder), 0 when missing'''
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class StageTimer(object):
+    '''the stage records of one backend run'''
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, rows=None, output=None):
+        '''
+        time fn() as stage name
+
+        rows : int or callable returning the rows processed, for the throughput
+        output : path whose size is recorded after the stage
+        '''
+        with PeakRSS() as rss:
+            ts = time.perf_counter()
+            result = fn()
+            seconds = time.perf_counter() - ts
+        rows = rows() if callable(rows) else rows
+        record = {"seconds": seconds, "peak_rss_mb": rss.peak / 2 ** 20}
+        if rows is not None:
+            record.update(rows=int(rows), rows_per_sec=rows / seconds if seconds > 0 else float("nan"))
+        if output is not None:
+            record["output_mb"] = folder_bytes(output) / 2 ** 20
+        self.stages[name] = record
+        return result
+
+
+def run_pandas(vintage, output, engine="pandas"):
+    '''the stages of the pandas backend, as in read_data_acquisition / read_data_performance(features=True)'''
+    timer = StageTimer()
+    fnma = PUBLIC_LOAN_FNMA(vintage["acq"], acquisition_file=vintage["acquisition_file"],
+                            performance_file=vintage["performance_file"])
+    schema = PUBLIC_LOAN_FNMA._PerformanceSchema
+
+    def read():
+        fnma.Loan_Data = fnma.read_csv(fnma.acquisition_file, fnma._AcquisitionSchema, engine=engine)
+        fnma.Performance_Data = fnma.read_csv(fnma.performance_file, schema, engine=engine)
+
+    def default_fill():
+        fnma.Loan_Data["OCLTV"] = fnma.Loan_Data["OCLTV"].fillna(fnma.Loan_Data["OLTV"])
+        fnma.Performance_Data = PUBLIC_LOAN_FNMA.fill_defaults(fnma.Performance_Data, schema)
+
+    timer.run("read", read, rows=lambda: len(fnma.Performance_Data))
+    rows = len(fnma.Performance_Data)
+    timer.run("default_fill", default_fill, rows=rows)
+    # the scheduled UPB is evaluated for the rows with a missing LAST_UPB
+    missing = int(fnma.Performance_Data["LAST_UPB"].isna().sum())
+    timer.run("schd_upb", fnma.fill_last_upb, rows=missing)
+    timer.run("features", fnma.derive_features, rows=rows)
+    timer.run("parquet_write", lambda: fnma.save_as_parquet(output), rows=rows,
+              output=os.path.join(output, "output", "FNMA"))
+    return timer.stages
+
+
+def run_spark(vintage, output, master="local[*]", shuffle_partitions=8):
+    '''the stages of the Spark backend in a local session; each stage is forced with a noop write'''
+    from pyspark.sql import SparkSession
+    from src.public_loan_fnma_spark import PUBLIC_LOAN_FNMA_spark
+
+    spark = SparkSession.builder.master(master).appName("benchmarks.suite") \
+                        .config("spark.sql.shuffle.partitions", shuffle_partitions) \
+                        .getOrCreate()
+    timer = StageTimer()
+    fnma = PUBLIC_LOAN_FNMA_spark(vintage["acq"], acquisition_file=vintage["acquisition_file"],
+                                  performance_file=vintage["performance_file"])
+
+    def noop(df):
+        df.write.format("noop").mode("overwrite").save()
+
+    try:
+        rows = timer.run("read", lambda: fnma.read_performance_frame(spark).count())
+        timer.stages["read"].update(rows=rows, rows_per_sec=rows / timer.stages["read"]["seconds"])
+        # the schema defaults are filled while reading the acquisition file
+        timer.run("default_fill", lambda: (fnma.read_data_acquisition(spark), noop(fnma.Loan_Data)))
+        max_term = fnma.Loan_Data.agg({"ORIG_TRM": "max"}).collect()[0][0]
+        timer.run("schd_upb", lambda: noop(fnma.compute_schd_upb(max_term, outAsMatrix=False)))
+        timer.run("features", lambda: (fnma.read_data_performance(spark), noop(fnma.Loan_Data)), rows=rows)
+        timer.run("parquet_write", lambda: fnma.save_as_parquet(output), rows=rows,
+                  output=os.path.join(output, "output", "FNMA"))
+    finally:
+        spark.stop()
+    return timer.stages
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def prepare_vintage(folder, acq, num_loans, term_mix=None, **rates):
+    '''the synthetic vintage of folder/input, regenerated when its options changed'''
+    input_folder = os.path.join(folder, "input")
+    # as read back from JSON (term keys become strings)
+    options = json.loads(json.dumps({"acq": acq, "loans": num_loans, "term_mix": term_mix, "rates": rates}))
+    options_file = os.path.join(input_folder, "options.json")
+    acquisition_file = os.path.join(input_folder, "Acquisition_" + acq + ".txt")
+    performance_file = os.path.join(input_folder, "Performance_" + acq + ".txt")
+    current = None
+    if os.path.exists(options_file) and os.path.exists(performance_file):
+        with open(options_file) as f:
+            current = json.load(f)
+    if current != options:
+        if os.path.isdir(input_folder):
+            shutil.rmtree(input_folder)
+        write_vintage(input_folder, acq, num_loans, term_mix=term_mix, **rates)
+        with open(options_file, "w") as f:
+            json.dump(options, f)
+    return {"acq": acq, "acquisition_file": acquisition_file, "performance_file": performance_file,
+            "options": options, "input_mb": folder_bytes(performance_file) / 2 ** 20}
+
+
+def append_history(path, record):
+    '''append record to the JSON list at path, returns the previous run of the same backend and options'''
+    history = []
+    if os.path.exists(path):
+        with open(path) as f:
+            history = json.load(f)
+    previous = None
+    for entry in reversed(history):
+        if entry["backend"] == record["backend"] and entry["options"] == record["options"]:
+            previous = entry
+            break
+    history.append(record)
+    tmp = path + ".tmp." + str(os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+    return previous
+
+
+def report(record, previous=None):
+    print(f"{record['backend']} @ {record['commit']}: {record['options']['loans']:,} loans, "
+          f"{record['input_mb']:,.1f} MB of Performance data")
+    for name in STAGES:
+        stage = record["stages"].get(name)
+        if stage is None:
+            continue
+        line = f"  {name:>14}: {stage['seconds']:8.2f}s | peak RSS {stage['peak_rss_mb']:8,.0f} MB"
+        if "rows_per_sec" in stage:
+            line = line + f" | {stage['rows_per_sec']:12,.0f} rows/sec"
+        if "output_mb" in stage:
+            line = line + f" | output {stage['output_mb']:8,.1f} MB"
+        before = None if previous is None else previous["stages"].get(name)
+        if before is not None and before["seconds"] > 0:
+            ratio = stage["seconds"] / before["seconds"]
+            line = line + f" | {ratio:5.2f}x previous" + ("  REGRESSION" if ratio > REGRESSION_RATIO else "")
+        print(line)
+
+
+def _term_mix(values):
+    if not values:
+        return None
+    return {int(k): float(v) for k, v in (x.split("=") for x in values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", required=True, help="work folder: input/, output/ and history.json")
+    parser.add_argument("--acq", default="2000Q1")
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--performance-gb", type=float, default=None,
+                        help="size the vintage to about this many GB of Performance data")
+    parser.add_argument("--term-mix", nargs="+", default=None, help="term=share pairs, e.g. 180=0.2 360=0.8")
+    parser.add_argument("--dlq-rate", type=float, default=0.03)
+    parser.add_argument("--prepay-rate", type=float, default=0.015)
+    parser.add_argument("--default-rate", type=float, default=0.002)
+    parser.add_argument("--mod-rate", type=float, default=0.05)
+    parser.add_argument("--null-rate", type=float, default=0.01)
+    parser.add_argument("--backends", nargs="+", choices=["pandas", "spark"], default=["pandas"])
+    parser.add_argument("--engine", choices=["pandas", "pyarrow"], default="pandas", help="CSV engine of the pandas backend")
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--history", default=None, help="JSON history, default to folder/history.json")
+    args = parser.parse_args()
+
+    num_loans = args.loans if args.performance_gb is None else loans_for_size(args.performance_gb)
+    vintage = prepare_vintage(args.folder, args.acq, num_loans, term_mix=_term_mix(args.term_mix),
+                              dlq_rate=args.dlq_rate, prepay_rate=args.prepay_rate,
+                              default_rate=args.default_rate, mod_rate=args.mod_rate, null_rate=args.null_rate)
+    history = args.history or os.path.join(args.folder, "history.json")
+
+    for backend in args.backends:
+        output = os.path.join(args.folder, "output_" + backend)
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        os.makedirs(output)
+        if backend == "pandas":
+            stages = run_pandas(vintage, output, engine=args.engine)
+            options = dict(vintage["options"], engine=args.engine)
+        else:
+            stages = run_spark(vintage, output, master=args.master)
+            options = dict(vintage["options"], master=args.master)
+        record = {"backend": backend, "commit": _git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  "host": platform.node(), "cpus": os.cpu_count(), "options": options,
+                  "input_mb": vintage["input_mb"], "stages": stages}
+        report(record, append_history(history, record))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+'''
+Synthetic FNMA Acquisition/Performance files in the public pipe-delimited layout.
+
+    python -m benchmarks.synthetic --folder /tmp/fnma --acq 2000Q1 --loans 100000
+    python -m benchmarks.synthetic --folder /tmp/fnma --acq 2000Q1 --performance-gb 2
+'''
+import argparse
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+# average bytes of one Performance row written by this generator
+PERFORMANCE_ROW_BYTES = 95
+# average rows per loan with the default rates and max_age
+PERFORMANCE_ROWS_PER_LOAN = 44
+
+
+def _month_string(month_index, with_day=False, valid=None):
+    '''month index (year * 12 + month - 1) to "MM/YYYY" or "MM/01/YYYY", null where not valid'''
+    months, inverse = np.unique(month_index, return_inverse=True)
+    sep = "/01/" if with_day else "/"
+    labels = pa.array([f"{m % 12 + 1:02d}{sep}{m // 12}" for m in months])
+    indices = pa.array(inverse.astype(np.int32), mask=None if valid is None else ~np.asarray(valid))
+    return pc.take(labels, indices)
+
+
+def _choice(rng, values, size, p=None):
+    return pc.take(pa.array(values), pa.array(rng.choice(len(values), size, p=p).astype(np.int32)))
+
+
+def _nullable(values, missing, type=None):
+    return pa.array(values, type=type, mask=np.asarray(missing))
+
+
+# share of the 180/240/360 month terms
+TERM_MIX = {180: 0.2, 240: 0.05, 360: 0.75}
+
+
+def generate_acquisition(acqYYYYQQ, num_loans, first_loan_id=100000000000, null_rate=0.01, term_mix=None, seed=0):
+    '''
+    Acquisition rows for one vintage as an Arrow table with the _AcquisitionSchema columns
+
+    term_mix : dict term -> share, default TERM_MIX
+    '''
+    rng = np.random.default_rng(seed)
+    year, quarter = int(acqYYYYQQ[:4]), int(acqYYYYQQ[-1])
+    orig_month = year * 12 + (quarter - 1) * 3 - rng.integers(1, 4, num_loans)
+    term_mix = TERM_MIX if term_mix is None else term_mix
+    shares = np.asarray(list(term_mix.values()), dtype=float)
+    terms = rng.choice(np.asarray(list(term_mix.keys())), num_loans, p=shares / shares.sum())
+    oltv = rng.integers(30, 98, num_loans)
+    high_ltv = oltv > 80
+
+    columns = {
+        "LOAN_ID":        pa.array(np.arange(first_loan_id, first_loan_id + num_loans).astype(str)),
+        "ORIG_CHN":       _choice(rng, ["R", "B", "C"], num_loans, p=[0.6, 0.2, 0.2]),
+        "SellerName":     _choice(rng, ["BANK OF AMERICA, N.A.", "WELLS FARGO BANK, N.A.", "OTHER"], num_loans),
+        "ORIG_RT":        pa.array(rng.uniform(2.75, 8.5, num_loans).round(3)),
+        "ORIG_AMT":       pa.array(rng.integers(40, 800, num_loans) * 1000),
+        "ORIG_TRM":       pa.array(terms),
+        "ORIG_DTE":       _month_string(orig_month),
+        "FRST_DTE":       _month_string(orig_month + 2),
+        "OLTV":           pa.array(oltv),
+        "OCLTV":          _nullable(oltv + rng.integers(0, 5, num_loans), rng.random(num_loans) < 0.3),
+        "NUM_BO":         _nullable(rng.integers(1, 3, num_loans), rng.random(num_loans) < null_rate),
+        "DTI":            _nullable(rng.integers(5, 64, num_loans), rng.random(num_loans) < 2 * null_rate),
+        "CSCORE_B":       _nullable(rng.integers(580, 830, num_loans), rng.random(num_loans) < null_rate),
+        "FTHB_FLG":       _choice(rng, ["Y", "N"], num_loans, p=[0.15, 0.85]),
+        "PURPOSE":        _choice(rng, ["P", "C", "R", "U"], num_loans),
+        "PROP_TYP":       _choice(rng, ["SF", "PU", "CO", "MH", "CP"], num_loans, p=[0.7, 0.15, 0.1, 0.03, 0.02]),
+        "NUM_UNIT":       _choice(rng, [1, 2, 3, 4], num_loans, p=[0.95, 0.03, 0.01, 0.01]),
+        "OCC_STAT":       _choice(rng, ["P", "S", "I"], num_loans, p=[0.88, 0.04, 0.08]),
+        "STATE":          _choice(rng, ["CA", "TX", "FL", "NY", "IL", "GA", "WA", "PA", "OH", "NJ"], num_loans),
+        "ZIP_3":          pa.array(rng.integers(100, 999, num_loans).astype(str)),
+        "MI_PCT":         _nullable(rng.choice([12, 25, 30], num_loans), ~high_ltv),
+        "Product_Type":   pa.array(np.full(num_loans, "FRM")),
+        "CSCORE_C":       _nullable(rng.integers(580, 830, num_loans), rng.random(num_loans) < 0.5),
+        "MI_TYPE":        _nullable(np.full(num_loans, "1"), ~high_ltv),
+        "RELOCATION_FLG": pa.array(np.full(num_loans, "N")),
+    }
+    return pa.table(columns)
+
+
+def generate_performance(acq_table, last_month=None, max_age=80, dlq_rate=0.03, cure_rate=0.4,
+                         prepay_rate=0.015, default_rate=0.002, mod_rate=0.05, null_rate=0.01, seed=0):
+    '''
+    Monthly Performance rows for the loans of generate_acquisition, sorted by LOAN_ID and ACT_DTE.
+
+    Each loan is observed from age 0 until it pays off, defaults, reaches max_age or last_month
+    (a month index, year * 12 + month - 1). Delinquency follows a simple roll/cure chain, loans
+    90+ days delinquent are modified with probability mod_rate and keep MOD_FLAG "Y" afterwards,
+    and LAST_UPB is blank for the first 6 months as in the public files.
+    '''
+    rng = np.random.default_rng(seed)
+    num_loans = acq_table.num_rows
+    frst_dte = acq_table["FRST_DTE"]
+    first_month = (pc.cast(pc.utf8_slice_codeunits(frst_dte, 3, 7), pa.int64()).to_numpy() * 12 +
+                   pc.cast(pc.utf8_slice_codeunits(frst_dte, 0, 2), pa.int64()).to_numpy() - 1)
+    terms = acq_table["ORIG_TRM"].to_numpy()
+    amounts = acq_table["ORIG_AMT"].to_numpy().astype(float)
+    rates = acq_table["ORIG_RT"].to_numpy()
+
+    # months until the loan leaves the pool, by prepayment or default
+    life = np.minimum(rng.geometric(prepay_rate + default_rate, num_loans), max_age)
+    if last_month is not None:
+        life = np.clip(np.minimum(life, last_month - first_month + 1), 1, None)
+    defaulted = rng.random(num_loans) < default_rate / (prepay_rate + default_rate)
+    censored = life == max_age
+    if last_month is not None:
+        censored = censored | (first_month + life - 1 >= last_month)
+
+    starts = np.cumsum(life) - life
+    loan_pos = np.repeat(np.arange(num_loans), life)
+    num_rows = len(loan_pos)
+    age = np.arange(num_rows) - starts[loan_pos]
+    is_last = age == life[loan_pos] - 1
+    act_month = first_month[loan_pos] + age
+
+    # delinquency chain: each month either rolls forward, cures to current or stays
+    dlq = np.zeros(num_rows, dtype=np.int16)
+    roll = rng.random(num_rows)
+    for a in range(1, int(age.max(initial=0)) + 1):
+        cur = np.flatnonzero(age == a)
+        prev = dlq[cur - 1]
+        dlq[cur] = np.where(prev == 0, (roll[cur] < dlq_rate).astype(np.int16),
+                            np.where(roll[cur] < cure_rate, 0, prev + 1))
+    terminal_default = is_last & defaulted[loan_pos] & ~censored[loan_pos]
+    dlq[terminal_default] = np.maximum(dlq[terminal_default], 4)
+
+    modified = (dlq >= 3) & (rng.random(num_rows) < mod_rate)
+    last_mod = np.maximum.accumulate(np.where(modified, np.arange(num_rows), -1))
+    mod_flag = np.where(last_mod >= starts[loan_pos], "Y", "N")
+
+    growth = 1 + rates[loan_pos] / 1200
+    growth_n = growth ** terms[loan_pos]
+    upb = (amounts[loan_pos] * (growth_n - growth ** (age + 1)) / (growth_n - 1)).round(2)
+
+    has_zb = is_last & ~censored[loan_pos]
+    zb_code = np.where(defaulted[loan_pos], "09", "01")
+    has_cost = has_zb & defaulted[loan_pos]
+    cost = (upb * 0.05).round(2)
+    dlq_null = rng.random(num_rows) < null_rate
+    dlq_x = rng.random(num_rows) < null_rate / 10
+    blank = pa.nulls(num_rows, pa.string())
+
+    columns = {
+        "LOAN_ID":             pc.take(acq_table["LOAN_ID"], pa.array(loan_pos)),
+        "ACT_DTE":             _month_string(act_month, with_day=True),
+        "SERVICER":            pa.array(np.full(num_rows, "OTHER")),
+        "LAST_RT":             pa.array(rates[loan_pos]),
+        "LAST_UPB":            _nullable(upb, age < 6),
+        "LOAN_AGE":            pa.array(age),
+        "Months_To_Legal_Mat": pa.array(terms[loan_pos] - age),
+        "Adj_Month_To_Mat":    _nullable(terms[loan_pos] - age, age < 6),
+        "Maturity_Date":       _month_string(first_month[loan_pos] + terms[loan_pos] - 1),
+        "MSA":                 pa.array(np.zeros(num_rows, dtype=np.int32)),
+        "DLQ_STATUS":          _nullable(np.where(dlq_x, "X", dlq.astype(str)), dlq_null),
+        "MOD_FLAG":            pa.array(mod_flag),
+        "ZB_CODE":             _nullable(zb_code, ~has_zb),
+        "ZB_DTE":              _month_string(act_month, valid=has_zb),
+        "LPI_DTE":             _month_string(act_month - 6, with_day=True, valid=has_cost),
+        "FCC_DTE":             _month_string(act_month - 2, with_day=True, valid=has_cost),
+        "DISP_DTE":            _month_string(act_month, with_day=True, valid=has_cost),
+        "FCC_COST":            _nullable(cost, ~has_cost),
+        "PP_COST":             _nullable(cost, ~has_cost),
+        "AR_COST":             blank,
+        "IE_COST":             blank,
+        "TAX_COST":            _nullable(cost, ~has_cost),
+        "NS_PROCS":            _nullable((upb * 0.7).round(2), ~has_cost),
+        "CE_PROCS":            blank,
+        "RMW_PROCS":           blank,
+        "O_PROCS":             blank,
+        "NON_INT_UPB":         blank,
+        "PRIN_FORG_UPB_FHFA":  blank,
+        "REPCH_FLAG":          _nullable(np.full(num_rows, "N"), ~has_zb),
+        "PRIN_FORG_UPB_OTH":   blank,
+        "TRANSFER_FLG":        pa.array(np.full(num_rows, "N")),
+    }
+    assert list(columns) == list(PUBLIC_LOAN_FNMA._PerformanceSchema.keys())
+    return pa.table(columns)
+
+
+def write_table(table, path, append=False):
+    '''write an Arrow table as a headerless pipe-delimited file, nulls as empty fields'''
+    options = pacsv.WriteOptions(include_header=False, delimiter="|", quoting_style="none")
+    with open(path, "ab" if append else "wb") as f:
+        pacsv.write_csv(table, f, write_options=options)
+
+
+def write_vintage(folder, acqYYYYQQ, num_loans, loans_per_block=200000, seed=0, term_mix=None, **kwargs):
+    '''
+    write Acquisition_<acqYYYYQQ>.txt and Performance_<acqYYYYQQ>.txt into folder, a block of loans at a time
+
+    term_mix and the null_rate of kwargs go to generate_acquisition, kwargs to generate_performance.
+    Returns the two file paths.
+    '''
+    os.makedirs(folder, exist_ok=True)
+    acquisition_file = os.path.join(folder, "Acquisition_" + acqYYYYQQ + ".txt")
+    performance_file = os.path.join(folder, "Performance_" + acqYYYYQQ + ".txt")
+    first_loan_id = 100000000000 + int(acqYYYYQQ[:4] + acqYYYYQQ[-1]) * 10000000
+    for block, start in enumerate(range(0, num_loans, loans_per_block)):
+        count = min(loans_per_block, num_loans - start)
+        acq_table = generate_acquisition(acqYYYYQQ, count, first_loan_id + start, seed=seed + block,
+                                         null_rate=kwargs.get("null_rate", 0.01), term_mix=term_mix)
+        per_table = generate_performance(acq_table, seed=seed + block, **kwargs)
+        write_table(acq_table, acquisition_file, append=block > 0)
+        write_table(per_table, performance_file, append=block > 0)
+    return acquisition_file, performance_file
+
+
+def loans_for_size(performance_gb):
+    '''approximate loan count giving a Performance file of performance_gb'''
+    return max(1, int(performance_gb * 2 ** 30 / (PERFORMANCE_ROW_BYTES * PERFORMANCE_ROWS_PER_LOAN)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder", required=True)
+    parser.add_argument("--acq", default="2000Q1")
+    parser.add_argument("--loans", type=int, default=100000)
+    parser.add_argument("--performance-gb", type=float, default=None,
+                        help="size the vintage to about this many GB of Performance data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    num_loans = args.loans if args.performance_gb is None else loans_for_size(args.performance_gb)
+    for path in write_vintage(args.folder, args.acq, num_loans, seed=args.seed):
+        print(path, f"{os.path.getsize(path) / 2 ** 20:,.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
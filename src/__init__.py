@@ -1 +1,24 @@
+'''
+Public loan data of the agencies.
 
+The schemas (src.schema) and the amortization (src.utilities) only need numpy. The backends are
+imported on first use, so `from src import PUBLIC_LOAN_FNMA` loads pandas and pyarrow and
+`from src import PUBLIC_LOAN_FNMA_spark` pyspark, when they are asked for only.
+'''
+import importlib
+
+
+# name -> module of the backends, imported by __getattr__
+_BACKENDS = {"PUBLIC_LOAN_FNMA": "src.public_loan_fnma",
+             "PUBLIC_LOAN_FRED": "src.public_loan_fred",
+             "PUBLIC_LOAN_FNMA_spark": "src.public_loan_fnma_spark"}
+
+
+def __getattr__(name):
+    if name in _BACKENDS:
+        return getattr(importlib.import_module(_BACKENDS[name]), name)
+    raise AttributeError("module 'src' has no attribute '{0}'".format(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_BACKENDS))
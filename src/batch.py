@@ -0,0 +1,225 @@
+'''
+Batch processing of many FNMA vintages.
+
+    python -m src.batch --input /data/fnma --output /data/out --workers 4 --memory-gb 16
+
+The Acquisition_<YYYYQn>.txt / Performance_<YYYYQn>.txt pairs of a folder are processed in a
+process pool, largest vintage first, while the estimated memory of the running vintages stays
+within the budget. Every vintage is written to the ACQ=<YYYYQn> partitions of
+output/FNMA/Loan.parquet and output/FNMA/LoanPerformance.parquet under the output folder.
+'''
+import argparse
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from src import metrics
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+from src.shared_store import VintageStore
+from src.utilities import showtime
+
+
+_VINTAGE_FILE = re.compile(r"^Acquisition_(\d{4}Q[1-4])\.txt$")
+
+# rough peak bytes in memory per byte of Performance file when a vintage is processed in memory
+# (parsed frame, features and the Arrow copy on write), and per streamed row
+IN_MEMORY_FACTOR = 4.0
+STREAM_ROW_BYTES = 600
+
+
+def discover_vintages(folder):
+    '''
+    Acquisition/Performance file pairs of folder, largest Performance file first
+
+    Returns
+    -------
+    out : list of dict with acq, acquisition_file, performance_file and bytes (size of the Performance file)
+    '''
+    vintages = []
+    for name in os.listdir(folder):
+        match = _VINTAGE_FILE.match(name)
+        if match is None:
+            continue
+        acq = match.group(1)
+        performance_file = os.path.join(folder, "Performance_" + acq + ".txt")
+        if not os.path.exists(performance_file):
+            print("discover_vintages: no performance file for " + acq)
+            continue
+        vintages.append({"acq": acq,
+                         "acquisition_file": os.path.join(folder, name),
+                         "performance_file": performance_file,
+                         "bytes": os.path.getsize(performance_file)})
+    vintages.sort(key=lambda v: (-v["bytes"], v["acq"]))
+    return vintages
+
+
+def estimate_memory(vintage, mode="stream", chunksize=500000):
+    '''estimated peak bytes of processing the vintage'''
+    acquisition_bytes = os.path.getsize(vintage["acquisition_file"]) * IN_MEMORY_FACTOR
+    if mode == "stream":
+        # one parsed chunk plus up to two buffered row groups of the same size
+        return acquisition_bytes + 3 * chunksize * STREAM_ROW_BYTES
+    return acquisition_bytes + vintage["bytes"] * IN_MEMORY_FACTOR
+
+
+def process_vintage(vintage, resultFolder, stageFolder=None, mode="stream", engine="pandas",
+                    chunksize=500000, project=False, partition_by_year=False, cubes=False, publish=None):
+    '''
+    process one vintage and write it to the ACQ= partitions of resultFolder
+
+    Parameters
+    ----------
+    vintage : dict from discover_vintages
+    mode : "stream" writes the performance rows chunk by chunk with read_data_performance_chunk
+           (bounded memory, no loan events); "memory" loads the vintage with the loan events and
+           the LAST_UPB backfill and writes it with save_as_parquet
+    engine, chunksize, project, partition_by_year : see read_data_performance_chunk
+    cubes : also write the pool cubes of the vintage (src.pool_cube), "memory" mode only
+    publish : folder of a src.shared_store.VintageStore the processed frames are also published
+              to ("" for the default folder), "memory" mode only
+
+    Returns
+    -------
+    out : dict with acq, loans, rows, seconds and rows_per_sec
+    '''
+    ts = time.time()
+    os.makedirs(resultFolder, exist_ok=True)
+    fnma = PUBLIC_LOAN_FNMA(vintage["acq"], stageFolder=stageFolder,
+                            acquisition_file=vintage["acquisition_file"],
+                            performance_file=vintage["performance_file"])
+    with metrics.stage("process_vintage", acq=vintage["acq"], mode=mode) as stage:
+        fnma.read_data_acquisition(engine=engine, project=project)
+        loans = len(fnma.Loan_Data)
+        if mode == "stream":
+            fnma.save_as_parquet(resultFolder, Performance_Data=False, raise_errors=True)
+            rows = fnma.read_data_performance_chunk(resultFolder=resultFolder, chunksize=chunksize,
+                                                    partition_by_year=partition_by_year, engine=engine,
+                                                    project=project)["rows"]
+        elif mode == "memory":
+            fnma.read_data_performance(engine=engine, project=project, features=True)
+            rows = len(fnma.Performance_Data)
+            fnma.save_as_parquet(resultFolder, raise_errors=True)
+            if cubes:
+                fnma.build_pool_cubes(resultFolder)
+            if publish is not None:
+                fnma.shared_store = VintageStore(publish or None)
+                fnma.publish()
+        else:
+            raise ValueError("unknown mode: " + str(mode))
+        stage.set(rows_out=rows, loans=loans)
+    seconds = time.time() - ts
+    return {"acq": vintage["acq"], "loans": loans, "rows": rows, "seconds": seconds,
+            "rows_per_sec": rows / seconds if seconds > 0 else float("nan")}
+
+
+def run_batch(folder, resultFolder, workers=None, memory_gb=None, mode="stream", acqs=None, **kwargs):
+    '''
+    process every vintage of folder in a process pool
+
+    Vintages are submitted largest first. A vintage only starts when its estimated memory fits
+    in memory_gb next to the running ones (one vintage always runs, whatever its estimate).
+
+    Parameters
+    ----------
+    folder : folder with the Acquisition_/Performance_ files
+    resultFolder : root of the output tree
+    workers : processes, default to the number of CPUs
+    memory_gb : memory budget, None for no limit
+    acqs : only these vintages, e.g. ["2000Q1", "2000Q2"]
+    kwargs : passed to process_vintage
+
+    Returns
+    -------
+    out : pandas dataframe indexed by acq with loans, rows, seconds, rows_per_sec, or error
+    '''
+    vintages = discover_vintages(folder)
+    if acqs is not None:
+        vintages = [v for v in vintages if v["acq"] in set(acqs)]
+    budget = None if memory_gb is None else memory_gb * 2 ** 30
+    os.makedirs(resultFolder, exist_ok=True)
+
+    ts = time.time()
+    report = []
+    pending = list(vintages)
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            in_use = sum(need for _, need in running.values())
+            limit = workers or os.cpu_count()
+            # largest first, skipping vintages that do not fit yet
+            for vintage in list(pending):
+                if len(running) >= limit:
+                    break
+                need = estimate_memory(vintage, mode, kwargs.get("chunksize", 500000))
+                if running and budget is not None and in_use + need > budget:
+                    continue
+                future = pool.submit(process_vintage, vintage, resultFolder, mode=mode, **kwargs)
+                running[future] = (vintage, need)
+                pending.remove(vintage)
+                in_use = in_use + need
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                vintage, _ = running.pop(future)
+                try:
+                    result = future.result()
+                    print(f"{result['acq']}: {result['rows']:,} rows, {result['loans']:,} loans in "
+                          f"{result['seconds']:.1f}s, {result['rows_per_sec']:,.0f} rows/sec")
+                except Exception as err:
+                    print("run_batch: {0} failed: {1}".format(vintage["acq"], err))
+                    result = {"acq": vintage["acq"], "error": str(err)}
+                report.append(result)
+
+    report = pd.DataFrame(report, columns=["acq", "loans", "rows", "seconds", "rows_per_sec", "error"])
+    report = report.set_index("acq").sort_index()
+    seconds = time.time() - ts
+    rows = report["rows"].sum()
+    print(f"run_batch: {len(report)} vintages, {rows:,.0f} rows in {showtime(ts)}, {rows / seconds:,.0f} rows/sec")
+    return report
+
+
+def enable_metrics(path):
+    '''JSON lines metrics to path, here and in the worker processes (src.metrics)'''
+    os.environ[metrics.ENV_VARIABLE] = path
+    metrics.enable(metrics.JsonLinesSink(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="folder with the Acquisition_/Performance_ files")
+    parser.add_argument("--output", required=True, help="root of the output tree")
+    parser.add_argument("--stage", default=None, help="stage folder, default to the output folder")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--memory-gb", type=float, default=None)
+    parser.add_argument("--mode", choices=["stream", "memory"], default="stream")
+    parser.add_argument("--engine", choices=["pandas", "pyarrow"], default="pandas")
+    parser.add_argument("--chunksize", type=int, default=500000)
+    parser.add_argument("--project", action="store_true", help="skip the schema 'drop' columns at parse time")
+    parser.add_argument("--partition-by-year", action="store_true")
+    parser.add_argument("--cubes", action="store_true", help="also write the pool cubes (memory mode)")
+    parser.add_argument("--publish", nargs="?", const="", default=None, metavar="FOLDER",
+                        help="also publish the vintages to a shared store, default folder when none is given (memory mode)")
+    parser.add_argument("--acq", nargs="+", default=None, help="only these vintages")
+    parser.add_argument("--metrics", default=None, help="append the stage metrics of every vintage to this JSON lines file")
+    args = parser.parse_args()
+    if args.metrics:
+        enable_metrics(args.metrics)
+
+    kwargs = {"stageFolder": args.stage or args.output, "engine": args.engine, "project": args.project}
+    if args.mode == "stream":
+        kwargs.update(chunksize=args.chunksize, partition_by_year=args.partition_by_year)
+    else:
+        if args.cubes:
+            kwargs.update(cubes=True)
+        if args.publish is not None:
+            kwargs.update(publish=args.publish)
+    report = run_batch(args.input, args.output, workers=args.workers, memory_gb=args.memory_gb,
+                       mode=args.mode, acqs=args.acq, **kwargs)
+    print(report.to_string())
+
+
+if __name__ == "__main__":
+    main()
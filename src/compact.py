@@ -0,0 +1,165 @@
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from src import file_lock
+
+
+# codes used for DLQ_STATUS, the same as the Spark path
+DLQ_NULL = -1
+DLQ_X = -2
+
+
+def to_month_index(dates):
+    '''
+    dates to int32 month indexes (year * 12 + month - 1), -1 for missing dates
+    '''
+    dates = pd.DatetimeIndex(dates)
+    out = np.where(dates.isna(), -1, dates.year * 12 + dates.month - 1)
+    return out.astype(np.int32)
+
+
+def from_month_index(month_index):
+    '''
+    int32 month indexes back to the first day of the month, NaT for -1
+    '''
+    month_index = np.asarray(month_index)
+    valid = month_index >= 0
+    years = np.where(valid, month_index // 12, 1970)
+    months = np.where(valid, month_index % 12 + 1, 1)
+    dates = pd.to_datetime(pd.DataFrame({"year": years, "month": months, "day": 1}))
+    return dates.where(valid).values
+
+
+def encode_dlq_status(status):
+    '''
+    DLQ_STATUS strings to int8: null -> -1, "X" -> -2, otherwise the number of months (capped at 127)
+    '''
+    status = pd.Series(status)
+    codes = pd.to_numeric(status, errors="coerce")
+    codes = codes.where(status != "X", DLQ_X).fillna(DLQ_NULL).clip(upper=127)
+    return codes.astype(np.int8).values
+
+
+# FNMA LOAN_IDs are digits; Freddie Mac loan sequence numbers are 12 characters: the product
+# letter, the 2-digit year (3 digits in the newer files, e.g. "105"), "Q", the quarter and the serial
+_FNMA_LOAN_ID = r"\d{1,18}"
+_FRED_LOAN_ID = r"([A-Z])(\d{2,3})Q([1-4])(\d{6,7})"
+
+
+def encode_loan_id(loan_ids):
+    '''
+    LOAN_ID strings to int64, element by element
+
+    FNMA LOAN_IDs (digits) keep their value. Freddie Mac loan sequence numbers, e.g.
+    "F01Q10000001" or "F105Q1000000", become letter code * 10^12 + period * 10^7 + serial, where
+    period is (year * 10 + quarter) for a 2-digit year and ((1000 + year) * 10 + quarter) for a
+    3-digit one, above every 12-digit FNMA LOAN_ID. Any other value raises a ValueError.
+    '''
+    loan_ids = pd.Series(loan_ids)
+    if pd.api.types.is_numeric_dtype(loan_ids):
+        return loan_ids.astype(np.int64).values
+    loan_ids = loan_ids.astype(str).reset_index(drop=True)
+    out = np.zeros(len(loan_ids), dtype=np.int64)
+    fnma = loan_ids.str.fullmatch(_FNMA_LOAN_ID).fillna(False).values.astype(bool)
+    out[fnma] = loan_ids[fnma].astype(np.int64).values
+
+    fred = loan_ids[~fnma]
+    parts = fred.str.extract("^" + _FRED_LOAN_ID + "$")
+    valid = (parts[0].notna() & (fred.str.len() == 12)).values
+    if not valid.all():
+        invalid = fred[~valid]
+        raise ValueError("encode_loan_id: {0} LOAN_IDs are neither FNMA nor Freddie Mac ids, e.g. {1}"
+                         .format(len(invalid), list(invalid.iloc[:5])))
+    if len(fred):
+        letter = parts[0].values.astype("U1").view(np.int32).astype(np.int64) - ord("A") + 1
+        year = parts[1].astype(np.int64).values + np.where(parts[1].str.len().values == 3, 1000, 0)
+        period = year * 10 + parts[2].astype(np.int64).values
+        out[~fnma] = letter * 10 ** 12 + period * 10 ** 7 + parts[3].astype(np.int64).values
+    return out
+
+
+class CategoryDictionary(object):
+    '''
+    categories per column shared across vintages
+
+    Categories are only ever appended, so a code keeps its meaning for every vintage
+    encoded with the same dictionary. With a path the dictionary is persisted as JSON and
+    codes are only assigned under an exclusive lock of <path>.lock, on the file content
+    reloaded under that lock: every process appends to the same list, and the categories
+    of a process are always a prefix of the file.
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.categories = {}
+        self._lock = None
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        '''merge the file into the categories, which must be a prefix of it'''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            disk = json.load(f)
+        for column, values in disk.items():
+            current = self.categories.get(column, [])
+            n = min(len(current), len(values))
+            if current[:n] != values[:n]:
+                raise ValueError("CategoryDictionary: the categories of {0} in {1} do not extend those "
+                                 "already used".format(column, self.path))
+            if len(values) > len(current):
+                self.categories[column] = list(values)
+
+    @contextmanager
+    def locked(self):
+        '''
+        hold the lock of the dictionary file: reload it on entry, write the added categories
+        on exit; encode and save within the block do no further file access
+        '''
+        if self.path is None or self._lock is not None:
+            yield self
+            return
+        with open(self.path + ".lock", "w") as lock:
+            file_lock.lock(lock)
+            self._lock = lock
+            try:
+                self.load()
+                try:
+                    yield self
+                finally:
+                    # the categories added before an error are valid too, and were maybe used
+                    self._write()
+            finally:
+                self._lock = None
+
+    def save(self):
+        '''write the categories, merged with those other processes added'''
+        with self.locked():
+            pass
+
+    def _write(self):
+        tmp = self.path + ".tmp." + str(os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.categories, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _extend(self, column, values):
+        current = self.categories.setdefault(column, [])
+        known = set(current)
+        for v in values:
+            if v not in known:
+                current.append(v)
+                known.add(v)
+
+    def encode(self, column, values):
+        '''
+        values as a pandas Categorical using (and extending) the categories of column
+        '''
+        with self.locked():
+            self._extend(column, sorted(pd.unique(pd.Series(values).dropna())))
+            return pd.Categorical(values, categories=self.categories[column])
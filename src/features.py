@@ -0,0 +1,310 @@
+'''
+Loan-event features of the performance data with NumPy.
+
+The performance rows are sorted once by (LOAN_ID, ACT_DTE); every loan is then a contiguous
+segment and all windows of the Spark path (lag, previous 12 rows, next 12/24 rows) become
+shifted, segment-masked array operations. No groupby-apply is involved.
+'''
+import numpy as np
+import pandas as pd
+
+from src.compact import encode_dlq_status
+
+
+# performance columns read by derive_loan_events, on top of the non-"drop" columns
+FEATURE_COLUMNS = ["MOD_FLAG", "ZB_CODE", "ZB_DTE", "LPI_DTE", "FCC_DTE", "DISP_DTE",
+                   "FCC_COST", "PP_COST", "AR_COST", "IE_COST", "TAX_COST",
+                   "NS_PROCS", "CE_PROCS", "RMW_PROCS", "O_PROCS"]
+
+# lowest code, below the DLQ_STATUS codes (-2 for "X", -1 for null) and the string ranks (-1 for null)
+_EMPTY = np.iinfo(np.int16).min
+
+# packed delinquency history: 5 bits per month, lag 1 in the lowest bits, code = DLQ_STATUS + 3
+# (0 no row, 1 "X", 2 null, 3 current, ...), so 12 months fit in an int64
+DLQ_HISTORY_BITS = 5
+DLQ_HISTORY_OFFSET = 3
+DLQ_HISTORY_MAX = (1 << DLQ_HISTORY_BITS) - 1 - DLQ_HISTORY_OFFSET
+_HISTORY_MASK = (1 << DLQ_HISTORY_BITS) - 1
+
+
+class LoanSegments(object):
+    '''
+    performance rows sorted by loan and date, with the boundaries of each loan
+
+    Parameters
+    ----------
+    loan_ids : array_like, LOAN_ID of each row
+    dates : array_like, ACT_DTE of each row (datetime64 or int month index)
+
+    Attributes
+    ----------
+    order : ndarray, row positions in sorted order, None when the rows were already sorted
+    first, last : ndarray, position (in sorted order) of the first/last row of the row's loan
+    '''
+
+    def __init__(self, loan_ids, dates):
+        loan_codes = pd.factorize(np.asarray(loan_ids), sort=True)[0]
+        date_keys = np.asarray(dates)
+        if date_keys.dtype == object:
+            # datetime.date objects, e.g. from Spark
+            date_keys = pd.to_datetime(date_keys).values
+        if np.issubdtype(date_keys.dtype, np.datetime64):
+            date_keys = date_keys.astype("datetime64[D]").astype(np.int64)
+
+        self.order = None
+        if len(loan_codes) > 1:
+            dl = np.diff(loan_codes)
+            if (dl < 0).any() or ((dl == 0) & (np.diff(date_keys) < 0)).any():
+                self.order = np.lexsort((date_keys, loan_codes))
+                loan_codes = loan_codes[self.order]
+
+        n = len(loan_codes)
+        self.size = n
+        starts = np.flatnonzero(np.r_[True, loan_codes[1:] != loan_codes[:-1]]) if n else np.array([], dtype=np.int64)
+        lengths = np.diff(np.r_[starts, n])
+        self.first = np.repeat(starts, lengths)
+        self.last = self.first + np.repeat(lengths, lengths) - 1
+        self.loan_codes = loan_codes
+
+    def forward_max(self, values, start, stop, initial=None):
+        '''
+        max of values over the rows start..stop (inclusive) after each row, within the loan
+
+        Returns _EMPTY where the window holds no row. initial is the result for a narrower
+        window start'..start-1 to extend, e.g. the next-12 max when computing the next-24 max.
+        '''
+        n = self.size
+        out = np.full(n, _EMPTY, dtype=values.dtype) if initial is None else initial.copy()
+        remaining = self.last - np.arange(n)
+        for s in range(start, min(stop, n - 1) + 1):
+            np.maximum(out[:n - s], values[s:], out=out[:n - s], where=remaining[:n - s] >= s)
+        return out
+
+    def lag(self, values, k=1):
+        '''value k rows before within the loan, _EMPTY when there is none'''
+        n = self.size
+        out = np.full(n, _EMPTY, dtype=values.dtype)
+        if n > k:
+            out[k:] = np.where(np.arange(k, n) - self.first[k:] >= k, values[:n - k], _EMPTY)
+        return out
+
+    def lags(self, values, rows, k=12):
+        '''
+        the previous k values of the given rows, shape (len(rows), k), oldest first, _EMPTY where there is none
+        '''
+        out = np.full((len(rows), k), _EMPTY, dtype=values.dtype)
+        for lag in range(1, k + 1):
+            valid = rows - self.first[rows] >= lag
+            out[valid, k - lag] = values[rows[valid] - lag]
+        return out
+
+    def first_per_loan(self, mask):
+        '''positions of the first row of each loan where mask holds'''
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return rows
+        keep = np.r_[True, self.loan_codes[rows[1:]] != self.loan_codes[rows[:-1]]]
+        return rows[keep]
+
+
+def _rank_codes(values):
+    '''
+    strings (or categoricals) to int16 ranks in lexicographic order, -1 for null
+
+    Returns the ranks and the sorted labels, so that max over ranks is the string max of Spark.
+    '''
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories.astype(str)
+        if len(categories) == 0:
+            return np.full(len(values), -1, dtype=np.int16), np.asarray([], dtype=object)
+        order = np.argsort(categories)
+        rank_of = np.empty(len(categories), dtype=np.int16)
+        rank_of[order] = np.arange(len(categories))
+        codes = values.cat.codes.values
+        ranks = np.where(codes < 0, -1, rank_of[np.maximum(codes, 0)]).astype(np.int16)
+        return ranks, np.asarray(categories[order], dtype=object)
+    codes, labels = pd.factorize(values, sort=True)
+    return codes.astype(np.int16), np.asarray(labels, dtype=object)
+
+
+def _dlq_codes(values):
+    values = pd.Series(values)
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return values.values.astype(np.int16)
+    return encode_dlq_status(values).astype(np.int16)
+
+
+def _to_int(values):
+    '''int16 codes to a nullable Int16 array, _EMPTY as null'''
+    return pd.arrays.IntegerArray(values.astype(np.int16), values == _EMPTY)
+
+
+def _to_label(ranks, labels):
+    '''string ranks back to strings, null for -1 and _EMPTY'''
+    out = np.full(len(ranks), None, dtype=object)
+    valid = ranks >= 0
+    out[valid] = labels[ranks[valid]]
+    return out
+
+
+def pack_dlq_history(lag_matrix):
+    '''
+    lag matrix (n, k) of DLQ_STATUS codes, oldest first and _EMPTY where there is no row,
+    to one int64 per row. Delinquencies above DLQ_HISTORY_MAX months are stored as DLQ_HISTORY_MAX.
+    '''
+    lag_matrix = np.asarray(lag_matrix)
+    k = lag_matrix.shape[1]
+    codes = np.clip(lag_matrix.astype(np.int64) + DLQ_HISTORY_OFFSET, 1, _HISTORY_MASK)
+    codes[lag_matrix == _EMPTY] = 0
+    packed = np.zeros(len(lag_matrix), dtype=np.int64)
+    for lag in range(1, k + 1):
+        packed |= codes[:, k - lag] << (DLQ_HISTORY_BITS * (lag - 1))
+    return packed
+
+
+def unpack_dlq_history(packed, k=12):
+    '''
+    packed histories to a float matrix (n, k) of DLQ_STATUS codes, oldest first, NaN where there is no row
+    (or the history itself is null)
+    '''
+    packed = pd.array(packed, dtype="Int64")
+    values = packed.to_numpy(dtype=np.int64, na_value=0)
+    out = np.full((len(values), k), np.nan)
+    for lag in range(1, k + 1):
+        codes = (values >> (DLQ_HISTORY_BITS * (lag - 1))) & _HISTORY_MASK
+        out[:, k - lag] = np.where(codes == 0, np.nan, codes - DLQ_HISTORY_OFFSET)
+    return out
+
+
+def dlq_history_lists(packed, k=12):
+    '''
+    packed histories to lists of the present DLQ_STATUS codes, oldest first, as collect_list over the
+    previous 12 rows did; None for a null history
+    '''
+    valid = ~pd.isna(pd.array(packed, dtype="Int64"))
+    matrix = unpack_dlq_history(packed, k)
+    return [[int(v) for v in row if v == v] if ok else None for row, ok in zip(matrix, valid)]
+
+
+def _to_packed(lag_matrix):
+    '''lag matrix to a nullable Int64 array of packed histories, exact through outer joins'''
+    return pd.array(pack_dlq_history(lag_matrix), dtype="Int64")
+
+
+def _sum_or_null(df, columns):
+    '''sum of the columns, null when any is null (as the Spark expression), None when a column is missing'''
+    if not all(c in df.columns for c in columns):
+        return None
+    total = df[columns[0]].astype(np.float64)
+    for c in columns[1:]:
+        total = total + df[c]
+    return total.values
+
+
+def derive_loan_events(df, row_features=False):
+    '''
+    Derive the loan events of the performance data, as the Spark read_data_performance.
+
+    Parameters
+    ----------
+    df : pandas dataframe of performance rows with at least LOAN_ID, ACT_DTE, LOAN_AGE,
+         DLQ_STATUS, LAST_UPB, MOD_FLAG and ZB_CODE (plain or compact representation).
+         ZB_DTE, LPI_DTE, FCC_DTE, DISP_DTE and the cost/proceeds columns are used when present.
+    row_features : also return the rows sorted by (LOAN_ID, ACT_DTE) with DLQ_LAG,
+         DLQ_NEXT12MAX, DLQ_NEXT24MAX, ZBCODE_NEXT12, ZBCODE_NEXT24, MOD_NEXT12 and MOD_NEXT24
+
+    Returns
+    -------
+    out : dict with "Mod" (first modification), "F3Q" (first 90+ days delinquency) and
+          "ZB" (zero balance) loan-level dataframes, and "Performance" when row_features.
+          The *_DLQ_LAGs12 columns hold the previous 12 DLQ_STATUS packed into an int64
+          (see pack_dlq_history), evaluated for the event rows only.
+    '''
+    seg = LoanSegments(df["LOAN_ID"].values, df["ACT_DTE"].values)
+    if seg.order is not None:
+        df = df.iloc[seg.order].reset_index(drop=True)
+
+    dlq = _dlq_codes(df["DLQ_STATUS"])
+    zb_rank, zb_labels = _rank_codes(df["ZB_CODE"])
+    mod_rank, mod_labels = _rank_codes(df["MOD_FLAG"])
+
+    dlq_lag = seg.lag(dlq)
+    dlq_next12 = seg.forward_max(dlq, 1, 12)
+    dlq_next24 = seg.forward_max(dlq, 13, 24, initial=dlq_next12)
+    zb_next12 = seg.forward_max(zb_rank, 1, 12)
+    zb_next24 = seg.forward_max(zb_rank, 13, 24, initial=zb_next12)
+
+    out = {}
+
+    rows = seg.first_per_loan(np.asarray(df["MOD_FLAG"] == "Y"))
+    out["Mod"] = pd.DataFrame({
+        "LOAN_ID":            df["LOAN_ID"].values[rows],
+        "MOD_DTE":            df["ACT_DTE"].values[rows],
+        "MOD_AGE":            df["LOAN_AGE"].values[rows],
+        "MOD_DLQ":            _to_int(dlq[rows]),
+        "MOD_DLQ_LAG":        _to_int(dlq_lag[rows]),
+        "MOD_DLQ_LAGs12":     _to_packed(seg.lags(dlq, rows)),
+        "MOD_POST_MAXDLQ_12": _to_int(dlq_next12[rows]),
+        "MOD_POST_MAXDLQ_24": _to_int(dlq_next24[rows]),
+        "MOD_POST_ZBCODE_12": _to_label(zb_next12[rows], zb_labels),
+        "MOD_POST_ZBCODE_24": _to_label(zb_next24[rows], zb_labels),
+    })
+
+    rows = seg.first_per_loan(dlq > 2)
+    out["F3Q"] = pd.DataFrame({
+        "LOAN_ID":            df["LOAN_ID"].values[rows],
+        "F3Q_DTE":            df["ACT_DTE"].values[rows],
+        "F3Q_AGE":            df["LOAN_AGE"].values[rows],
+        "F3Q_DLQ_LAGs12":     _to_packed(seg.lags(dlq, rows)),
+        "F3Q_POST_MAXDLQ_12": _to_int(dlq_next12[rows]),
+        "F3Q_POST_MAXDLQ_24": _to_int(dlq_next24[rows]),
+        "F3Q_POST_ZBCODE_12": _to_label(zb_next12[rows], zb_labels),
+        "F3Q_POST_ZBCODE_24": _to_label(zb_next24[rows], zb_labels),
+    })
+
+    rows = np.flatnonzero(zb_rank >= 0)
+    zb = {
+        "LOAN_ID":        df["LOAN_ID"].values[rows],
+        "ZB_CODE":        df["ZB_CODE"].values[rows],
+        "ZB_DTE":         df["ZB_DTE"].values[rows] if "ZB_DTE" in df.columns else None,
+        "ZB_AGE":         df["LOAN_AGE"].values[rows],
+        "ZB_DLQ_LAGs12":  _to_packed(seg.lags(dlq, rows)),
+        "ZB_DLQ_LAG":     _to_int(dlq_lag[rows]),
+        "ZB_LAST_UPB":    df["LAST_UPB"].values[rows],
+    }
+    for k in ("LPI_DTE", "FCC_DTE", "DISP_DTE"):
+        if k in df.columns:
+            zb[k] = df[k].values[rows]
+    deft_cost = _sum_or_null(df, ["FCC_COST", "PP_COST", "AR_COST", "IE_COST", "TAX_COST"])
+    deft_procs = _sum_or_null(df, ["NS_PROCS", "CE_PROCS", "RMW_PROCS", "O_PROCS"])
+    if deft_cost is not None:
+        zb["DEFT_COST"] = deft_cost[rows]
+    if deft_procs is not None:
+        zb["DEFT_PROCS"] = deft_procs[rows]
+    out["ZB"] = pd.DataFrame({k: v for k, v in zb.items() if v is not None})
+
+    if row_features:
+        mod_next12 = seg.forward_max(mod_rank, 1, 12)
+        mod_next24 = seg.forward_max(mod_rank, 13, 24, initial=mod_next12)
+        df = df.copy()
+        df["DLQ_LAG"] = _to_int(dlq_lag)
+        df["DLQ_NEXT12MAX"] = _to_int(dlq_next12)
+        df["DLQ_NEXT24MAX"] = _to_int(dlq_next24)
+        df["ZBCODE_NEXT12"] = _to_label(zb_next12, zb_labels)
+        df["ZBCODE_NEXT24"] = _to_label(zb_next24, zb_labels)
+        df["MOD_NEXT12"] = _to_label(mod_next12, mod_labels)
+        df["MOD_NEXT24"] = _to_label(mod_next24, mod_labels)
+        out["Performance"] = df
+    return out
+
+
+def loan_level_events(events):
+    '''
+    one row per loan with any event: the Mod, F3Q and ZB tables outer-joined on LOAN_ID
+    '''
+    loan_ids = pd.unique(np.concatenate([events[k]["LOAN_ID"].values for k in ("Mod", "F3Q", "ZB")]))
+    out = pd.DataFrame({"LOAN_ID": loan_ids})
+    for k in ("Mod", "F3Q", "ZB"):
+        out = out.merge(events[k], on="LOAN_ID", how="left")
+    return out
@@ -0,0 +1,76 @@
+'''
+Advisory whole-file locks of the processes of one machine.
+
+flock where the platform has fcntl. On Windows the exclusive locks use msvcrt (a lock of the
+first byte) and the shared locks are not taken: VintageStore cannot see the readers of an
+entry there, but the files a reader holds open cannot be removed there either. Without both
+modules the locks are no-ops. fcntl and msvcrt are imported on first use, so importing the
+modules that lock files stays portable.
+'''
+import os
+import time
+
+
+def _fcntl():
+    try:
+        import fcntl
+    except ImportError:
+        return None
+    return fcntl
+
+
+def _msvcrt():
+    try:
+        import msvcrt
+    except ImportError:
+        return None
+    return msvcrt
+
+
+def _fileno(f):
+    return f if isinstance(f, int) else f.fileno()
+
+
+def lock(f, shared=False, blocking=True):
+    '''
+    lock the open file f (a file object or descriptor) until it is closed or unlock(f)
+
+    Returns False when blocking is False and another process holds a conflicting lock.
+    '''
+    fcntl = _fcntl()
+    if fcntl is not None:
+        flags = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(_fileno(f), flags)
+        except BlockingIOError:
+            return False
+        return True
+    msvcrt = _msvcrt()
+    if msvcrt is None or shared:
+        return True
+    fd = _fileno(f)
+    while True:
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def unlock(f):
+    '''release the lock of f taken by lock'''
+    fcntl = _fcntl()
+    if fcntl is not None:
+        fcntl.flock(_fileno(f), fcntl.LOCK_UN)
+        return
+    msvcrt = _msvcrt()
+    if msvcrt is not None:
+        fd = _fileno(f)
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
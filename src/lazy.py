@@ -0,0 +1,231 @@
+'''
+Deferred query plans over the loan data.
+
+    fnma = PUBLIC_LOAN_FNMA("2000Q1", stageFolder=folder, lazy=True)
+    loans = fnma.Loan_Data.filter([("STATE", "==", "CA"), ("CSCORE_B", "<", 620)]).select("LOAN_ID", "ORIG_AMT")
+    df = fnma.Performance_Data.select("LOAN_ID", "ACT_DTE", "LAST_UPB").join(loans).collect()
+
+A LazyFrame holds a source (a Parquet folder read as a pyarrow dataset, or an in-memory pandas
+frame) and the filters, column selection and joins given by the caller; nothing is read until
+collect, to_table, head or count. At execution the filter and the columns go to the dataset
+scan (hive partitions and row-group statistics skip data, only the selected columns are
+decoded), and the keys of the right side of an inner or semi join are pushed into the left scan:
+through the LOAN_ID index of a LoanPerformance partition (src.loan_index) when there is one,
+as an isin filter otherwise.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src import metrics
+from src.loan_index import INDEX_FILE, read_loans
+
+
+_JOIN_TYPES = {"inner": "inner", "left": "left outer", "semi": "left semi"}
+
+
+def scan(folder):
+    '''
+    LazyFrame over the Parquet data under folder (hive partitions become columns)
+
+    folder is a dataset (e.g. output/FNMA/LoanPerformance.parquet, with an ACQ column) or one
+    vintage partition (e.g. .../LoanPerformance.parquet/ACQ=2000Q1, whose LOAN_ID index is used)
+    '''
+    return LazyFrame(ds.dataset(folder, format="parquet", partitioning="hive"), label=folder,
+                     index_folder=folder if os.path.exists(os.path.join(folder, INDEX_FILE)) else None)
+
+
+def _filter_expression(predicate):
+    '''a pyarrow.dataset expression, or the expression of a DNF filter list, and the columns it reads'''
+    if isinstance(predicate, ds.Expression):
+        return predicate, None
+    if isinstance(predicate, tuple):
+        predicate = [predicate]
+    conjunctions = predicate if predicate and isinstance(predicate[0], list) else [predicate]
+    return pq.filters_to_expression(predicate), {f[0] for conjunction in conjunctions for f in conjunction}
+
+
+class LazyFrame(object):
+    '''a deferred scan; filter, select and join return a new plan, collect runs it'''
+
+    def __init__(self, source, columns=None, filter=None, filter_columns=frozenset(), joins=(), index_folder=None,
+                 label=None, projection=None):
+        self._source = source
+        # source columns read by the scan, None for all
+        self._columns = columns
+        # columns of the result after the joins, None for all
+        self._projection = projection
+        self._filter = filter
+        # columns read by the filter, None when unknown (a pyarrow expression)
+        self._filter_columns = filter_columns
+        self._joins = tuple(joins)
+        self._index_folder = index_folder
+        self._label = label or type(source).__name__
+
+    def _plan(self, **changes):
+        plan = dict(source=self._source, columns=self._columns, filter=self._filter,
+                    filter_columns=self._filter_columns, joins=self._joins, index_folder=self._index_folder,
+                    label=self._label, projection=self._projection)
+        plan.update(changes)
+        return LazyFrame(**plan)
+
+    @property
+    def source_schema(self):
+        if isinstance(self._source, pd.DataFrame):
+            return pa.Schema.from_pandas(self._source.head(0), preserve_index=False)
+        return self._source.schema
+
+    @property
+    def columns(self):
+        '''columns of the result'''
+        if self._projection is not None:
+            return list(self._projection)
+        columns = list(self.source_schema.names if self._columns is None else self._columns)
+        columns += [k for k in self._keys() if k not in columns]
+        for other, on, how in self._joins:
+            if how != "semi":
+                columns += [c for c in other.columns if c not in on]
+        return columns
+
+    def filter(self, *predicates):
+        '''
+        keep the rows matching every predicate: a pyarrow.dataset expression
+        (e.g. ds.field("LAST_UPB") > 0) or filters in the pyarrow DNF form
+        (e.g. [("STATE", "==", "CA"), ("CSCORE_B", "<", 620)])
+        '''
+        expression, filter_columns = self._filter, self._filter_columns
+        for predicate in predicates:
+            e, c = _filter_expression(predicate)
+            expression = e if expression is None else expression & e
+            filter_columns = None if c is None or filter_columns is None else filter_columns | c
+        return self._plan(filter=expression, filter_columns=filter_columns)
+
+    def select(self, *columns):
+        '''
+        keep these columns (names, or one list of names) of the result, the joined ones included;
+        after a join the selection applies to the joined rows and only its source columns are scanned
+        '''
+        if len(columns) == 1 and isinstance(columns[0], (list, tuple)):
+            columns = columns[0]
+        columns = list(columns)
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError("unknown columns: {0}".format(sorted(unknown)))
+        if not self._joins:
+            return self._plan(columns=columns)
+        source = set(self.source_schema.names if self._columns is None else self._columns)
+        return self._plan(columns=[c for c in columns if c in source], projection=columns)
+
+    def join(self, other, on="LOAN_ID", how="inner"):
+        '''
+        join the rows of the LazyFrame other on the key columns on
+
+        how: "inner", "left" or "semi" (the rows with a match in other, no column of other added).
+             For "inner" and "semi" other is run first and its keys restrict the scan of this plan.
+        '''
+        if how not in _JOIN_TYPES:
+            raise ValueError("unknown join type: {0}".format(how))
+        on = [on] if isinstance(on, str) else list(on)
+        projection = self._projection
+        if projection is not None:
+            projection = projection + [k for k in on if k not in projection]
+            if how != "semi":
+                projection += [c for c in other.columns if c not in projection]
+        return self._plan(joins=self._joins + ((other, on, how),), projection=projection)
+
+    def explain(self):
+        '''the plan as text'''
+        lines = ["scan {0}{1}".format(self._label, " (LOAN_ID index)" if self._index_folder else "")]
+        if self._columns is not None:
+            lines.append("  columns: {0}".format(", ".join(self._columns)))
+        if self._filter is not None:
+            lines.append("  filter: {0}".format(self._filter))
+        for other, on, how in self._joins:
+            lines.append("  {0} join on {1}{2}".format(how, ", ".join(on),
+                                                       ", keys pushed into the scan" if how != "left" else ""))
+            lines += ["    " + line for line in other.explain().splitlines()]
+        if self._projection is not None:
+            lines.append("  select: {0}".format(", ".join(self._projection)))
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return "LazyFrame\n" + self.explain()
+
+    def _scan_columns(self, keys):
+        '''source columns to read, None for all'''
+        if self._columns is None:
+            return None
+        columns = list(self._columns) + [k for k in keys if k not in self._columns]
+        if isinstance(self._source, pd.DataFrame):
+            # the frame is converted to Arrow, so the filter columns are needed too
+            if self._filter_columns is None:
+                return None
+            columns += [c for c in self._filter_columns if c not in columns]
+        return columns
+
+    def _scan(self, keys, key=None, key_values=None):
+        columns = self._scan_columns(keys)
+        expression = self._filter
+        if isinstance(self._source, pd.DataFrame):
+            frame = self._source if columns is None else self._source[columns]
+            dataset = ds.dataset(pa.Table.from_pandas(frame, preserve_index=False))
+        else:
+            dataset = self._source
+            if key == "LOAN_ID" and self._index_folder is not None:
+                table = read_loans(self._index_folder, key_values, columns=columns, filter=expression)
+                return table if columns is None else table.select(columns)
+        if key is not None:
+            isin = ds.field(key).isin(pa.array(key_values, type=dataset.schema.field(key).type))
+            expression = isin if expression is None else expression & isin
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def _keys(self):
+        keys = []
+        for _, on, _ in self._joins:
+            keys += [k for k in on if k not in keys]
+        return keys
+
+    def to_table(self):
+        '''run the plan, an Arrow table'''
+        with metrics.stage("collect", joins=len(self._joins)) as stage:
+            right = [(other.to_table() if how != "semi" else other.to_table().select(on), on, how)
+                     for other, on, how in self._joins]
+            # the keys of the inner and semi joins on the first single join column restrict the scan
+            key, key_values = None, None
+            for other_table, on, how in right:
+                if how == "left" or len(on) != 1 or (key is not None and on[0] != key):
+                    continue
+                values = np.unique(other_table.column(on[0]).drop_null().to_numpy(zero_copy_only=False))
+                key, key_values = on[0], values if key is None else np.intersect1d(key_values, values)
+            keys = self._keys()
+            table = self._scan(keys, key, key_values)
+            if self._columns is not None:
+                table = table.select(self._columns + [k for k in keys if k not in self._columns])
+            for other_table, on, how in right:
+                table = table.join(other_table, keys=on, join_type=_JOIN_TYPES[how], use_threads=True)
+            if self._projection is not None:
+                table = table.select(self._projection)
+            stage.set(rows_out=table.num_rows)
+        return table
+
+    def collect(self):
+        '''run the plan, a pandas dataframe'''
+        return self.to_table().to_pandas()
+
+    def head(self, n=5):
+        '''the first n rows as a pandas dataframe; without joins only the rows needed are read'''
+        if self._joins or isinstance(self._source, pd.DataFrame):
+            return self.to_table().slice(0, n).to_pandas()
+        columns = self._scan_columns([])
+        table = self._source.head(n, columns=columns, filter=self._filter)
+        return (table if columns is None else table.select(self._columns)).to_pandas()
+
+    def count(self):
+        '''number of rows of the result; without joins only the row counts of the scan are read'''
+        if self._joins or isinstance(self._source, pd.DataFrame):
+            return self.to_table().num_rows
+        return self._source.count_rows(filter=self._filter)
@@ -0,0 +1,159 @@
+'''
+Sidecar LOAN_ID index of a Parquet vintage partition.
+
+_loan_index.parquet, next to the data files of LoanPerformance.parquet/ACQ=<acqYYYYQQ>, holds one
+row per loan and row group: the file (relative to the partition folder), the row group, the
+offset of the loan's first row in the row group and the number of rows up to its last one. The
+leading underscore keeps it out of pyarrow datasets and Spark reads of the partition.
+
+The data files are written sorted by LOAN_ID, so a loan sits in one row group (two at a
+boundary) and a query for some loans reads only the row groups listed for them.
+'''
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src import metrics
+
+
+INDEX_FILE = "_loan_index.parquet"
+
+
+def data_files(folder):
+    '''Parquet data files under folder (hive partitions included), relative to folder, sorted'''
+    files = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith((".", "_")))
+        for name in names:
+            if name.endswith(".parquet") and not name.startswith((".", "_")):
+                files.append(os.path.relpath(os.path.join(root, name), folder))
+    return sorted(files)
+
+
+def _row_group_runs(loan_ids):
+    '''first position and span (last - first + 1) of every LOAN_ID of one row group'''
+    values = loan_ids.to_numpy(zero_copy_only=False)
+    if values.dtype == object:
+        values = values.astype(str)
+    unique, first = np.unique(values, return_index=True)
+    _, last = np.unique(values[::-1], return_index=True)
+    last = len(values) - 1 - last
+    return unique, first, last - first + 1
+
+
+def build_loan_index(folder):
+    '''
+    scan the LOAN_ID column of every row group under folder and write folder/_loan_index.parquet
+
+    Returns
+    -------
+    out : the index as an Arrow table (LOAN_ID, file, row_group, offset, rows)
+    '''
+    with metrics.stage("build_loan_index", folder=folder) as stage:
+        index = _scan_loan_ids(folder)
+        path = os.path.join(folder, INDEX_FILE)
+        tmp = path + ".tmp." + str(os.getpid())
+        pq.write_table(index, tmp)
+        os.replace(tmp, path)
+        stage.set(rows_out=index.num_rows, bytes_written=os.path.getsize(path))
+    return index
+
+
+def _scan_loan_ids(folder):
+    parts = []
+    for file in data_files(folder):
+        parquet = pq.ParquetFile(os.path.join(folder, file))
+        for row_group in range(parquet.num_row_groups):
+            loan_ids = parquet.read_row_group(row_group, columns=["LOAN_ID"]).column("LOAN_ID")
+            unique, first, rows = _row_group_runs(loan_ids)
+            parts.append(pa.table({"LOAN_ID": pa.array(unique, type=loan_ids.type),
+                                   "file": pa.array([file] * len(unique), type=pa.string()),
+                                   "row_group": pa.array(np.full(len(unique), row_group, dtype=np.int32)),
+                                   "offset": pa.array(first.astype(np.int64)),
+                                   "rows": pa.array(rows.astype(np.int64))}))
+    if parts:
+        index = pa.concat_tables(parts)
+    else:
+        index = pa.table({"LOAN_ID": pa.array([], type=pa.string()), "file": pa.array([], type=pa.string()),
+                          "row_group": pa.array([], type=pa.int32()), "offset": pa.array([], type=pa.int64()),
+                          "rows": pa.array([], type=pa.int64())})
+    return index.sort_by([("LOAN_ID", "ascending"), ("file", "ascending"), ("row_group", "ascending")])
+
+
+def _loan_id_array(loan_ids, type):
+    loan_ids = np.asarray(loan_ids)
+    # an empty list is float64 to numpy
+    return pa.array(loan_ids if len(loan_ids) else [], type=type)
+
+
+def read_loan_index(folder):
+    '''the index of folder, None when it is missing or older than a data file'''
+    path = os.path.join(folder, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    if any(os.path.getmtime(os.path.join(folder, f)) > mtime for f in data_files(folder)):
+        return None
+    return pq.read_table(path)
+
+
+def read_loans(folder, loan_ids, columns=None, filter=None):
+    '''
+    rows of loan_ids from the Parquet data under folder
+
+    With a current index only the row groups listed for the loans are read, and the rows are
+    taken from each loan's offset over its span; none of the loans in the index gives an empty
+    table with the dataset schema without reading any data. Without an index the LOAN_ID filter
+    is pushed down to the row-group statistics of a pyarrow dataset scan.
+
+    Parameters
+    ----------
+    loan_ids : array_like of LOAN_ID
+    columns : list, optional, columns returned (LOAN_ID is always read)
+    filter : pyarrow.dataset expression, optional, further row filter
+
+    Returns
+    -------
+    out : Arrow table, rows in file order
+    '''
+    index = read_loan_index(folder)
+    read_columns = None if columns is None else list(dict.fromkeys(["LOAN_ID"] + list(columns)))
+    if index is not None:
+        loan_ids = _loan_id_array(loan_ids, index.schema.field("LOAN_ID").type)
+        entries = index.filter(pc.is_in(index.column("LOAN_ID"), value_set=loan_ids))
+        if entries.num_rows == 0:
+            schema = ds.dataset(folder, format="parquet", partitioning="hive").schema
+            if read_columns is not None:
+                schema = pa.schema([schema.field(k) for k in read_columns])
+            return schema.empty_table()
+    if index is None:
+        dataset = ds.dataset(folder, format="parquet", partitioning="hive")
+        loan_ids = _loan_id_array(loan_ids, dataset.schema.field("LOAN_ID").type)
+        expression = ds.field("LOAN_ID").isin(loan_ids)
+        if filter is not None:
+            expression = expression & filter
+        return dataset.to_table(columns=read_columns, filter=expression)
+
+    entries = entries.sort_by([("file", "ascending"), ("row_group", "ascending"), ("offset", "ascending")])
+    files = entries.column("file").to_numpy(zero_copy_only=False)
+    row_groups = entries.column("row_group").to_numpy()
+    offsets = entries.column("offset").to_numpy()
+    rows = entries.column("rows").to_numpy()
+    tables = []
+    for file in dict.fromkeys(files):
+        in_file = files == file
+        parquet = pq.ParquetFile(os.path.join(folder, file))
+        for row_group in np.unique(row_groups[in_file]):
+            selected = in_file & (row_groups == row_group)
+            table = parquet.read_row_group(int(row_group), columns=read_columns)
+            positions = np.concatenate([np.arange(o, o + n) for o, n in zip(offsets[selected], rows[selected])])
+            tables.append(table.take(pa.array(np.unique(positions))))
+    table = pa.concat_tables(tables)
+    table = table.filter(pc.is_in(table.column("LOAN_ID"), value_set=loan_ids))
+    if filter is not None:
+        table = table.filter(filter)
+    return table
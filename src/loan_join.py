@@ -0,0 +1,101 @@
+'''
+Streaming merge-join of loan attributes onto performance chunks.
+
+The acquisition and the performance files of a vintage are both ordered by LOAN_ID, so the
+performance file can be enriched chunk by chunk while the acquisition file is read alongside
+it: LoanWindow keeps the loans from the smallest LOAN_ID of the current performance chunk to
+the largest one read so far, reads acquisition chunks until the window covers the chunk and
+drops the loans the performance file is past. Memory is proportional to the chunk sizes, not to
+the vintage.
+'''
+import numpy as np
+import pandas as pd
+
+
+def _loan_ids(values):
+    '''LOAN_IDs as a numpy array that sorts like the files (fixed-width strings)'''
+    values = np.asarray(values)
+    return values.astype(str) if values.dtype == object else values
+
+
+class LoanWindow(object):
+    '''
+    loan attributes of a LOAN_ID-ordered stream of frames, looked up by LOAN_ID in ascending order
+
+    Parameters
+    ----------
+    chunks : iterable of frames with a LOAN_ID column, e.g. the acquisition file read in chunks
+             or [Loan_Data]; the rows are sorted within a chunk, the chunks must follow each other
+    '''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._ids = None
+        self._frame = None
+        self._exhausted = False
+        # largest LOAN_ID dropped from the window, the lookups must stay above it
+        self._evicted = None
+        self.rows_read = 0
+        self.peak_rows = 0
+
+    def _evict(self, lowest):
+        first = int(np.searchsorted(self._ids, lowest, side="left"))
+        if first:
+            self._evicted = self._ids[first - 1]
+            self._ids = self._ids[first:]
+            self._frame = self._frame.iloc[first:]
+
+    def _read(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            return
+        chunk = chunk.sort_values("LOAN_ID", kind="stable")
+        ids = _loan_ids(chunk["LOAN_ID"].values)
+        self.rows_read = self.rows_read + len(chunk)
+        if self._frame is None:
+            self._ids, self._frame = ids, chunk
+            return
+        last = self._ids[-1] if len(self._ids) else self._evicted
+        if len(ids) and last is not None and ids[0] <= last:
+            raise ValueError("LoanWindow: LOAN_ID {0} after {1}, the loans are not in LOAN_ID order".format(ids[0], last))
+        self._ids = np.concatenate([self._ids, ids])
+        self._frame = pd.concat([self._frame, chunk])
+
+    def lookup(self, loan_ids):
+        '''
+        the attribute columns (all but LOAN_ID) of the loans loan_ids, one row per id in their order
+
+        Parameters
+        ----------
+        loan_ids : ascending array of LOAN_IDs, not below those of the previous lookup
+
+        Returns
+        -------
+        out : frame with a default index; missing values for the ids without a loan
+        '''
+        loan_ids = _loan_ids(loan_ids)
+        if self._frame is None:
+            self._read()
+        if len(loan_ids):
+            lowest, highest = loan_ids[0], loan_ids[-1]
+            if (loan_ids[1:] < loan_ids[:-1]).any():
+                raise ValueError("LoanWindow: the performance rows are not in LOAN_ID order")
+            if self._evicted is not None and lowest <= self._evicted:
+                raise ValueError("LoanWindow: LOAN_ID {0} after {1}, the performance rows are not in LOAN_ID order"
+                                 .format(lowest, self._evicted))
+            self._evict(lowest)
+            while not self._exhausted and (len(self._ids) == 0 or self._ids[-1] < highest):
+                self._read()
+                self._evict(lowest)
+        self.peak_rows = max(self.peak_rows, len(self._ids))
+
+        attributes = self._frame.drop(columns="LOAN_ID")
+        if len(self._ids) == 0:
+            return attributes.reset_index(drop=True).reindex(range(len(loan_ids)))
+        position = np.minimum(np.searchsorted(self._ids, loan_ids), len(self._ids) - 1)
+        out = attributes.iloc[position].reset_index(drop=True)
+        matched = self._ids[position] == loan_ids
+        if not matched.all():
+            out = out.where(pd.Series(matched))
+        return out
@@ -0,0 +1,186 @@
+'''
+Structured per-stage metrics of the pipeline.
+
+    with metrics.collect() as records:
+        fnma.read_data_performance()
+    records.to_frame()
+
+Every instrumented stage (read_csv, parse_dates, fill_defaults, fill_last_upb, derive_features,
+join_events, write_parquet, ...) emits one record: stage name, wall and CPU seconds, rows in/out,
+bytes read/written when known, the peak RSS of the process so far (where the resource module
+exists, not on Windows), the pid and the fields given to the stage (e.g. acq). The sizes are
+given as read_path / written_path, a file or folder that is only measured when the record is
+emitted, so a disabled stage never walks the written files. Records go to the enabled sinks: an in-memory MemoryCollector or a
+JsonLinesSink appending one JSON object per line (safe from several processes).
+
+Setting PUBLIC_LOAN_METRICS=<path.jsonl> enables a JsonLinesSink at import, also in the worker
+processes of src.batch and src.refresh. With no sink enabled stage() returns a shared no-op and
+costs one list check.
+'''
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+ENV_VARIABLE = "PUBLIC_LOAN_METRICS"
+
+_sinks = []
+_local = threading.local()
+# ru_maxrss is in KiB on Linux, bytes on macOS
+_MAXRSS_SCALE = 1 if platform.system() == "Darwin" else 1024
+
+
+class MemoryCollector(object):
+    '''records kept in a list'''
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.records)
+
+
+class JsonLinesSink(object):
+    '''records appended to path, one JSON object per line'''
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def emit(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        # one write per record on an O_APPEND file, lines of concurrent processes do not interleave
+        with open(self.path, "a") as f:
+            f.write(line)
+
+
+def enable(sink):
+    '''add sink (a MemoryCollector, JsonLinesSink or any object with emit(record)), returns it'''
+    _sinks.append(sink)
+    return sink
+
+
+def disable(sink=None):
+    '''remove sink, or every sink'''
+    if sink is None:
+        del _sinks[:]
+    elif sink in _sinks:
+        _sinks.remove(sink)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+@contextmanager
+def collect():
+    '''a MemoryCollector enabled for the with-block'''
+    collector = enable(MemoryCollector())
+    try:
+        yield collector
+    finally:
+        disable(collector)
+
+
+def file_bytes(path):
+    '''size of a file, or of the files under a folder; None for anything else (e.g. a buffer)'''
+    if not isinstance(path, (str, os.PathLike)):
+        return None
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return None
+
+
+class Stage(object):
+    '''an open stage; set() or add() its counters (rows_in, rows_out, bytes_read, bytes_written, ...)'''
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **counters):
+        self.fields.update(counters)
+        return self
+
+    def add(self, **counters):
+        for k, v in counters.items():
+            self.fields[k] = self.fields.get(k, 0) + v
+        return self
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _local.stack.pop()
+        peak_rss = None if resource is None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_SCALE
+        record = {"stage": self.name, "parent": self.parent, "pid": os.getpid(), "start": time.time() - wall,
+                  "wall_seconds": wall, "cpu_seconds": cpu, "peak_rss_bytes": peak_rss}
+        record.update(self.fields)
+        for path_field, bytes_field in (("read_path", "bytes_read"), ("written_path", "bytes_written")):
+            if path_field in record:
+                record[bytes_field] = file_bytes(record.pop(path_field))
+        if exc_type is not None:
+            record["error"] = repr(exc)
+        for sink in list(_sinks):
+            sink.emit(record)
+        return False
+
+
+class _NullStage(object):
+    def set(self, **counters):
+        return self
+
+    def add(self, **counters):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name, **fields):
+    '''
+    context manager timing the stage name, a no-op when no sink is enabled
+
+    fields are copied into the record, e.g. acq="2000Q1", rows_in=len(df); read_path and
+    written_path (also given to set) become bytes_read and bytes_written, measured at exit
+    '''
+    if not _sinks:
+        return _NULL_STAGE
+    return Stage(name, fields)
+
+
+if os.environ.get(ENV_VARIABLE):
+    enable(JsonLinesSink(os.environ[ENV_VARIABLE]))
@@ -0,0 +1,90 @@
+'''
+Parallel parsing of one large delimited file.
+
+The file is split into newline-aligned byte ranges that are parsed in a process pool. Every
+worker writes its table as an Arrow IPC file to shared memory (/dev/shm when available); the
+parent memory-maps the files in range order, so no DataFrame is pickled between processes and
+the row order of the file is kept.
+'''
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+
+
+def shared_memory_folder():
+    '''/dev/shm when available, the temporary folder otherwise'''
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def byte_ranges(path, parts):
+    '''
+    split path into at most parts (start, end) byte ranges, each starting at the beginning of a line
+    '''
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            pos = size * i // parts
+            if pos <= bounds[-1]:
+                continue
+            # from the byte before pos, so that a range already starting a line is kept
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def _parse_range(path, start, end, parse, folder):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    table = parse(data)
+    del data
+    ipc_file = os.path.join(folder, "range-" + uuid.uuid4().hex + ".arrow")
+    with pa.OSFile(ipc_file, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return ipc_file
+
+
+def read_ranges(path, parse, workers=None, ranges_per_worker=4, folder=None):
+    '''
+    parse path in parallel
+
+    Parameters
+    ----------
+    path : file to parse
+    parse : picklable callable, bytes of whole lines -> pyarrow Table
+    workers : processes, default to the number of CPUs
+    ranges_per_worker : ranges per process, more ranges balance the load better
+    folder : folder of the intermediate Arrow IPC files, default to shared_memory_folder()
+
+    Returns
+    -------
+    out : pyarrow Table with the rows in file order
+    '''
+    workers = workers or os.cpu_count()
+    folder = folder or shared_memory_folder()
+    ranges = byte_ranges(path, workers * ranges_per_worker)
+
+    futures = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_parse_range, path, start, end, parse, folder) for start, end in ranges]
+        tables = [pa.ipc.open_file(pa.memory_map(future.result())).read_all() for future in futures]
+        return pa.concat_tables(tables, promote_options="default")
+    finally:
+        # the mapped tables stay valid after the unlink
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                os.remove(future.result())
@@ -0,0 +1,91 @@
+'''
+Cache of parsed input files as Arrow IPC files.
+
+An entry is keyed by the source file (absolute path, size, mtime), the schema and the parsed
+columns, so a changed file or schema is simply a miss. Entries are memory-mapped on hit and
+evicted least recently used first when the folder exceeds its quota.
+'''
+import hashlib
+import json
+import os
+
+import pyarrow as pa
+
+
+def cache_key(path, schema, columns=None, **options):
+    '''sha1 of the source file fingerprint, the schema, the columns and any other options'''
+    stat = os.stat(path)
+    key = {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+           "schema": schema, "columns": columns, "options": options}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ParseCache(object):
+    '''
+    Arrow IPC files in folder, at most quota_bytes in total
+
+    Parameters
+    ----------
+    folder : cache folder
+    quota_bytes : disk quota, the least recently used entries are removed beyond it
+    '''
+
+    _Suffix = ".arrow"
+
+    def __init__(self, folder, quota_bytes):
+        self.folder = folder
+        self.quota_bytes = quota_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + self._Suffix)
+
+    def get(self, key):
+        '''the memory-mapped table of key, None on a miss'''
+        path = self._path(key)
+        try:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        # the modification time orders the entries for eviction
+        os.utime(path)
+        return table
+
+    def put(self, key, table):
+        '''store table under key and evict beyond the quota'''
+        path = self._path(key)
+        tmp = path + ".tmp." + str(os.getpid())
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        self.evict(keep=path)
+
+    def entries(self):
+        '''(path, bytes, mtime) of the entries, least recently used first'''
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(self._Suffix):
+                path = os.path.join(self.folder, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self, keep=None):
+        '''remove the least recently used entries until the cache fits in the quota'''
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for path, size, _ in entries:
+            if total <= self.quota_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total = total - size
+        return total
@@ -0,0 +1,240 @@
+'''
+Pool aggregation cubes: vintage curves without the row-level performance data.
+
+build_cubes aggregates the performance rows of a vintage by LOAN_AGE and the loan segments
+(STATE, CSCORE_B bucket, OLTV bucket) in one grouped pass. The Loan_Data attributes are coded
+once per loan and gathered through an integer loan index, the cell of every row is one int64
+(mixed radix of the dimension codes) and the measures are np.bincount sums over the cells.
+
+    PoolCube      LOANS, UPB, BEG_UPB (LAST_UPB of the previous report), PREPAY_UPB and
+                  DEFAULT_UPB (BEG_UPB of the loans zero-balanced by prepayment / a credit
+                  event in the month), DLQ30_UPB, DLQ60_UPB, DLQ90P_UPB
+    DlqTransition LOANS and BEG_UPB by DLQ_FROM (status of the previous report) and DLQ_TO
+                  (status of the month, PREPAID / DEFAULT / ZB_OTHER for a zero balance)
+
+Every measure is a sum, so cubes of several vintages, or partial cubes of the same one, merge
+by addition (merge_cubes). The rollups are the grouping sets of the segments: a rolled-up
+dimension holds ALL, e.g. STATE == ALL, FICO_BKT == ALL, OLTV_BKT == ALL is the vintage curve.
+cube_rates and roll_rates turn the sums into SMM/CPR, MDR/CDR and roll rates.
+'''
+import itertools
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from src.features import LoanSegments, _dlq_codes, _rank_codes
+
+
+ALL = "ALL"
+NA = "NA"
+
+SEGMENTS = ("STATE", "FICO_BKT", "OLTV_BKT")
+
+# bucket edges (left-closed) and labels of CSCORE_B and OLTV, below the first edge is the first label
+FICO_EDGES = [620, 660, 700, 740, 780]
+FICO_LABELS = ["<620", "620-659", "660-699", "700-739", "740-779", "780+"]
+OLTV_EDGES = [60.001, 70.001, 80.001, 90.001, 95.001]
+OLTV_LABELS = ["<=60", "60-70", "70-80", "80-90", "90-95", ">95"]
+
+DLQ_LABELS = ["C", "30", "60", "90+", "X"]
+ZB_LABELS = ["PREPAID", "DEFAULT", "ZB_OTHER"]
+
+# ZB_CODE of a prepayment and of the credit events (third-party sale, short sale, REO, note sale)
+PREPAY_CODES = ("01",)
+DEFAULT_CODES = ("02", "03", "09", "15")
+
+POOL_MEASURES = ("LOANS", "UPB", "BEG_UPB", "PREPAY_UPB", "DEFAULT_UPB", "DLQ30_UPB", "DLQ60_UPB", "DLQ90P_UPB")
+TRANSITION_MEASURES = ("LOANS", "BEG_UPB")
+
+
+def _bucket(values, edges, labels):
+    '''bucket codes of values, len(labels) (NA) for missing and non-positive values'''
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.digitize(values, edges)
+    codes[~(values > 0)] = len(labels)
+    return codes
+
+
+def _loan_segments(loans):
+    '''per-loan codes and labels of the SEGMENTS; the last label of each is NA'''
+    state = pd.Series(loans["STATE"])
+    if isinstance(state.dtype, pd.CategoricalDtype):
+        state_codes, state_labels = state.cat.codes.values.astype(np.int64), state.cat.categories.astype(str)
+    else:
+        state_codes, state_labels = pd.factorize(state, sort=True)
+    state_codes = np.where(state_codes < 0, len(state_labels), state_codes)
+    return {"STATE": (state_codes, list(state_labels) + [NA]),
+            "FICO_BKT": (_bucket(loans["CSCORE_B"], FICO_EDGES, FICO_LABELS), FICO_LABELS + [NA]),
+            "OLTV_BKT": (_bucket(loans["OLTV"], OLTV_EDGES, OLTV_LABELS), OLTV_LABELS + [NA])}
+
+
+def _zb_class(values):
+    '''ZB_CODE to 0 (none), 1 + position in ZB_LABELS'''
+    ranks, labels = _rank_codes(values)
+    classes = np.array([1 if l in PREPAY_CODES else 2 if l in DEFAULT_CODES else 3 for l in labels] + [0],
+                       dtype=np.int8)
+    return classes[np.where(ranks < 0, len(labels), ranks)]
+
+
+def _dlq_class(dlq):
+    '''DLQ_STATUS codes to positions in DLQ_LABELS'''
+    out = np.clip(dlq, 0, 3).astype(np.int8)
+    out[(dlq == -2) | (dlq == -1)] = 4
+    return out
+
+
+def _group_sum(dims, measures):
+    '''
+    sums of the measures by the cells of the dims
+
+    dims : dict name -> (codes, labels), codes in 0 .. len(labels) - 1
+    measures : dict name -> array, int arrays are summed as int64
+
+    Returns
+    -------
+    out : dataframe, one row per non-empty cell, dims as labels
+    '''
+    key = np.zeros(len(next(iter(dims.values()))[0]), dtype=np.int64)
+    for codes, labels in dims.values():
+        key = key * len(labels) + codes
+    cells, inverse = np.unique(key, return_inverse=True)
+    out = {}
+    rest = cells
+    for name, (codes, labels) in reversed(list(dims.items())):
+        out[name] = np.asarray(labels, dtype=object)[rest % len(labels)]
+        rest = rest // len(labels)
+    out = {name: out[name] for name in dims}
+    for name, values in measures.items():
+        total = np.bincount(inverse, weights=values, minlength=len(cells))
+        out[name] = total.astype(np.int64) if np.issubdtype(np.asarray(values).dtype, np.integer) else total
+    return pd.DataFrame(out)
+
+
+def _rollups(cube, measures, segments=SEGMENTS, rollups=None):
+    '''cube plus its grouping sets: every subset of segments set to ALL (or the given subsets)'''
+    if rollups is None:
+        rollups = [c for n in range(1, len(segments) + 1) for c in itertools.combinations(segments, n)]
+    dims = [c for c in cube.columns if c not in measures]
+    parts = [cube]
+    for rolled in rollups:
+        part = cube.assign(**{d: ALL for d in rolled})
+        parts.append(part.groupby(dims, sort=False, observed=True)[list(measures)].sum().reset_index())
+    return pd.concat(parts, ignore_index=True)
+
+
+def build_cubes(loans, performance, acq=None, rollups=None, loan_index=None):
+    '''
+    the PoolCube and DlqTransition cubes of a vintage
+
+    Parameters
+    ----------
+    loans : Loan_Data (LOAN_ID, STATE, CSCORE_B, OLTV)
+    performance : Performance_Data (LOAN_ID, ACT_DTE, LOAN_AGE, LAST_UPB, DLQ_STATUS, and
+                  ZB_CODE for PREPAY_UPB, DEFAULT_UPB and the zero-balance transitions),
+                  plain or compact representation
+    acq : value of the ACQ column
+    rollups : list of tuples of SEGMENTS rolled up to ALL, None for every subset, [] for none
+    loan_index : array_like, optional, position of each performance row's loan in loans
+                 (e.g. PUBLIC_LOAN_FNMA.loan_index), -1 for an unknown loan
+
+    Returns
+    -------
+    out : dict with the "PoolCube" and "DlqTransition" dataframes
+    '''
+    seg = LoanSegments(performance["LOAN_ID"].values, performance["ACT_DTE"].values)
+    order = seg.order if seg.order is not None else slice(None)
+    if loan_index is None:
+        loan_index = pd.Index(np.asarray(loans["LOAN_ID"])).get_indexer(np.asarray(performance["LOAN_ID"]))
+    loan_index = np.asarray(loan_index)[order]
+
+    dims = {}
+    ages = np.asarray(performance["LOAN_AGE"], dtype=np.int64)[order]
+    min_age = int(ages.min()) if len(ages) else 0
+    age_labels = np.arange(min_age, int(ages.max()) + 1 if len(ages) else 1)
+    dims["LOAN_AGE"] = (ages - min_age, age_labels)
+    for name, (codes, labels) in _loan_segments(loans).items():
+        dims[name] = (np.where(loan_index < 0, len(labels) - 1, codes[np.maximum(loan_index, 0)]), labels)
+
+    upb = np.nan_to_num(np.asarray(performance["LAST_UPB"], dtype=np.float64)[order])
+    # the previous report of the same loan
+    has_lag = np.arange(len(upb)) - seg.first >= 1
+    beg_upb = np.where(has_lag, np.roll(upb, 1), 0)
+    dlq = _dlq_codes(performance["DLQ_STATUS"]).astype(np.int64)[order]
+    dlq_class = _dlq_class(dlq)
+    if "ZB_CODE" in performance.columns:
+        zb = _zb_class(performance["ZB_CODE"])[order]
+    else:
+        zb = np.zeros(len(upb), dtype=np.int8)
+
+    pool = _group_sum(dims, {"LOANS": np.ones(len(upb), dtype=np.int64),
+                             "UPB": upb,
+                             "BEG_UPB": beg_upb,
+                             "PREPAY_UPB": np.where(zb == 1, beg_upb, 0),
+                             "DEFAULT_UPB": np.where(zb == 2, beg_upb, 0),
+                             "DLQ30_UPB": np.where(dlq == 1, upb, 0),
+                             "DLQ60_UPB": np.where(dlq == 2, upb, 0),
+                             "DLQ90P_UPB": np.where(dlq >= 3, upb, 0)})
+
+    labels = DLQ_LABELS + ZB_LABELS
+    dlq_from = np.where(has_lag, np.roll(dlq_class, 1), -1)
+    dlq_to = np.where(zb > 0, len(DLQ_LABELS) - 1 + zb, dlq_class)
+    rows = has_lag & (dlq_from >= 0) & (dlq_to >= 0)
+    transition_dims = {k: (codes[rows], l) for k, (codes, l) in dims.items()}
+    transition_dims["DLQ_FROM"] = (dlq_from[rows].astype(np.int64), labels)
+    transition_dims["DLQ_TO"] = (dlq_to[rows].astype(np.int64), labels)
+    if rows.any():
+        transitions = _group_sum(transition_dims, {"LOANS": np.ones(int(rows.sum()), dtype=np.int64),
+                                                   "BEG_UPB": beg_upb[rows]})
+    else:
+        transitions = pd.DataFrame({k: pd.Series(dtype=object) for k in transition_dims})
+        transitions = transitions.assign(LOANS=pd.Series(dtype=np.int64), BEG_UPB=pd.Series(dtype=np.float64))
+
+    out = {"PoolCube": _rollups(pool, POOL_MEASURES, rollups=rollups),
+           "DlqTransition": _rollups(transitions, TRANSITION_MEASURES, rollups=rollups)}
+    for name, cube in out.items():
+        cube["LOAN_AGE"] = cube["LOAN_AGE"].astype(np.int32)
+        if acq is not None:
+            cube.insert(0, "ACQ", acq)
+    return out
+
+
+def merge_cubes(cubes, rollup=()):
+    '''
+    sum partial cubes of the same kind (e.g. per vintage) cell by cell
+
+    rollup : dimensions rolled up to ALL first, e.g. ("ACQ",) for the curves of all vintages;
+             their existing ALL rows are dropped so that nothing is counted twice
+    '''
+    cube = pd.concat(cubes, ignore_index=True)
+    measures = [c for c in cube.columns if c in POOL_MEASURES or c in TRANSITION_MEASURES]
+    dims = [c for c in cube.columns if c not in measures]
+    for d in rollup:
+        cube = cube[cube[d].astype(str) != ALL].assign(**{d: ALL})
+    return cube.groupby(dims, sort=True, observed=True)[measures].sum().reset_index()
+
+
+def read_cube(folder, filter=None):
+    '''
+    the cube written under folder (e.g. output/FNMA/PoolCube.parquet, ACQ partitions), as pandas
+
+    filter : pyarrow.dataset expression, e.g. (ds.field("STATE") == "ALL") & (ds.field("ACQ") == "2000Q1")
+    '''
+    return ds.dataset(folder, format="parquet", partitioning="hive").to_table(filter=filter).to_pandas()
+
+
+def cube_rates(cube):
+    '''PoolCube with SMM, CPR, MDR, CDR (annualized) and DLQ90P_PCT (UPB weighted)'''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        smm = cube["PREPAY_UPB"] / cube["BEG_UPB"]
+        mdr = cube["DEFAULT_UPB"] / cube["BEG_UPB"]
+        return cube.assign(SMM=smm, CPR=1 - (1 - smm) ** 12, MDR=mdr, CDR=1 - (1 - mdr) ** 12,
+                           DLQ90P_PCT=cube["DLQ90P_UPB"] / cube["UPB"])
+
+
+def roll_rates(transitions):
+    '''DlqTransition with ROLL_RATE (by loan count) and ROLL_RATE_UPB (by beginning UPB) per DLQ_FROM'''
+    dims = [c for c in transitions.columns if c not in TRANSITION_MEASURES and c != "DLQ_TO"]
+    totals = transitions.groupby(dims, sort=False, observed=True)[list(TRANSITION_MEASURES)].transform("sum")
+    return transitions.assign(ROLL_RATE=transitions["LOANS"] / totals["LOANS"],
+                              ROLL_RATE_UPB=transitions["BEG_UPB"] / totals["BEG_UPB"])
@@ -1,84 +1,72 @@
+import functools
+import io
+import os
+import shutil
+import time
+import warnings
 import numpy as np
 import pandas as pd
-import sqlalchemy as db
-from src.utilities import *
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from src import metrics
+from src.utilities import compute_amortization, compute_amortization_at, compute_amortization_path, cpr_to_smm, rate_matrix
+from src.compact import CategoryDictionary, encode_dlq_status, encode_loan_id, to_month_index
+from src.features import FEATURE_COLUMNS, derive_loan_events, loan_level_events
+from src.lazy import LazyFrame, scan
+from src.loan_index import build_loan_index, read_loans
+from src.loan_join import LoanWindow
+from src.parallel_read import read_ranges
+from src.parse_cache import ParseCache, cache_key
+from src.pool_cube import build_cubes
+from src.schema import ACQUISITION_SCHEMA, PERFORMANCE_SCHEMA, arrow_type, column_type, select_columns
+from src.shared_store import vintage_key
+from src.upb_cube import cube_key, open_or_build
 
 
 class PUBLIC_LOAN_FNMA(object):
     '''processing public loan data from Fannie Mae '''
 
     # schema of Acquisition Data
-    _AcquisitionSchema = {"LOAN_ID":         {"dtype": "string"},
-                          "ORIG_CHN":        {"dtype": "string"},
-                          "SellerName":      {"dtype": "string", "drop":True},
-                          "ORIG_RT":         {"dtype": "float"},
-                          "ORIG_AMT":        {"dtype": "double"},
-                          "ORIG_TRM":        {"dtype": "int" },
-                          "ORIG_DTE":        {"dtype": "date", "format":"%m/%Y", "format2":"MM/yyyy"},
-                          "FRST_DTE":        {"dtype": "date", "format":"%m/%Y", "format2":"MM/yyyy"},
-                          "OLTV":            {"dtype": "float", "default": 0},
-                          "OCLTV":           {"dtype": "float", "default": 0},
-                          "NUM_BO":          {"dtype": "int", "default": -1},
-                          "DTI":             {"dtype": "int", "default": -1},
-                          "CSCORE_B":        {"dtype": "float", "default": -1},
-                          "FTHB_FLG":        {"dtype": "string"},
-                          "PURPOSE":         {"dtype": "string"},
-                          "PROP_TYP":        {"dtype": "string"},
-                          "NUM_UNIT":        {"dtype": "int", "default": -1},
-                          "OCC_STAT":        {"dtype": "string"},
-                          "STATE":           {"dtype": "string"},
-                          "ZIP_3":           {"dtype": "string"},
-                          "MI_PCT":          {"dtype": "int", "default": 0},
-                          "Product_Type":    {"dtype": "string"},
-                          "CSCORE_C":        {"dtype": "int", "default": -1},
-                          "MI_TYPE":         {"dtype": "string", "default": "0"},
-                          "RELOCATION_FLG":  {"dtype": "string"}
-                          }
+    _AcquisitionSchema = ACQUISITION_SCHEMA
 
     # schema of Performance Data
-    _PerformanceSchema = {"LOAN_ID":         {"dtype": "string"},
-                          "ACT_DTE":         {"dtype": "date", "format":"%d/%m/%Y", "format2":"MM/dd/yyyy"},
-                          "SERVICER":        {"dtype": "string", "drop":True},
-                          "LAST_RT":         {"dtype": "float"},
-                          "LAST_UPB":        {"dtype": "double"},
-                          "LOAN_AGE":        {"dtype": "int"},
-                          "Months_To_Legal_Mat": {"dtype": "int", "default": -1},
-                          "Adj_Month_To_Mat": {"dtype": "int", "default": -1},
-                          "Maturity_Date":   {"dtype": "date",                      "format2":"MM/yyyy"},
-                          "MSA":             {"dtype": "string", "drop":True},
-                          "DLQ_STATUS":      {"dtype": "string"},
-                          "MOD_FLAG":        {"dtype": "string", "drop":True},
-                          "ZB_CODE":         {"dtype": "string", "drop":True},
-                          "ZB_DTE":          {"dtype": "date",   "drop":True,        "format2":"MM/yyyy"    },
-                          "LPI_DTE":         {"dtype": "date",   "drop":True,        "format2":"MM/dd/yyyy" },
-                          "FCC_DTE":         {"dtype": "date",   "drop":True,        "format2":"MM/dd/yyyy" },
-                          "DISP_DTE":         {"dtype": "date",   "drop":True,        "format2":"MM/dd/yyyy" },
-                          "FCC_COST":        {"dtype": "float", "drop":True},
-                          "PP_COST":         {"dtype": "float", "drop":True},
-                          "AR_COST":         {"dtype": "float", "drop":True},
-                          "IE_COST":         {"dtype": "float", "drop":True},
-                          "TAX_COST":        {"dtype": "float", "drop":True},
-                          "NS_PROCS":        {"dtype": "float", "drop":True},
-                          "CE_PROCS":        {"dtype": "float", "drop":True},
-                          "RMW_PROCS":       {"dtype": "float", "drop":True},
-                          "O_PROCS":         {"dtype": "float", "drop":True},
-                          "NON_INT_UPB":     {"dtype": "float"},
-                          "PRIN_FORG_UPB_FHFA": {"dtype": "float"},
-                          "REPCH_FLAG":      {"dtype": "string"},
-                          "PRIN_FORG_UPB_OTH": {"dtype": "string"},
-                          "TRANSFER_FLG":    {"dtype": "string"},
-                          }
-
-    def __init__(self, acqYYYYQQ, stageFolder=None,  acquisition_file=None, performance_file=None):
+    _PerformanceSchema = PERFORMANCE_SCHEMA
+
+    # file of the category dictionary shared by all vintages, in stageFolder
+    _CategoryDictionaryFile = "category_dictionary.json"
+
+    # folder of the agency in the output tree (resultFolder/output/<_Agency>/...) and of its UPB cubes in stageFolder
+    _Agency = "FNMA"
+    _UPBCubeFolder = "upb_cube"
+
+    def __init__(self, acqYYYYQQ, stageFolder=None,  acquisition_file=None, performance_file=None, compact=False,
+                 upb_cube=False, parse_cache_gb=None, lazy=False, shared_store=None):
         self.acqYYYYQQ = acqYYYYQQ
         self.acquisition_file = acquisition_file
         self.performance_file = performance_file
         self.stageFolder = stageFolder
+        self.compact = compact
+        self.upb_cube = upb_cube
+        self.parse_cache_gb = parse_cache_gb
+        self.lazy = lazy
+        self.shared_store = shared_store
+        self._attached = set()
+        self._parse_cache = None
         self._Loan_Data = None
         self._Performance_Data = None
+        # rows of Performance_Data whose LAST_UPB fill_last_upb backfilled
+        self._filled_upb = None
+        self._category_dictionary = None
+        self._schd_upb_cube = None
+        self.pool_cubes = None
 
     @property
     def Loan_Data(self):
+        if self.lazy:
+            return self.scan_loans()
+        if self._Loan_Data is None and self.shared_store is not None:
+            self._Loan_Data = self._attach("Loan")
         return self._Loan_Data
 
     @Loan_Data.setter
@@ -87,187 +75,690 @@ class PUBLIC_LOAN_FNMA(object):
 
     @property
     def Performance_Data(self):
+        if self.lazy:
+            return self.scan_performance()
+        if self._Performance_Data is None and self.shared_store is not None:
+            self._Performance_Data = self._attach("LoanPerformance")
         return self._Performance_Data
 
     @Performance_Data.setter
     def Performance_Data(self, x):
         self._Performance_Data = x
+        self._filled_upb = None
+
+    columnType = staticmethod(column_type)
+
+    arrowType = staticmethod(arrow_type)
 
     @staticmethod
-    def columnType(v):
-        vout = str
-        dtype = v.get('dtype')
-        if dtype == "float":
-            vout = np.float32
-        elif dtype == "double":
-            vout = np.float64
-        elif dtype  == "int":
-            value = v.get('default')
-            if value is None:
-                vout = np.int32
-            else:
-                vout = np.float32
-        elif dtype  == "string":
-            vout = str
-        elif dtype == "date":
-            vout = "date"
+    def arrowSchema(schema, columns=None):
+        return pa.schema([(k, PUBLIC_LOAN_FNMA.arrowType(v)) for k, v in schema.items()
+                          if columns is None or k in columns])
+
+    @staticmethod
+    def readOptions(schema):
+        '''
+        column names, pandas dtypes and date columns for pd.read_csv
+        '''
+        col_names = [k for k in schema.keys()]
+        col_dtype = {k: PUBLIC_LOAN_FNMA.columnType(v) for k, v in schema.items() \
+                     if PUBLIC_LOAN_FNMA.columnType(v) not in ("other", "date")}
+
+        parse_dates = [k for k, v in schema.items() \
+                       if PUBLIC_LOAN_FNMA.columnType(v) == "date"]
+        return col_names, col_dtype, parse_dates
+
+    selectColumns = staticmethod(select_columns)
+
+    @staticmethod
+    def parse_dates(df, schema):
+        '''
+        convert the date columns read as strings with the schema "format"
+        '''
+        with metrics.stage("parse_dates", rows_in=len(df), rows_out=len(df)):
+            for k, v in schema.items():
+                if v.get('dtype') == "date" and k in df.columns:
+                    df[k] = pd.to_datetime(df[k], format=v.get('format')).astype("datetime64[ns]")
+        return df
+
+    def outputSchema(self, schema):
+        '''
+        schema of the frames produced from files read with schema (see conform), used for the
+        compact representation and the Parquet schema of the streamed output
+        '''
+        return schema
+
+    def outputColumns(self, schema, columns=None):
+        '''columns of the frames conform produces from the columns read with schema'''
+        return [k for k in schema.keys()] if columns is None else list(columns)
+
+    def conform(self, df, schema, columns=None):
+        '''
+        the frame read with schema (and the columns of selectColumns) in the output layout;
+        the FNMA files already are, other agencies map their layout onto it (see PUBLIC_LOAN_FRED)
+        '''
+        return df
+
+    def read_csv(self, file, schema, engine="pandas", chunksize=None, block_size=None, columns=None):
+        '''
+        read a pipe-delimited file typed by schema, date columns parsed with the schema "format"
+
+        Parameters
+        ----------
+        file: path of the file
+        schema: _AcquisitionSchema or _PerformanceSchema
+        engine: "pandas" (pd.read_csv) or "pyarrow" (pyarrow.csv, multithreaded block parsing)
+        chunksize: int, optional, rows per chunk (pandas) and, approximately, per block (pyarrow)
+        block_size: int, optional, bytes per pyarrow block, overrides the size derived from chunksize
+        columns: list, optional, only these columns are parsed (see selectColumns)
+
+        Returns
+        -------
+        out : pandas dataframe, or an iterator of pandas dataframes when chunksize is given.
+              Defaults are not filled.
+        '''
+        col_names, col_dtype, parse_dates = PUBLIC_LOAN_FNMA.readOptions(schema)
+
+        if engine == "pandas":
+            col_dtype.update({k: str for k in parse_dates})
+            if chunksize is None:
+                with metrics.stage("read_csv", engine=engine, read_path=file) as stage:
+                    df = pd.read_csv(file, delimiter='|', header=None, names=col_names, usecols=columns,
+                                     dtype=col_dtype)
+                    stage.set(rows_out=len(df))
+                return PUBLIC_LOAN_FNMA.parse_dates(df, schema)
+            reader = pd.read_csv(file, delimiter='|', header=None,
+                                 names=col_names,
+                                 usecols=columns,
+                                 dtype=col_dtype,
+                                 chunksize=chunksize
+                                 )
+            return (PUBLIC_LOAN_FNMA.parse_dates(df, schema) for df in reader)
+
+        elif engine == "pyarrow":
+            if block_size is None and chunksize is not None:
+                block_size = chunksize * 128
+            column_types = {k: pa.from_numpy_dtype(v) if v is not str else pa.string() for k, v in col_dtype.items()}
+            column_types.update({k: pa.timestamp("ns") for k in parse_dates})
+            timestamp_parsers = sorted({v['format'] for k, v in schema.items() if k in parse_dates and 'format' in v},
+                                       key=len, reverse=True)
+            read_options = pacsv.ReadOptions(column_names=col_names, use_threads=True,
+                                             **({} if block_size is None else {"block_size": block_size}))
+            parse_options = pacsv.ParseOptions(delimiter='|', quote_char=False)
+            convert_options = pacsv.ConvertOptions(column_types=column_types,
+                                                   include_columns=columns,
+                                                   timestamp_parsers=timestamp_parsers,
+                                                   strings_can_be_null=True)
+            if chunksize is None:
+                with metrics.stage("read_csv", engine=engine, read_path=file) as stage:
+                    table = pacsv.read_csv(file, read_options=read_options, parse_options=parse_options,
+                                           convert_options=convert_options)
+                    stage.set(rows_out=table.num_rows)
+                return table.to_pandas()
+            reader = pacsv.open_csv(file, read_options=read_options, parse_options=parse_options,
+                                    convert_options=convert_options)
+            return (batch.to_pandas() for batch in reader)
+
         else:
-            vout = "other"
-        return vout
+            raise ValueError("unknown engine: {0}".format(engine))
+
+    @staticmethod
+    def fill_defaults(df, schema):
+        '''
+        fill the missing values with the schema defaults, int columns become int32
+        '''
+        with metrics.stage("fill_defaults", rows_in=len(df), rows_out=len(df)):
+            for k, v in schema.items():
+                value = v.get('default')
+                if value is not None and k in df.columns:
+                    if v.get("dtype") == "int":
+                        df[k] = df[k].fillna(value).astype("int32")
+                    else:
+                        df[k] = df[k].fillna(value)
+        return df
 
 
-    def read_data_acquisition(self, acquisition_file=None):
+    def read_data_acquisition(self, acquisition_file=None, engine="pandas", project=False, keep_columns=None):
         '''
         read and pre-process acqusition data
+
+        engine: "pandas" or "pyarrow", see read_csv
+        project, keep_columns: skip the "drop" columns at parse time, see selectColumns
         '''
         if acquisition_file is not None:
             self.acquisition_file = acquisition_file
 
-        col_names = [ k for k in self._AcquisitionSchema.keys()]
-        col_dtype = { k: PUBLIC_LOAN_FNMA.columnType(v) for k, v in self._AcquisitionSchema.items() \
-                         if PUBLIC_LOAN_FNMA.columnType(v) not in ( "other", "date") }
+        columns = PUBLIC_LOAN_FNMA.selectColumns(self._AcquisitionSchema, project, keep_columns)
 
-        parse_dates =[ k for k, v in self._AcquisitionSchema.items() \
-                         if PUBLIC_LOAN_FNMA.columnType(v) == "date" ]
+        def read():
+            df = self.read_csv(self.acquisition_file, self._AcquisitionSchema, engine=engine, columns=columns)
+            with metrics.stage("fill_defaults", rows_in=len(df), rows_out=len(df)):
+                df['OCLTV'] = df['OCLTV'].fillna(df['OLTV'])
+            return self.conform(df, self._AcquisitionSchema, columns)
 
-        print(parse_dates)
-
-        df = pd.read_csv(self.acquisition_file, delimiter ='|', header=None,
-                    names=col_names,
-                    dtype=col_dtype,  parse_dates = parse_dates
-                    )
-        df['OCLTV'] = df['OCLTV'].fillna(df['OLTV'])
-        self.Loan_Data = df
+        with metrics.stage("read_data_acquisition", acq=self.acqYYYYQQ, agency=self._Agency) as stage:
+            df = self.read_cached(self.acquisition_file, self._AcquisitionSchema, columns, read)
+            if self.compact:
+                df = self.compact_frame(df, self.outputSchema(self._AcquisitionSchema))
+            self.Loan_Data = df
+            stage.set(rows_out=len(df))
         return None
 
 
-    def read_data_performance(self, performance_file=None):
+    def read_data_performance(self, performance_file=None, fill_upb=True, engine="pandas",
+                              project=False, keep_columns=None, features=False, workers=None, cubes=False):
         '''
         read and pre-process performance data
+
+        fill_upb: backfill missing LAST_UPB with the scheduled UPB when Loan_Data is loaded
+        engine: "pandas" or "pyarrow", see read_csv
+        project, keep_columns: skip the "drop" columns at parse time, see selectColumns
+        features: derive the loan events, see derive_features
+        workers: parse newline-aligned byte ranges of the file in this many processes
+                 (src.parallel_read); the rows keep the file order
+        cubes: aggregate the pool cubes once the data is read, see build_pool_cubes
         '''
         if performance_file is not None:
             self.performance_file = performance_file
+        if features and project:
+            keep_columns = list(keep_columns or []) + [c for c in FEATURE_COLUMNS if c in self._PerformanceSchema]
+        if cubes and project:
+            keep_columns = list(keep_columns or []) + ["ZB_CODE"]
+
+        columns = PUBLIC_LOAN_FNMA.selectColumns(self._PerformanceSchema, project, keep_columns)
+
+        def read():
+            if workers is not None and workers > 1:
+                parse = functools.partial(_parse_performance_bytes, engine=engine, columns=columns, cls=type(self))
+                return read_ranges(self.performance_file, parse, workers=workers).to_pandas()
+            df = self.read_csv(self.performance_file, self._PerformanceSchema, engine=engine, columns=columns)
+            df = PUBLIC_LOAN_FNMA.fill_defaults(df, self._PerformanceSchema)
+            return self.conform(df, self._PerformanceSchema, columns)
+
+        with metrics.stage("read_data_performance", acq=self.acqYYYYQQ, agency=self._Agency, workers=workers) as stage:
+            df = self.read_cached(self.performance_file, self._PerformanceSchema, columns, read)
+
+            if self.compact:
+                df = self.compact_frame(df, self.outputSchema(self._PerformanceSchema))
+            self.Performance_Data = df
+            if fill_upb:
+                self.fill_last_upb()
+            if features:
+                self.derive_features()
+            if cubes:
+                self.build_pool_cubes()
+            stage.set(rows_out=len(self._Performance_Data))
+        return None
 
-        col_names = [k for k in self._PerformanceSchema.keys()]
-        col_dtype = {k: PUBLIC_LOAN_FNMA.columnType(v) for k, v in self._PerformanceSchema.items() \
-                     if PUBLIC_LOAN_FNMA.columnType(v) not in ("other", "date")}
+    def build_pool_cubes(self, resultFolder=None, rollups=None):
+        '''
+        aggregate Performance_Data into the PoolCube and DlqTransition cubes of the vintage
+        (src.pool_cube.build_cubes), the Loan_Data segments joined by integer loan index
 
-        parse_dates = [k for k, v in self._PerformanceSchema.items() \
-                       if PUBLIC_LOAN_FNMA.columnType(v) == "date"]
+        The cubes are kept in pool_cubes and, when resultFolder (default to stageFolder) exists,
+        written to resultFolder/output/<_Agency>/<PoolCube|DlqTransition>.parquet/ACQ=<acqYYYYQQ>.
 
-        df = pd.read_csv(self.performance_file, delimiter='|', header=None,
-                         names=col_names,
-                         dtype=col_dtype,
-                         parse_dates=parse_dates
-                         )
-
-        for k, v in self._PerformanceSchema.items():
-            value = v.get('default')
-            if value is not None:
-                if v.get("dtype") == "int":
-                    df[k] = df[k].fillna(value).astype("int32")
-                else:
-                    df[k] = df[k].fillna(value)
-
-        self.Performance_Data = df
-        return None
-        #df["ACQ"] = self.acqYYYYQQ
-        #if self.resultFolder is not None:
-        #   df.to_parquet(self.resultFolder + "\\performance.parquet", engine='pyarrow', partition_cols=['ACQ'])
-      
-    @decorator_time
-    def read_data_performance_chunk(self, performance_file=None, **kwargs):
+        rollups: grouping sets of the segments, see build_cubes
+
+        Returns
+        -------
+        out : dict with the "PoolCube" and "DlqTransition" dataframes
         '''
-        read and pre-process performance data
+        if resultFolder is None:
+            resultFolder = self.stageFolder
+        with metrics.stage("build_pool_cubes", acq=self.acqYYYYQQ, agency=self._Agency,
+                           rows_in=len(self._Performance_Data)) as stage:
+            self.pool_cubes = build_cubes(self._Loan_Data, self._Performance_Data, acq=self.acqYYYYQQ,
+                                          rollups=rollups,
+                                          loan_index=self.loan_index(self._Performance_Data["LOAN_ID"]))
+            stage.set(rows_out=sum(len(v) for v in self.pool_cubes.values()))
+        if resultFolder is not None and os.path.isdir(resultFolder):
+            for name, cube in self.pool_cubes.items():
+                folder = os.path.join(resultFolder, "output", self._Agency, name + ".parquet", "ACQ=" + self.acqYYYYQQ)
+                # ACQ is the partition
+                self._write_vintage_parquet(cube.drop(columns="ACQ"), folder, 500000)
+        return self.pool_cubes
+
+    def derive_features(self):
+        '''
+        derive the loan events of Performance_Data with the NumPy engine (src.features)
 
-        df.write.mode('append').parquet('parquet_data_file')
+        Performance_Data is sorted by LOAN_ID and ACT_DTE; the first modification (MOD_*),
+        first 90+ days delinquency (F3Q_*) and zero balance (ZB_*) columns are left-joined onto
+        Loan_Data, or become Loan_Data (one row per loan with an event) when it is not loaded.
+        '''
+        with metrics.stage("derive_features", acq=self.acqYYYYQQ, rows_in=len(self._Performance_Data)) as stage:
+            events = derive_loan_events(self._Performance_Data)
+            stage.set(rows_out=sum(len(v) for v in events.values()))
+        with metrics.stage("join_events", acq=self.acqYYYYQQ) as stage:
+            if self._Loan_Data is None:
+                self.Loan_Data = loan_level_events(events)
+            else:
+                df = self._Loan_Data
+                for k in ("Mod", "F3Q", "ZB"):
+                    df = df.merge(events[k], on="LOAN_ID", how="left")
+                self.Loan_Data = df
+            stage.set(rows_out=len(self._Loan_Data))
+        with metrics.stage("sort", acq=self.acqYYYYQQ, rows_in=len(self._Performance_Data)):
+            self.Performance_Data = self._Performance_Data.sort_values(["LOAN_ID", "ACT_DTE"], kind="stable",
+                                                                      ignore_index=True)
+        return None
 
+    def read_data_performance_chunk(self, performance_file=None, resultFolder=None, chunksize=500000,
+                                    row_group_size=500000, partition_by_year=False, engine="pandas",
+                                    project=False, keep_columns=None, loan_columns=None, loan_chunksize=100000):
+        '''
+        stream the performance file into a Parquet dataset with bounded memory
+
+        Each chunk is typed and default-filled like read_data_performance and appended to
+        resultFolder/output/<_Agency>/LoanPerformance.parquet/ACQ=<acqYYYYQQ>/[ACT_YEAR=<yyyy>/]part-0.parquet,
+        the layout used by save_as_parquet. Only about chunksize rows (plus the buffered row groups)
+        are held in memory at any time. The vintage partition is overwritten and its LOAN_ID index
+        (src.loan_index) rebuilt; the rows keep the file order, which groups the rows by loan.
+
+        With loan_columns the rows are enriched with these Loan_Data columns by a merge-join on
+        LOAN_ID (src.loan_join) and written to LoanPerformanceJoined.parquet instead: the
+        acquisition file is read alongside in chunks of loan_chunksize rows, or the loaded
+        Loan_Data used, so memory stays proportional to the chunk sizes. Both files must be
+        ordered by LOAN_ID, as published; the rows without a loan get missing values.
+
+        Parameters
+        ----------
+        resultFolder: root folder of the output tree, default to stageFolder
+        chunksize: rows parsed per chunk
+        row_group_size: rows per Parquet row group
+        partition_by_year: also partition by the activity year of ACT_DTE
+        engine: "pandas" or "pyarrow", see read_csv
+        project, keep_columns: skip the "drop" columns at parse time, see selectColumns
+        loan_columns: list, optional, output columns of the acquisition file added to every row
+        loan_chunksize: acquisition rows parsed per chunk
+
+        Returns
+        -------
+        out : dict with rows, seconds, rows_per_sec and the written files
         '''
         if performance_file is not None:
             self.performance_file = performance_file
+        if resultFolder is None:
+            resultFolder = self.stageFolder
+
+        columns = PUBLIC_LOAN_FNMA.selectColumns(self._PerformanceSchema, project, keep_columns)
+        output_schema = self.outputSchema(self._PerformanceSchema)
+        output_columns = self.outputColumns(self._PerformanceSchema, columns)
+        arrow_schema = pa.schema([(k, PUBLIC_LOAN_FNMA.arrowType(output_schema[k])) for k in output_columns])
+
+        name = "LoanPerformance"
+        window = None
+        if loan_columns:
+            loan_columns = list(loan_columns)
+            loan_schema = self.outputSchema(self._AcquisitionSchema)
+            unknown = set(loan_columns) - set(loan_schema)
+            if unknown:
+                raise ValueError("unknown columns: {0}".format(sorted(unknown)))
+            overlap = (set(loan_columns) & set(output_columns)) | ({"LOAN_ID"} & set(loan_columns))
+            if overlap:
+                raise ValueError("loan columns already in the performance rows: {0}".format(sorted(overlap)))
+            window = self._loan_window(loan_columns, engine, loan_chunksize)
+            for k in loan_columns:
+                arrow_schema = arrow_schema.append(pa.field(k, PUBLIC_LOAN_FNMA.arrowType(loan_schema[k])))
+            name = "LoanPerformanceJoined"
+
+        vintage_folder = os.path.join(resultFolder, "output", self._Agency, name + ".parquet", "ACQ=" + self.acqYYYYQQ)
+        if os.path.isdir(vintage_folder):
+            shutil.rmtree(vintage_folder)
+
+        writers = {}
+        buffers = {}
+
+        def flush(partition):
+            tables = buffers.pop(partition)
+            if partition not in writers:
+                folder = vintage_folder if partition is None else os.path.join(vintage_folder, "ACT_YEAR=" + partition)
+                os.makedirs(folder, exist_ok=True)
+                writers[partition] = pq.ParquetWriter(os.path.join(folder, "part-0.parquet"), arrow_schema)
+            table = pa.concat_tables(tables)
+            with metrics.stage("write_parquet", rows_in=table.num_rows):
+                writers[partition].write_table(table, row_group_size=row_group_size)
+
+        ts = time.time()
+        rows = 0
+        with metrics.stage("read_data_performance_chunk", acq=self.acqYYYYQQ, engine=engine,
+                           read_path=self.performance_file) as stage:
+            try:
+                for df in self.read_csv(self.performance_file, self._PerformanceSchema, engine=engine,
+                                        chunksize=chunksize, columns=columns):
+                    df = PUBLIC_LOAN_FNMA.fill_defaults(df, self._PerformanceSchema)
+                    df = self.conform(df, self._PerformanceSchema, columns)
+                    if window is not None:
+                        with metrics.stage("loan_join", rows_in=len(df), rows_out=len(df)):
+                            df = pd.concat([df.reset_index(drop=True), window.lookup(df["LOAN_ID"].values)], axis=1)
+                    rows = rows + len(df)
+                    if partition_by_year:
+                        years = df["ACT_DTE"].dt.year.fillna(-1).astype(int).astype(str).replace("-1", "__HIVE_DEFAULT_PARTITION__")
+                        parts = df.groupby(years.values, sort=False)
+                    else:
+                        parts = [(None, df)]
+
+                    for partition, part in parts:
+                        table = pa.Table.from_pandas(part, schema=arrow_schema, preserve_index=False)
+                        buffers.setdefault(partition, []).append(table)
+                        if sum(t.num_rows for t in buffers[partition]) >= row_group_size:
+                            flush(partition)
+
+                    # keep the total buffered rows bounded when there are many partitions
+                    while buffers and sum(t.num_rows for v in buffers.values() for t in v) > 2 * row_group_size:
+                        flush(max(buffers, key=lambda k: sum(t.num_rows for t in buffers[k])))
+
+                for partition in list(buffers):
+                    flush(partition)
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            if writers:
+                build_loan_index(vintage_folder)
+            stage.set(rows_out=rows, written_path=vintage_folder)
+            if window is not None:
+                stage.set(loans_read=window.rows_read, loan_window_peak=window.peak_rows)
+
+        seconds = time.time() - ts
+        rows_per_sec = rows / seconds if seconds > 0 else float("nan")
+        return {"rows": rows, "seconds": seconds, "rows_per_sec": rows_per_sec,
+                "files": [w.where for w in writers.values()]}
+
+    def _loan_window(self, loan_columns, engine, chunksize):
+        '''
+        LoanWindow over the LOAN_ID and loan_columns of the loans: the loaded Loan_Data when it
+        is in the plain representation, the acquisition file read in chunks otherwise
+        '''
+        if self._Loan_Data is not None and not self.compact:
+            return LoanWindow([self._Loan_Data[["LOAN_ID"] + loan_columns]])
 
-        col_names = [k for k in self._PerformanceSchema.keys()]
-        col_dtype = {k: PUBLIC_LOAN_FNMA.columnType(v) for k, v in self._PerformanceSchema.items() \
-                     if PUBLIC_LOAN_FNMA.columnType(v) not in ("other", "date")}
+        needed = {"LOAN_ID", "OLTV"} | set(loan_columns)
+        columns = [k for k in self._AcquisitionSchema if k in needed]
 
-        parse_dates = [k for k, v in self._PerformanceSchema.items() \
-                       if PUBLIC_LOAN_FNMA.columnType(v) == "date"]
+        def chunks():
+            for df in self.read_csv(self.acquisition_file, self._AcquisitionSchema, engine=engine,
+                                    chunksize=chunksize, columns=columns):
+                if "OCLTV" in df.columns:
+                    df['OCLTV'] = df['OCLTV'].fillna(df['OLTV'])
+                df = self.conform(df, self._AcquisitionSchema, columns)
+                yield df[["LOAN_ID"] + loan_columns]
+        return LoanWindow(chunks())
 
-        
-        db_engine_file = 'sqlite:///' + self.stageFolder + "\\performance10.db"
-        db_engine = db.create_engine(db_engine_file)
-
-        chunksize = 10000
-        loop = 0
-        create_it = True
-        pqwriter = None
-        for df in pd.read_csv(self.performance_file, delimiter='|', header=None,
-                         chunksize=chunksize, iterator=True,
-                         names=col_names,
-                         dtype=col_dtype,
-                         parse_dates=parse_dates
-                         ):
-            loop = loop + 1
-            print(loop)
-            for k, v in self._PerformanceSchema.items():
-                value = v.get('default')
-                if value is not None:
-                    if v.get("dtype") == "int":
-                       df[k] = df[k].fillna(value).astype("int32")
-                    else:
-                       df[k] = df[k].fillna(value)
+    @property
+    def parse_cache(self):
+        '''
+        the cache of parsed input files in stageFolder/parse_cache, None when parse_cache_gb is not set
+        '''
+        if self.parse_cache_gb is None or self.stageFolder is None:
+            return None
+        if self._parse_cache is None:
+            self._parse_cache = ParseCache(os.path.join(self.stageFolder, "parse_cache"),
+                                           int(self.parse_cache_gb * 2 ** 30))
+        return self._parse_cache
+
+    def read_cached(self, file, schema, columns, read):
+        '''
+        the typed, default-filled frame of file: from the parse cache when the file, schema and
+        columns are unchanged, otherwise read() stored in the cache
+
+        Parameters
+        ----------
+        file: path of the source file
+        schema, columns: as passed to read_csv, part of the cache key
+        read: callable returning the frame on a miss
+        '''
+        cache = self.parse_cache
+        if cache is None:
+            return read()
+        key = cache_key(file, schema, columns)
+        with metrics.stage("parse_cache_get", key=key) as stage:
+            table = cache.get(key)
+            stage.set(hit=table is not None)
+            if table is not None:
+                df = table.to_pandas()
+                stage.set(rows_out=len(df), bytes_read=table.nbytes)
+                return df
+        df = read()
+        with metrics.stage("parse_cache_put", key=key, rows_in=len(df)):
+            cache.put(key, pa.Table.from_pandas(df, preserve_index=False))
+        return df
 
+    @property
+    def category_dictionary(self):
+        if self._category_dictionary is None:
+            path = None
+            if self.stageFolder is not None:
+                path = os.path.join(self.stageFolder, self._CategoryDictionaryFile)
+            self._category_dictionary = CategoryDictionary(path)
+        return self._category_dictionary
+
+    def compact_frame(self, df, schema):
+        '''
+        compact in-memory representation of a frame read with schema
 
-            print("save_sqlite")
-            if create_it:
-               df.to_sql("perf", db_engine, if_exists='replace')
-               #table = pa.Table.from_pandas(df)
-               #pqwriter = pq.ParquetWriter(self.resultFolder + "\\performance2.parquet", table.schema)
-               #pqwriter.write_table(table)
-               create_it = False
+        LOAN_ID becomes int64, DLQ_STATUS int8 (null -1, "X" -2), dates int32 month indexes
+        (year * 12 + month - 1, -1 when missing) and the other string columns categoricals
+        coded with the category dictionary shared by all vintages in stageFolder.
+        '''
+        with metrics.stage("compact", rows_in=len(df), rows_out=len(df)), self.category_dictionary.locked():
+            for k, v in schema.items():
+                if k not in df.columns or isinstance(df[k].dtype, pd.CategoricalDtype):
+                    continue
+                if k == "LOAN_ID":
+                    df[k] = encode_loan_id(df[k])
+                elif k == "DLQ_STATUS":
+                    df[k] = encode_dlq_status(df[k])
+                elif v.get('dtype') == "date":
+                    df[k] = to_month_index(df[k])
+                elif v.get('dtype') == "string":
+                    df[k] = self.category_dictionary.encode(k, df[k])
+        return df
+
+    def compact_data(self):
+        '''
+        convert the loaded Loan_Data and Performance_Data to the compact representation
+        '''
+        self.compact = True
+        if self._Loan_Data is not None:
+            self.Loan_Data = self.compact_frame(self._Loan_Data, self.outputSchema(self._AcquisitionSchema))
+        if self._Performance_Data is not None:
+            self.Performance_Data = self.compact_frame(self._Performance_Data, self.outputSchema(self._PerformanceSchema))
+        return None
+
+    def memory_report(self):
+        '''
+        rows, bytes and bytes per row of Loan_Data and Performance_Data
+
+        Returns
+        -------
+        out : pandas dataframe, one row per loaded frame
+        '''
+        report = []
+        for name in ("Loan_Data", "Performance_Data"):
+            df = getattr(self, "_" + name)
+            if df is None:
+                continue
+            nbytes = int(df.memory_usage(index=True, deep=True).sum())
+            report.append({"data": name, "rows": len(df), "bytes": nbytes,
+                           "bytes_per_row": nbytes / len(df) if len(df) else float("nan")})
+        return pd.DataFrame(report, columns=["data", "rows", "bytes", "bytes_per_row"]).set_index("data")
+
+    def save_as_parquet(self, resultFolder= None, Loan_Data =True, Performance_Data=True, row_group_size=500000,
+                        raise_errors=False):
+       '''
+       write Loan_Data and Performance_Data to resultFolder/output/<_Agency>/Loan.parquet/ACQ=<acqYYYYQQ>/part-0.parquet
+       and resultFolder/output/<_Agency>/LoanPerformance.parquet/ACQ=<acqYYYYQQ>/part-0.parquet,
+       overwriting the vintage partition
+
+       The performance rows are written sorted by LOAN_ID and ACT_DTE, with row-group statistics
+       and the LOAN_ID index of src.loan_index, see query_performance.
+
+       raise_errors: raise the write errors (and a missing resultFolder) instead of warning (RuntimeWarning)
+       '''
+       if resultFolder is None:
+            resultFolder = self.stageFolder
+       if resultFolder is None or not os.path.isdir(resultFolder):
+            if raise_errors:
+                 raise ValueError("save_as_parquet: no result folder {0}".format(resultFolder))
+            return None
+       # the compact representation keeps its codes
+       loan_schema = None if self.compact else self.outputSchema(self._AcquisitionSchema)
+       performance_schema = None if self.compact else self.outputSchema(self._PerformanceSchema)
+       try:
+            if (Loan_Data == True) and (self._Loan_Data is not None):
+              self._write_vintage_parquet(self._Loan_Data, resultFolder + "/output/" + self._Agency + "/Loan.parquet/ACQ=" + self.acqYYYYQQ, row_group_size,
+                                          schema=loan_schema)
+            if (Performance_Data == True) and (self._Performance_Data is not None):
+              folder = resultFolder + "/output/" + self._Agency + "/LoanPerformance.parquet/ACQ=" + self.acqYYYYQQ
+              self._write_vintage_parquet(self._Performance_Data, folder, row_group_size,
+                                          sort_by=["LOAN_ID", "ACT_DTE"], schema=performance_schema)
+              build_loan_index(folder)
+       except Exception as err:
+            if raise_errors:
+                 raise
+            warnings.warn("save_as_parquet: {0}".format(err), RuntimeWarning)
+
+    @staticmethod
+    def _write_vintage_parquet(df, folder, row_group_size, sort_by=None, schema=None):
+       '''
+       write df as folder/part-0.parquet, replacing folder
+
+       schema: file schema (see src.schema) of the columns of df in the plain representation; they
+               are written with their arrowType (date32, float32, ...), as by read_data_performance_chunk,
+               and the other strings as string instead of the large_string of pandas
+       '''
+       with metrics.stage("write_parquet", rows_in=len(df), folder=folder) as stage:
+            if sort_by is not None:
+                 df = df.sort_values(sort_by, kind="stable", ignore_index=True)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            fields = []
+            for field in table.schema:
+                 if schema is not None and field.name in schema:
+                      field = field.with_type(PUBLIC_LOAN_FNMA.arrowType(schema[field.name]))
+                 elif pa.types.is_large_string(field.type):
+                      field = field.with_type(pa.string())
+                 fields.append(field)
+            table = table.cast(pa.schema(fields, metadata=table.schema.metadata))
+            if os.path.isdir(folder):
+                 shutil.rmtree(folder)
+            os.makedirs(folder)
+            pq.write_table(table, os.path.join(folder, "part-0.parquet"),
+                           row_group_size=row_group_size, write_statistics=True)
+            stage.set(written_path=folder)
+
+    def query_performance(self, filters=None, loan_ids=None, columns=None, resultFolder=None):
+       '''
+       performance history of the loans matching filters, read from the written vintage partition
+
+       The filters are resolved against Loan_Data (or the written Loan.parquet partition when
+       Loan_Data is not loaded); only the row groups of LoanPerformance.parquet/ACQ=<acqYYYYQQ>
+       that hold the matching loans are then read, see src.loan_index.read_loans.
+
+       Parameters
+       ----------
+       filters: loan-attribute filters in the pyarrow DNF form, e.g. [("STATE", "==", "CA"), ("CSCORE_B", "<", 620)]
+       loan_ids: array_like, optional, restrict to these loans
+       columns: list, optional, performance columns returned
+       resultFolder: root folder of the output tree, default to stageFolder
+
+       Returns
+       -------
+       out : pandas dataframe, rows sorted by LOAN_ID and ACT_DTE when the partition was written by save_as_parquet
+       '''
+       if resultFolder is None:
+            resultFolder = self.stageFolder
+       folder = os.path.join(resultFolder, "output", self._Agency, "LoanPerformance.parquet", "ACQ=" + self.acqYYYYQQ)
+       if filters is not None:
+            if self._Loan_Data is not None:
+                 loans = pa.Table.from_pandas(self._Loan_Data[["LOAN_ID"] + sorted({f[0] for f in _flatten_filters(filters)})],
+                                              preserve_index=False)
+                 loans = loans.filter(pq.filters_to_expression(filters))
             else:
-               df.to_sql("perf", db_engine, if_exists='append')
-
-               #table = pa.Table.from_pandas(df)
-               #pqwriter.write_table(table)
-        # close the parquet writer
-        if pqwriter:
-            pqwriter.close()
-        
-        ##self.SQLite2Parquet("performance9.db",  "performance.parquet")
-        return d
-
-    def SQLite2Parquet(self, dbFile, parquetFile):
-        print("SQLite2Parquet")
-        db_engine_file = 'sqlite:///' + self.resultFolder + "\\" + dbFile
-        db_engine = db.create_engine(db_engine_file)
-        df =  pd.read_sql_query("select * from  perf ", db_engine )
-        #db_engine.close()
-        print("finsing reading")
-        df["ACQ"] = self.acqYYYYQQ
-        df.to_parquet(self.resultFolder + "\\" + parquetFile, engine='pyarrow', partition_cols=['ACQ'])
-        return True
-
-    def save_as_parquet(self, resultFolder= None, Loan_Data =True, Performance_Data=True):
-       if resultFolder is not None:
-            if os.path.isdir(resultFolder):
-              try:
-                 if (Loan_Data == True) and (self.Loan_Data is not None):
-                   self.Loan_Data.write.mode('overwrite').parquet(resultFolder + "/output/FNMA/Loan.parquet/ACQ=" + self.acqYYYYQQ)
-                 if (Performance_Data == True) and (self.Performance_Data is not None):
-                   self.Performance_Data.write.mode('overwrite').parquet(resultFolder + "/output/FNMA/LoanPerformance.parquet/ACQ=" + self.acqYYYYQQ)
-              except Exception as err:
-                  print("save_as_parquet: Error:  {0}".format(err))
+                 loans = pq.read_table(os.path.join(resultFolder, "output", self._Agency, "Loan.parquet", "ACQ=" + self.acqYYYYQQ),
+                                       columns=["LOAN_ID"], filters=filters)
+            matched = loans.column("LOAN_ID").to_numpy(zero_copy_only=False)
+            if loan_ids is not None:
+                 matched = matched[np.isin(matched, np.asarray(loan_ids))]
+            loan_ids = matched
+       elif loan_ids is None:
+            raise ValueError("query_performance: give filters or loan_ids")
+       with metrics.stage("query_performance", acq=self.acqYYYYQQ, loans=len(loan_ids)) as stage:
+            table = read_loans(folder, loan_ids, columns=columns)
+            stage.set(rows_out=table.num_rows)
+       return table.to_pandas()
 
     def clear_data(self):
-       if _Loan_Data is not None:
-         del _Loan_Data
-         _Loan_Data = None
-       if _Performance_Data is not None:
-         del _Performance_Data
-         _Performance_Data = None
-       
-    def compute_schd_upb(self, monthCount, outAsMatrix=True, loan_Pandas_Dataframe=None):
+       '''release the in-memory Loan_Data and Performance_Data, and the shared_store entries attached'''
+       self._Loan_Data = None
+       self._Performance_Data = None
+       for key in self._attached:
+            self.shared_store.release(key)
+       self._attached = set()
+
+    def publish(self, Loan_Data=True, Performance_Data=True):
+       '''
+       write the loaded Loan_Data and Performance_Data to shared_store (src.shared_store), where
+       the PUBLIC_LOAN_FNMA of other processes with the same vintage, agency and compact setting
+       attach to them through Loan_Data and Performance_Data instead of reading the files
+       '''
+       if self.shared_store is None:
+            raise ValueError("publish: no shared_store")
+       frames = {"Loan": self._Loan_Data if Loan_Data else None,
+                 "LoanPerformance": self._Performance_Data if Performance_Data else None}
+       for name, df in frames.items():
+            if df is not None:
+                 self.shared_store.publish(vintage_key(self._Agency, self.acqYYYYQQ, name, self.compact), df)
+
+    def _attach(self, name):
+       '''the frame name of the vintage in shared_store, None when it is not published'''
+       key = vintage_key(self._Agency, self.acqYYYYQQ, name, self.compact)
+       table = self.shared_store.attach(key)
+       if table is None:
+            return None
+       if key in self._attached:
+            self.shared_store.release(key)
+       self._attached.add(key)
+       # split_blocks keeps the columns that need no conversion as views of the shared memory
+       return table.to_pandas(split_blocks=True)
+
+    def scan_loans(self, resultFolder=None):
+       '''
+       a src.lazy.LazyFrame over Loan_Data, or over the written Loan.parquet partition of the
+       vintage when Loan_Data is not loaded; None when there is neither
+       '''
+       return self._scan(self._Loan_Data, "Loan", resultFolder)
+
+    def scan_performance(self, resultFolder=None):
+       '''
+       a src.lazy.LazyFrame over Performance_Data, or over the written LoanPerformance.parquet
+       partition of the vintage (with its LOAN_ID index) when Performance_Data is not loaded;
+       None when there is neither
+       '''
+       return self._scan(self._Performance_Data, "LoanPerformance", resultFolder)
+
+    def _scan(self, df, name, resultFolder):
+       if df is not None:
+            return LazyFrame(df)
+       if resultFolder is None:
+            resultFolder = self.stageFolder
+       if resultFolder is None:
+            return None
+       folder = os.path.join(resultFolder, "output", self._Agency, name + ".parquet", "ACQ=" + self.acqYYYYQQ)
+       return scan(folder) if os.path.isdir(folder) else None
+
+    def loan_index(self, loan_ids, loan_Pandas_Dataframe=None):
+          '''
+          Integer position of each LOAN_ID in Loan_Data, -1 when the loan is unknown.
+          '''
+          if loan_Pandas_Dataframe  is None:
+             sub_df = self._Loan_Data
+          else:
+             sub_df = loan_Pandas_Dataframe
+          return pd.Index(sub_df["LOAN_ID"].values).get_indexer(np.asarray(loan_ids))
+
+    def compute_schd_upb(self, monthCount=None, outAsMatrix=True, loan_Pandas_Dataframe=None, keys=None,
+                         follow_rate=False):
           '''
           Calculate the scheduled UPB based on the Loan_Data["ORIG_AMT", "ORIG_RT", "ORIG_TRM"]
 
@@ -275,21 +766,59 @@ class PUBLIC_LOAN_FNMA(object):
           ----------
           monthCount: int, sepcify the period to get UPB.
           outAsMatrix : default to be True, returning "matrix" or  "pandas_df"
-       
+          keys: pandas dataframe with "LOAN_ID" and "LOAN_AGE", optional.
+                When given, only these pairs are evaluated (monthCount and outAsMatrix are ignored)
+                and the result is aligned to the rows of keys; unknown loans give NaN.
+          follow_rate: amortize at the LAST_RT path of Performance_Data (see rate_path) instead
+                of ORIG_RT, the payment being re-amortized at every rate change; the UPB cube
+                is not used
+
           Returns
           -------
-          out : ndarray (loanCount, monthCount), pandas dataframe
+          out : ndarray (loanCount, monthCount), pandas dataframe, or ndarray (len(keys), )
           '''
           if loan_Pandas_Dataframe  is None:
              sub_df = self._Loan_Data
           else:
              sub_df = loan_Pandas_Dataframe
-         
-          upb_matrix = compute_amortization(principals    = sub_df["ORIG_AMT"], 
+
+          if follow_rate and self._Performance_Data is not None:
+             if keys is not None:
+                ages = np.asarray(keys["LOAN_AGE"], dtype=np.int64)
+                monthCount = int(ages.max()) + 1 if len(ages) else 1
+             upb_matrix = compute_amortization_path(principals    = sub_df["ORIG_AMT"],
+                                                    monthly_rates = self.rate_path(monthCount, sub_df),
+                                                    terms         = sub_df["ORIG_TRM"],
+                                                    start_period  = 0,
+                                                    end_period    = monthCount)
+             if keys is not None:
+                loan_index = self.loan_index(keys["LOAN_ID"], sub_df)
+                out = np.full(len(ages), np.nan)
+                known = (loan_index >= 0) & (ages >= 0)
+                within = known & (ages < upb_matrix.shape[1])
+                out[within] = upb_matrix[loan_index[within], ages[within]]
+                out[known & ~within] = -999
+                return out
+          elif self.upb_cube and loan_Pandas_Dataframe is None and self.stageFolder is not None:
+             cube = self.schd_upb_cube()
+             if keys is not None:
+                return cube.at(cube.loan_index(keys["LOAN_ID"]), keys["LOAN_AGE"])
+             num_month = int(sub_df["ORIG_TRM"].max())
+             if monthCount is not None:
+                num_month = min(num_month, max(1, monthCount))
+             upb_matrix = cube.slice(slice(None), 0, num_month)
+          elif keys is not None:
+             return compute_amortization_at(principals    = sub_df["ORIG_AMT"],
                                             monthly_rates = sub_df["ORIG_RT"] / 1200,
                                             terms         = sub_df["ORIG_TRM"],
-                                            start_period  = 0, 
-                                            end_period    = monthCount)
+                                            ages          = keys["LOAN_AGE"],
+                                            loan_index    = self.loan_index(keys["LOAN_ID"], sub_df))
+          else:
+             upb_matrix = compute_amortization(principals    = sub_df["ORIG_AMT"], 
+                                               monthly_rates = sub_df["ORIG_RT"] / 1200,
+                                               terms         = sub_df["ORIG_TRM"],
+                                               start_period  = 0, 
+                                               end_period    = monthCount)
           
           if outAsMatrix == True:
              return upb_matrix
@@ -305,3 +834,145 @@ class PUBLIC_LOAN_FNMA(object):
              
              return (upb_array)
 
+    def rate_path(self, monthCount=None, loan_Pandas_Dataframe=None):
+          '''
+          Monthly rate of every loan at every age (loans x months, rows aligned to Loan_Data):
+          ORIG_RT / 1200 until the first report, then the LAST_RT / 1200 reported at each LOAN_AGE
+          of Performance_Data, carried forward to the next report (src.utilities.rate_matrix)
+          '''
+          if loan_Pandas_Dataframe  is None:
+             sub_df = self._Loan_Data
+          else:
+             sub_df = loan_Pandas_Dataframe
+          num_month = int(sub_df["ORIG_TRM"].max()) if monthCount is None else max(1, monthCount)
+          df = self._Performance_Data
+          return rate_matrix(sub_df["ORIG_RT"].values / 1200, num_month,
+                             loan_index = self.loan_index(df["LOAN_ID"], sub_df),
+                             ages       = df["LOAN_AGE"].values,
+                             rates      = df["LAST_RT"].values / 1200)
+
+    def project_upb(self, monthCount=None, cpr=None, smm=None, curtailments=None, outAsMatrix=True,
+                    dtype=np.float64):
+          '''
+          Project the balance of every loan forward from its last reported month of Performance_Data:
+          LAST_UPB at that LOAN_AGE, amortized at LAST_RT (ORIG_RT when missing) over the rest of
+          ORIG_TRM, with prepayments (src.utilities.compute_amortization_path). Only the reported
+          balances are used, not those backfilled by fill_last_upb; the loans with a ZB_CODE
+          (prepaid, liquidated, ...) are projected at 0. Performance_Data must have ZB_CODE, e.g.
+          read with keep_columns=["ZB_CODE"] when projecting.
+
+          Parameters
+          ----------
+          monthCount: int, optional, months projected (default to the longest remaining term)
+          cpr: annual prepayment rates (fractions), or smm: monthly ones; a scalar, a vector over
+               the projected months or a matrix (loans of Loan_Data, months)
+          curtailments: principal paid ahead of schedule, in amount, shaped like smm
+          outAsMatrix : default to be True, returning "matrix" or  "pandas_df"
+          dtype: np.float64 or np.float32, output precision
+
+          Returns
+          -------
+          out : ndarray (loanCount, months + 1), rows aligned to Loan_Data, column j the balance
+                j months after the last report (NaN rows for the loans never reported), or a
+                pandas dataframe with "LOAN_ID", "LOAN_AGE", "PROJ_UPB"
+          '''
+          if cpr is not None and smm is not None:
+             raise ValueError("project_upb: give cpr or smm, not both")
+          if cpr is not None:
+             smm = cpr_to_smm(cpr)
+          sub_df = self._Loan_Data
+          df = self._Performance_Data
+          if "ZB_CODE" not in df.columns:
+             raise ValueError("project_upb: Performance_Data has no ZB_CODE, read it with keep_columns=['ZB_CODE']")
+          with metrics.stage("project_upb", acq=self.acqYYYYQQ, rows_in=len(sub_df)) as stage:
+             reported = df["LAST_UPB"].notna().values & (df["LAST_UPB"].values >= 0)
+             if self._filled_upb is not None and len(self._filled_upb) == len(df):
+                reported = reported & ~self._filled_upb
+             zero_balance = self.loan_index(df.loc[df["ZB_CODE"].notna().values, "LOAN_ID"].unique(), sub_df)
+             reported = df.loc[reported, ["LOAN_ID", "LOAN_AGE", "LAST_UPB", "LAST_RT"]]
+             reported = reported.sort_values(["LOAN_ID", "LOAN_AGE"], kind="stable")
+             last = reported.drop_duplicates("LOAN_ID", keep="last")
+             loan_index = self.loan_index(last["LOAN_ID"], sub_df)
+             last = last[loan_index >= 0]
+             loan_index = loan_index[loan_index >= 0]
+
+             ages = np.zeros(len(sub_df), dtype=np.int64)
+             ages[loan_index] = last["LOAN_AGE"].values
+             principals = np.full(len(sub_df), np.nan)
+             principals[loan_index] = last["LAST_UPB"].values
+             rates = sub_df["ORIG_RT"].values / 1200
+             rates[loan_index] = np.where(last["LAST_RT"].isna().values, rates[loan_index],
+                                          last["LAST_RT"].values / 1200)
+             terms = np.maximum(sub_df["ORIG_TRM"].values - ages, 0)
+             end_period = None if monthCount is None else monthCount + 1
+             upb_matrix = compute_amortization_path(principals, rates, terms, 0, end_period, smm=smm,
+                                                    curtailments=curtailments, dtype=dtype)
+             unreported = np.ones(len(sub_df), dtype=bool)
+             unreported[loan_index] = False
+             upb_matrix[unreported] = np.nan
+             upb_matrix[zero_balance[zero_balance >= 0]] = 0
+             stage.set(zero_balance=int((zero_balance >= 0).sum()))
+             stage.set(rows_out=upb_matrix.size)
+
+          if outAsMatrix == True:
+             return upb_matrix
+          c = upb_matrix.shape[1]
+          return pd.DataFrame({"LOAN_ID": np.repeat(sub_df["LOAN_ID"].values[loan_index], c),
+                               "LOAN_AGE": (ages[loan_index][:, np.newaxis] + np.arange(c)).ravel(),
+                               "PROJ_UPB": upb_matrix[loan_index].ravel()})
+
+    def schd_upb_cube(self):
+          '''
+          The scheduled UPB cube (loan x age) of Loan_Data, memory-mapped from
+          stageFolder/upb_cube/ACQ=<acqYYYYQQ>.<key>.<dtype>.npy (named by ACQ=<acqYYYYQQ>.npy.json) and
+          built when missing or stale (src.upb_cube).
+          compute_schd_upb and fill_last_upb read it when the instance was created with upb_cube=True;
+          the matrices it returns are then read-only views of the file.
+          '''
+          df = self._Loan_Data
+          inputs = (df["LOAN_ID"].values, df["ORIG_AMT"].values, df["ORIG_RT"].values / 1200, df["ORIG_TRM"].values)
+          path = os.path.join(self.stageFolder, self._UPBCubeFolder, "ACQ=" + self.acqYYYYQQ + ".npy")
+          if self._schd_upb_cube is None or self._schd_upb_cube.key != cube_key(*inputs):
+             self._schd_upb_cube = open_or_build(path, *inputs)
+          return self._schd_upb_cube
+
+    def fill_last_upb(self):
+          '''
+          Backfill missing Performance_Data["LAST_UPB"] with the scheduled UPB of the row's loan and age.
+          Only the rows with a missing LAST_UPB are evaluated, by integer loan index; the rows whose
+          age is outside 0..ORIG_TRM (or whose loan is not in Loan_Data) have no scheduled balance
+          and stay missing.
+          '''
+          if self._Loan_Data is None or self._Performance_Data is None:
+             return None
+          df = self._Performance_Data
+          missing = df["LAST_UPB"].isna().values
+          if missing.any():
+             with metrics.stage("fill_last_upb", acq=self.acqYYYYQQ, rows_in=len(df)) as stage:
+                schd_upb = np.asarray(self.compute_schd_upb(keys=df.loc[missing, ["LOAN_ID", "LOAN_AGE"]]), dtype=np.float64)
+                # -999 beyond ORIG_TRM, NaN before age 0 and for the unknown loans
+                balance = np.isfinite(schd_upb) & (schd_upb >= 0)
+                rows = np.flatnonzero(missing)[balance]
+                df.iloc[rows, df.columns.get_loc("LAST_UPB")] = np.round(schd_upb[balance], 3)
+                self._filled_upb = np.zeros(len(df), dtype=bool)
+                self._filled_upb[rows] = True
+                stage.set(rows_out=len(rows))
+          return None
+
+
+def _flatten_filters(filters):
+    '''the (column, op, value) tuples of a DNF filter list'''
+    if filters and isinstance(filters[0], list):
+        return [f for conjunction in filters for f in conjunction]
+    return list(filters)
+
+
+def _parse_performance_bytes(data, engine="pandas", columns=None, cls=PUBLIC_LOAN_FNMA):
+    '''
+    whole lines of a Performance file of the agency class cls, typed, default-filled and conformed,
+    as an Arrow table (src.parallel_read worker)
+    '''
+    fnma = cls(None)
+    df = fnma.read_csv(io.BytesIO(data), cls._PerformanceSchema, engine=engine, columns=columns)
+    df = PUBLIC_LOAN_FNMA.fill_defaults(df, cls._PerformanceSchema)
+    return pa.Table.from_pandas(fnma.conform(df, cls._PerformanceSchema, columns), preserve_index=False)
@@ -1,39 +1,146 @@
-from datetime import datetime
+import os
+import warnings
 
 from pyspark.sql import functions as F,  Window
-from pyspark.sql.types import DateType, StructType, StructField,  DoubleType, FloatType, IntegerType, LongType, StringType, DateType
+from pyspark.sql.types import DateType, StructType, StructField,  DoubleType, FloatType, IntegerType, LongType, StringType
 import numpy as np
 import pandas as pd
-import sqlalchemy as db
-from src.utilities import *
-import time
-from src.public_loan_fnma import *
+from src import metrics
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+from src.schema import spark_type
+from src.features import DLQ_HISTORY_BITS, DLQ_HISTORY_OFFSET, FEATURE_COLUMNS, derive_loan_events, loan_level_events
+
+# performance columns read by the fused loan-event pass
+_EVENT_INPUT_COLUMNS = ["LOAN_ID", "ACT_DTE", "LOAN_AGE", "DLQ_STATUS", "LAST_UPB"] + FEATURE_COLUMNS
+
+# output of the fused loan-event pass, the columns of the Mod_DF/F3Q_DF/ZB_DF joins
+_LOAN_EVENT_SCHEMA = StructType([
+    StructField("LOAN_ID", StringType()),
+    StructField("MOD_DTE", DateType()),
+    StructField("MOD_AGE", IntegerType()),
+    StructField("MOD_DLQ", IntegerType()),
+    StructField("MOD_DLQ_LAG", IntegerType()),
+    StructField("MOD_DLQ_LAGs12", LongType()),
+    StructField("MOD_POST_MAXDLQ_12", IntegerType()),
+    StructField("MOD_POST_MAXDLQ_24", IntegerType()),
+    StructField("MOD_POST_ZBCODE_12", StringType()),
+    StructField("MOD_POST_ZBCODE_24", StringType()),
+    StructField("F3Q_DTE", DateType()),
+    StructField("F3Q_AGE", IntegerType()),
+    StructField("F3Q_DLQ_LAGs12", LongType()),
+    StructField("F3Q_POST_MAXDLQ_12", IntegerType()),
+    StructField("F3Q_POST_MAXDLQ_24", IntegerType()),
+    StructField("F3Q_POST_ZBCODE_12", StringType()),
+    StructField("F3Q_POST_ZBCODE_24", StringType()),
+    StructField("ZB_CODE", StringType()),
+    StructField("ZB_DTE", DateType()),
+    StructField("ZB_AGE", IntegerType()),
+    StructField("ZB_DLQ_LAGs12", LongType()),
+    StructField("ZB_DLQ_LAG", IntegerType()),
+    StructField("ZB_LAST_UPB", DoubleType()),
+    StructField("LPI_DTE", DateType()),
+    StructField("FCC_DTE", DateType()),
+    StructField("DISP_DTE", DateType()),
+    StructField("DEFT_COST", FloatType()),
+    StructField("DEFT_PROCS", FloatType()),
+])
+
+
+_HISTORY_MASK = (1 << DLQ_HISTORY_BITS) - 1
+
+
+def pack_dlq_history_column(dlq, window, k=12):
+    '''
+    the previous k DLQ_STATUS over window packed into a long, as src.features.pack_dlq_history
+    '''
+    packed = F.lit(0).cast(LongType())
+    for lag in range(1, k + 1):
+        code = F.least(F.greatest(F.lag(dlq, lag).over(window) + DLQ_HISTORY_OFFSET, F.lit(1)), F.lit(_HISTORY_MASK))
+        packed = packed + F.coalesce(code, F.lit(0)).cast(LongType()) * (1 << (DLQ_HISTORY_BITS * (lag - 1)))
+    return packed
+
+
+def dlq_history_lag(column, lag=1):
+    '''
+    DLQ_STATUS lag months before the event from a packed history column, null where there is no row
+    '''
+    code = "(shiftright(" + column + ", " + str(DLQ_HISTORY_BITS * (lag - 1)) + ") & " + str(_HISTORY_MASK) + ")"
+    return F.expr("case when " + code + " = 0 then null else cast(" + code + " as int) - " + str(DLQ_HISTORY_OFFSET) + " end")
+
+
+def dlq_history_array(column, k=12):
+    '''
+    packed history column to the array of the present DLQ_STATUS, oldest first, as collect_list did
+    '''
+    return F.expr("filter(transform(sequence(" + str(k) + ", 1, -1), "
+                  "i -> cast(shiftright(" + column + ", " + str(DLQ_HISTORY_BITS) + " * (i - 1)) & " + str(_HISTORY_MASK) + " as int) - "
+                  + str(DLQ_HISTORY_OFFSET) + "), x -> x >= " + str(1 - DLQ_HISTORY_OFFSET) + ")")
+
+
+def _loan_events_frame(pdf):
+    '''loan-level events of complete loans, typed for _LOAN_EVENT_SCHEMA'''
+    events = loan_level_events(derive_loan_events(pdf))
+    out = pd.DataFrame(index=events.index)
+    for field in _LOAN_EVENT_SCHEMA.fields:
+        if field.name not in events.columns:
+            out[field.name] = None
+            continue
+        col = events[field.name]
+        if isinstance(field.dataType, DateType):
+            col = pd.to_datetime(col).dt.date
+        elif isinstance(field.dataType, (IntegerType, FloatType, DoubleType)):
+            col = col.astype(np.float64)
+        elif isinstance(field.dataType, (StringType, LongType)):
+            # object keeps the packed histories exact
+            col = col.astype(object).where(col.notna(), None)
+        out[field.name] = col
+    return out
+
+
+def _loan_events_partition(batches):
+    '''
+    mapInPandas function over a partition sorted by (LOAN_ID, ACT_DTE)
+
+    The batches split the partition at arbitrary rows, so the rows of the last loan of a batch
+    are carried into the next one; every loan is processed exactly once with all its rows.
+    '''
+    carry = None
+    for pdf in batches:
+        if carry is not None:
+            pdf = pd.concat([carry, pdf], ignore_index=True)
+        if len(pdf) == 0:
+            continue
+        tail = (pdf["LOAN_ID"] == pdf["LOAN_ID"].iloc[-1]).values
+        carry = pdf[tail]
+        if not tail.all():
+            yield _loan_events_frame(pdf[~tail])
+    if carry is not None and len(carry):
+        yield _loan_events_frame(carry)
+
+def schd_upb_column(principal, monthly_rate, term, age):
+    '''
+    scheduled UPB as a column expression of the annuity closed form, evaluated on the executors
+
+    B(k) = P * (expm1(n * log1p(r)) - expm1(k * log1p(r))) / expm1(n * log1p(r)), P * (1 - k / n)
+    for a zero rate; 0 at the end of term, -999 beyond it and null for a negative age, as
+    src.utilities.compute_amortization.
+    '''
+    principal, monthly_rate, term, age = (F.col(c) if isinstance(c, str) else c for c in (principal, monthly_rate, term, age))
+    growth = F.log1p(monthly_rate)
+    balance = F.when(monthly_rate == 0, principal * (1 - age / term)) \
+               .otherwise(principal * (F.expm1(term * growth) - F.expm1(age * growth)) / F.expm1(term * growth))
+    return F.when(age < 0, F.lit(None)).when(age == term, F.lit(0.0)).when(age > term, F.lit(-999.0)).otherwise(balance)
+
 
 class PUBLIC_LOAN_FNMA_spark(PUBLIC_LOAN_FNMA):
     '''processing public loan data from Fannie Mae '''
       #schema of Acquisition Data
     
-    def __init__(self, acqYYYYQQ, stageFolder=None,  acquisition_file=None, performance_file=None):
-         super().__init__(acqYYYYQQ, stageFolder    , acquisition_file, performance_file)
+    def __init__(self, acqYYYYQQ, stageFolder=None,  acquisition_file=None, performance_file=None, **kwargs):
+         super().__init__(acqYYYYQQ, stageFolder    , acquisition_file, performance_file, **kwargs)
          
 
-    @staticmethod
-    def convTypeToSpark(v):
-          vout = StringType()
-          dtype = v.get('dtype')
-          if dtype == "float":
-             vout = FloatType()
-          elif dtype == "double":
-            vout = DoubleType()
-          elif dtype  == "int":
-            vout = IntegerType()
-          elif dtype  == "string":
-            vout = StringType()
-          elif dtype == "date":
-            vout = StringType()
-          else:
-            vout = StringType()
-          return vout
+    convTypeToSpark = staticmethod(spark_type)
 
     @staticmethod
     def save_to_hive(dbname, tablename, dataframe_src):
@@ -46,6 +153,35 @@ class PUBLIC_LOAN_FNMA_spark(PUBLIC_LOAN_FNMA):
           spark.sql("insert into table ratings \
                      select * from " +dataframe_src )
 
+    def save_as_parquet(self, resultFolder= None, Loan_Data =True, Performance_Data=True, raise_errors=False):
+       '''
+       write Loan_Data and Performance_Data to the ACQ=<acqYYYYQQ> partitions of
+       resultFolder/output/<_Agency>/Loan.parquet and LoanPerformance.parquet, overwriting them
+
+       raise_errors: raise the write errors (and a missing resultFolder) instead of warning (RuntimeWarning)
+       '''
+       if resultFolder is None:
+            resultFolder = self.stageFolder
+       if resultFolder is None or not os.path.isdir(resultFolder):
+            if raise_errors:
+                 raise ValueError("save_as_parquet: no result folder {0}".format(resultFolder))
+            return None
+       try:
+            if (Loan_Data == True) and (self.Loan_Data is not None):
+              folder = resultFolder + "/output/" + self._Agency + "/Loan.parquet/ACQ=" + self.acqYYYYQQ
+              with metrics.stage("write_parquet", acq=self.acqYYYYQQ, backend="spark", folder=folder) as stage:
+                 self.Loan_Data.write.mode('overwrite').parquet(folder)
+                 stage.set(written_path=folder)
+            if (Performance_Data == True) and (self.Performance_Data is not None):
+              folder = resultFolder + "/output/" + self._Agency + "/LoanPerformance.parquet/ACQ=" + self.acqYYYYQQ
+              with metrics.stage("write_parquet", acq=self.acqYYYYQQ, backend="spark", folder=folder) as stage:
+                 self.Performance_Data.write.mode('overwrite').parquet(folder)
+                 stage.set(written_path=folder)
+       except Exception as err:
+            if raise_errors:
+                 raise
+            warnings.warn("save_as_parquet: {0}".format(err), RuntimeWarning)
+
     def compute_schd_upb(self, monthCount, outAsMatrix=True):
           '''
           Calculate the scheduled UPB based on the Loan_Data["ORIG_AMT", "ORIG_RT", "ORIG_TRM"]
@@ -53,22 +189,59 @@ class PUBLIC_LOAN_FNMA_spark(PUBLIC_LOAN_FNMA):
           Parameters
           ----------
           monthCount: int, sepcify the period to get UPB.
-          outformat : string, "matrix", "pandas_df", "spark_df"
+          outAsMatrix : True collects the loans to the driver and returns the ndarray (only for small
+                        Loan_Data); False returns a spark dataframe (LOAN_ID, LOAN_AGE, SCHD_UPB) for ages
+                        0..monthCount-1, computed on the executors with schd_upb_column
        
           Returns
           -------
           out : ndarray (M, N),  spark dataframe
           '''
-          sub_df = self.Loan_Data.select("LOAN_ID", "ORIG_AMT", "ORIG_RT", "ORIG_TRM").toPandas()
-         
-          upb_matrix = super().compute_schd_upb(monthCount, outAsMatrix, sub_df)
-          
           if outAsMatrix == True:
-             return upb_matrix
-          else:
-             return spark.createDataFrame(upb_matrix)
-        
+             sub_df = self.Loan_Data.select("LOAN_ID", "ORIG_AMT", "ORIG_RT", "ORIG_TRM").toPandas()
+             return super().compute_schd_upb(monthCount, outAsMatrix, sub_df)
+
+          ages = self.Loan_Data.sparkSession.range(monthCount).select(F.col("id").cast(IntegerType()).alias("LOAN_AGE"))
+          return self.Loan_Data.select("LOAN_ID", "ORIG_AMT", "ORIG_RT", "ORIG_TRM").crossJoin(ages) \
+                     .select("LOAN_ID", "LOAN_AGE",
+                             schd_upb_column("ORIG_AMT", F.col("ORIG_RT") / 1200, "ORIG_TRM", "LOAN_AGE").alias("SCHD_UPB"))
+
+    def fill_last_upb(self, performance_df=None, num_partitions=None):
+          '''
+          Backfill the missing LAST_UPB with the scheduled UPB of the row's loan and age.
 
+          The loan terms of Loan_Data are hash partitioned by LOAN_ID like the performance rows of
+          read_data_performance and joined on LOAN_ID alone; the closed form is only evaluated for
+          the rows with a missing LAST_UPB. The rows whose age is outside 0..ORIG_TRM have no
+          scheduled balance and stay missing. Nothing is collected to the driver.
+
+          Parameters
+          ----------
+          performance_df : spark dataframe, default to Performance_Data (which is then replaced)
+          num_partitions : int, LOAN_ID partitions, defaults to spark.sql.shuffle.partitions
+
+          Returns
+          -------
+          out : spark dataframe
+          '''
+          update = performance_df is None
+          if update:
+             performance_df = self.Performance_Data
+          if num_partitions is None:
+             num_partitions = int(performance_df.sparkSession.conf.get("spark.sql.shuffle.partitions"))
+          terms = self.Loan_Data.select("LOAN_ID",
+                                        F.col("ORIG_AMT").alias("_ORIG_AMT"),
+                                        F.col("ORIG_RT").alias("_ORIG_RT"),
+                                        F.col("ORIG_TRM").alias("_ORIG_TRM")).repartition(num_partitions, "LOAN_ID")
+          schd_upb = schd_upb_column("_ORIG_AMT", F.col("_ORIG_RT") / 1200, "_ORIG_TRM", "LOAN_AGE")
+          # -999 beyond ORIG_TRM is a flag, not a balance
+          schd_upb = F.when(schd_upb >= 0, schd_upb)
+          out = performance_df.join(terms, "LOAN_ID", how="left") \
+                    .withColumn("LAST_UPB", F.when(F.col("LAST_UPB").isNull(), F.round(schd_upb, 3)).otherwise(F.col("LAST_UPB"))) \
+                    .drop("_ORIG_AMT", "_ORIG_RT", "_ORIG_TRM")
+          if update:
+             self.Performance_Data = out
+          return out
 
     def read_data_acquisition (self, spark, acquisition_file=None):
           '''
@@ -79,55 +252,38 @@ class PUBLIC_LOAN_FNMA_spark(PUBLIC_LOAN_FNMA):
 
           # need to check file existing
           ColumnSchema = StructType([StructField(k, PUBLIC_LOAN_FNMA_spark.convTypeToSpark(v), True) for k, v in self._AcquisitionSchema.items()])                   
-          ts = time.time()
-          acq_df = spark.read.format("csv").options(header='False', delimiter="|").schema(ColumnSchema).load(self.acquisition_file )
-          
-          for k, v in self._AcquisitionSchema.items():
-             if v.get('dtype') == "date":
-                acq_df = acq_df.withColumn(k,  F.to_date(F.col(k), v.get('format2')))
-             else:
-                value = v.get('default')
-                if value is not None:
-                   acq_df = acq_df.withColumn(k, F.when(F.col(k).isNull(), value).otherwise(F.col(k)))
+          with metrics.stage("read_data_acquisition", acq=self.acqYYYYQQ, backend="spark", lazy=True,
+                             read_path=self.acquisition_file):
+             acq_df = spark.read.format("csv").options(header='False', delimiter="|").schema(ColumnSchema).load(self.acquisition_file )
 
-          acq_df = acq_df.withColumn('OCLTV',     F.expr("case when OCLTV ==0 then OLTV else OCLTV end"))
+             for k, v in self._AcquisitionSchema.items():
+                if v.get('dtype') == "date":
+                   acq_df = acq_df.withColumn(k,  F.to_date(F.col(k), v.get('format2')))
+                else:
+                   value = v.get('default')
+                   if value is not None:
+                      acq_df = acq_df.withColumn(k, F.when(F.col(k).isNull(), value).otherwise(F.col(k)))
 
-          for k, v in self._AcquisitionSchema.items():
-             if v.get('drop') == True:
-                acq_df= acq_df.drop(k)
-         
-          self.Loan_Data = acq_df
-          
-          ts = time.time()
-          schd_upbData = self.compute_schd_upb(monthCount=12, outAsMatrix=False)
-          print("compute upb: ", showtime(ts))
-        
+             acq_df = acq_df.withColumn('OCLTV',     F.expr("case when OCLTV ==0 then OLTV else OCLTV end"))
+
+             for k, v in self._AcquisitionSchema.items():
+                if v.get('drop') == True:
+                   acq_df= acq_df.drop(k)
+
+             self.Loan_Data = acq_df
           return None
 
-    def read_data_performance (self, spark, performance_file=None):
+    def read_performance_frame(self, spark):
           '''
-          read and pre-process acqusition data
+          the Performance file as a spark dataframe with dates, DLQ_STATUS codes, DEFT_COST and DEFT_PROCS
           '''
-          if performance_file is not None:
-             self.performance_file = performance_file
-
-          # need to check file existing
           ColumnSchema = [StructField(k, PUBLIC_LOAN_FNMA_spark.convTypeToSpark(v), True) for k, v in self._PerformanceSchema.items()]
           ColumnSchema = StructType(ColumnSchema)                                
 
-          #udf
-          #str_to_date =  udf (lambda x: datetime.strptime(x, '%m/%Y'), DateType())   
-          windowIncF12 =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE").rowsBetween(1, 12)
-          windowIncF24 =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE").rowsBetween(1, 24)
-          windowIncP12 =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE").rowsBetween(-12, -1)
-          windowInc    =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE")
+          with metrics.stage("read_csv", acq=self.acqYYYYQQ, backend="spark", lazy=True,
+                             read_path=self.performance_file):
+             per_df = spark.read.format("csv").options(header='False', delimiter="|").schema(ColumnSchema).load(self.performance_file )
 
-          ts = time.time()
-          per_df = spark.read.format("csv").options(header='False', delimiter="|").schema(ColumnSchema).load(self.performance_file )
-          #per_df.show(10)
-          print("read cvs: ", showtime(ts))
-        
-          ts = time.time()
           # date columnd
           for k, v in self._PerformanceSchema.items():
              if v.get('dtype') == "date":
@@ -136,92 +292,131 @@ class PUBLIC_LOAN_FNMA_spark(PUBLIC_LOAN_FNMA):
           per_df = per_df.withColumn('DLQ_STATUS', F.when(F.col('DLQ_STATUS').isNull(), -1).when(F.col('DLQ_STATUS') == "X", -2).otherwise(F.col('DLQ_STATUS').cast(IntegerType())))
           per_df = per_df.withColumn('DEFT_COST',  F.expr("FCC_COST + PP_COST + AR_COST + IE_COST + TAX_COST"))
           per_df = per_df.withColumn('DEFT_PROCS',  F.expr("NS_PROCS + CE_PROCS + RMW_PROCS + O_PROCS"))
+          return per_df
+
+    def read_data_performance (self, spark, performance_file=None, fused=True, sort_output=False, num_partitions=None,
+                               fill_upb=True):
+          '''
+          read and pre-process performance data
+
+          Parameters
+          ----------
+          spark : SparkSession
+          fused : bool, derive the loan events in one pass: a single shuffle by LOAN_ID, a sort within
+                  partitions and a mapInPandas over the sorted rows (src.features), joined onto Loan_Data
+                  once. False runs the original window pipeline (four window specs, three row_number/filter
+                  tables and three joins).
+          sort_output : bool, globally sort Loan_Data and Performance_Data by LOAN_ID (and ACT_DTE).
+                  This is an extra shuffle and range sort; only ask for it when the consumer needs the order.
+          num_partitions : int, number of LOAN_ID partitions, defaults to spark.sql.shuffle.partitions. The
+                  performance rows are shuffled once into these partitions; the loan events and the
+                  LAST_UPB backfill (see fill_last_upb) reuse them.
+          fill_upb : bool, backfill missing LAST_UPB with the scheduled UPB when Loan_Data is loaded
+          '''
+          if performance_file is not None:
+             self.performance_file = performance_file
+
+          # need to check file existing
+          per_df = self.read_performance_frame(spark)
+          if num_partitions is None:
+             num_partitions = int(spark.conf.get("spark.sql.shuffle.partitions"))
+          per_df = per_df.repartition(num_partitions, "LOAN_ID")
+          has_loans = self.Loan_Data is not None
 
-          per_df = per_df.withColumn("DLQ_LAG", F.lag('DLQ_STATUS', 1).over(windowInc)) \
-              .withColumn("DLQ_LAGs12",         F.collect_list('DLQ_STATUS').over(windowIncP12)) \
-              .withColumn("DLQ_NEXT12MAX",      F.max('DLQ_STATUS').over(windowIncF12)) \
-              .withColumn("DLQ_NEXT24MAX",      F.max('DLQ_STATUS').over(windowIncF24)) \
-              .withColumn("ZBCODE_NEXT12",      F.max('ZB_CODE').over(windowIncF12)) \
-              .withColumn("ZBCODE_NEXT24",      F.max('ZB_CODE').over(windowIncF24)) \
-              .withColumn("MOD_NEXT12",         F.max('MOD_FLAG').over(windowIncF12)) \
-              .withColumn("MOD_NEXT24",         F.max('MOD_FLAG').over(windowIncF24)) 
-
-          print(per_df.printSchema())
-          
-          print("transform: ", showtime(ts))
-        
-          ts = time.time()
-          Mod_DF = per_df.filter(F.col("MOD_FLAG")=='Y').withColumn("rn", F.row_number().over(windowInc)).where((F.col("rn") ==1)) \
-                      .select("LOAN_ID", 
-                              F.col("ACT_DTE").alias("MOD_DTE"), 
-                              F.col("LOAN_AGE").alias("MOD_AGE"), 
-                              F.col("DLQ_STATUS").alias("MOD_DLQ"),
-                              F.col("DLQ_LAG").alias("MOD_DLQ_LAG"),
-                              F.col("DLQ_LAGs12").alias("MOD_DLQ_LAGs12"),
-                              F.col("DLQ_NEXT12MAX").alias("MOD_POST_MAXDLQ_12"),
-                              F.col("DLQ_NEXT24MAX").alias("MOD_POST_MAXDLQ_24"),
-                              F.col("ZBCODE_NEXT12").alias("MOD_POST_ZBCODE_12"),
-                              F.col("ZBCODE_NEXT24").alias("MOD_POST_ZBCODE_24")
-                              )
-          print("Mod DF: ", showtime(ts))
-        
-          ts = time.time()
-          F3Q_DF = per_df.filter(F.col("DLQ_STATUS")>2).withColumn("rn", F.row_number().over(windowInc)).where((F.col("rn") ==1)) \
-                     .select("LOAN_ID", 
-                              F.col("ACT_DTE").alias("F3Q_DTE"), 
-                              F.col("LOAN_AGE").alias("F3Q_AGE"), 
-                              F.col("DLQ_LAGs12").alias("F3Q_DLQ_LAGs12"),
-                              F.col("DLQ_NEXT12MAX").alias("F3Q_POST_MAXDLQ_12"),
-                              F.col("DLQ_NEXT24MAX").alias("F3Q_POST_MAXDLQ_24"),
-                              F.col("ZBCODE_NEXT12").alias("F3Q_POST_ZBCODE_12"),
-                              F.col("ZBCODE_NEXT24").alias("F3Q_POST_ZBCODE_24")
-                              )
-          print("F3Q DF: ", showtime(ts))
-        
-          ts = time.time()
-          ZB_DF = per_df.filter(F.col("ZB_CODE").isNotNull()) \
-                    .select("LOAN_ID", "ZB_CODE", "ZB_DTE",
-                              F.col("LOAN_AGE").alias("ZB_AGE"), 
-                              F.col("DLQ_LAGs12").alias("ZB_DLQ_LAGs12"),
-                              F.col("DLQ_LAG").alias("ZB_DLQ_LAG"),
-                              F.col("LAST_UPB").alias("ZB_LAST_UPB"),
-                              "LPI_DTE",
-                              "FCC_DTE",
-                              "DISP_DTE", "DEFT_COST", "DEFT_PROCS"
-                    )
-          print("ZB DF: ", showtime(ts))
-        
-          ts = time.time()
-
-          if self.Loan_Data is None:
-             loanLevelDF =  Mod_DF.select("LOAN_ID") \
-                     .union(F3Q_DF.select("LOAN_ID")) \
-                     .union( ZB_DF.select("LOAN_ID")).distinct()
-          
-             loanLevelDF = loanLevelDF.join(Mod_DF, "LOAN_ID", how="left")
-             loanLevelDF = loanLevelDF.join(F3Q_DF, "LOAN_ID", how="left")
-             loanLevelDF = loanLevelDF.join(ZB_DF,  "LOAN_ID",  how="left") 
+          if fused:
+             with metrics.stage("derive_features", acq=self.acqYYYYQQ, backend="spark", lazy=True, fused=True):
+                events_df = per_df.select(_EVENT_INPUT_COLUMNS) \
+                                  .sortWithinPartitions("LOAN_ID", "ACT_DTE") \
+                                  .mapInPandas(_loan_events_partition, schema=_LOAN_EVENT_SCHEMA)
+                if self.Loan_Data is None:
+                   self.Loan_Data = events_df
+                else:
+                   # the events (one row per loan) are new attributes of mapInPandas, not known to be
+                   # partitioned by LOAN_ID: a sort-merge join shuffles them again, the broadcast join
+                   # chosen for small vintages does not shuffle Loan_Data
+                   self.Loan_Data = self.Loan_Data.join(events_df, "LOAN_ID", how="left")
+                if sort_output:
+                   self.Loan_Data = self.Loan_Data.orderBy(["LOAN_ID"])
           else:
-             self.Loan_Data = self._Loan_Data.join(Mod_DF, "LOAN_ID", how="left") \
-                                         .join(F3Q_DF, "LOAN_ID", how="left") \
-                                         .join(ZB_DF,  "LOAN_ID",  how="left").orderBy(["LOAN_ID"])
-              
-          print("join: ", showtime(ts))
+             self._window_loan_events(per_df, sort_output)
+
           select_col = [k for k, v in self._PerformanceSchema.items() if v.get("drop", False) == False]
-          Performance_Data = per_df.select(select_col)
+          Performance_Data = per_df.select(select_col).filter(F.col("LOAN_AGE")>=0)
 
-          #calcualte schd_upb
-          age_max = 12  #Performance_Data.agg({"LOAN_AGE": "max"}).first()[0]
-          ts = time.time()
-          schd_upbData = self.compute_schd_upb(monthCount=age_max, outAsMatrix=False)
-          print("compute upb: ", showtime(ts))
-         
-          ts = time.time()
-          self.Performance_Data = Performance_Data.join(schd_upbData, on=["LOAN_ID", "LOAN_AGE"], how="left").orderBy(["LOAN_ID",  "ACT_DTE"])
-          print("joining upb: ", showtime(ts))
-          ts = time.time()
-          self.Performance_Data = self.Performance_Data.filter(F.col("LOAN_AGE")>=0).withColumn("LAST_UPB",  F.expr("case when LAST_UPB is Null then round(SCHD_UPB,3) else LAST_UPB end") )
-          self.Performance_Data=  self.Performance_Data.drop("SCHD_UPB")
-          print("filtering out: ", showtime(ts))
+          if fill_upb and has_loans:
+             Performance_Data = self.fill_last_upb(Performance_Data, num_partitions)
+          if sort_output:
+             Performance_Data = Performance_Data.orderBy(["LOAN_ID",  "ACT_DTE"])
+          self.Performance_Data = Performance_Data
            
           return None
+
+    def _window_loan_events(self, per_df, sort_output=True):
+          '''
+          the original window pipeline of the loan events, joined onto Loan_Data
+          '''
+          windowIncF12 =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE").rowsBetween(1, 12)
+          windowIncF24 =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE").rowsBetween(1, 24)
+          windowInc    =  Window().partitionBy("LOAN_ID").orderBy("ACT_DTE")
+
+          with metrics.stage("window_features", acq=self.acqYYYYQQ, backend="spark", lazy=True):
+             per_df = per_df.withColumn("DLQ_LAG", F.lag('DLQ_STATUS', 1).over(windowInc)) \
+                 .withColumn("DLQ_LAGs12",         pack_dlq_history_column('DLQ_STATUS', windowInc)) \
+                 .withColumn("DLQ_NEXT12MAX",      F.max('DLQ_STATUS').over(windowIncF12)) \
+                 .withColumn("DLQ_NEXT24MAX",      F.max('DLQ_STATUS').over(windowIncF24)) \
+                 .withColumn("ZBCODE_NEXT12",      F.max('ZB_CODE').over(windowIncF12)) \
+                 .withColumn("ZBCODE_NEXT24",      F.max('ZB_CODE').over(windowIncF24)) \
+                 .withColumn("MOD_NEXT12",         F.max('MOD_FLAG').over(windowIncF12)) \
+                 .withColumn("MOD_NEXT24",         F.max('MOD_FLAG').over(windowIncF24)) 
+
+          with metrics.stage("derive_features", acq=self.acqYYYYQQ, backend="spark", lazy=True, fused=False):
+             Mod_DF = per_df.filter(F.col("MOD_FLAG")=='Y').withColumn("rn", F.row_number().over(windowInc)).where((F.col("rn") ==1)) \
+                         .select("LOAN_ID", 
+                                 F.col("ACT_DTE").alias("MOD_DTE"), 
+                                 F.col("LOAN_AGE").alias("MOD_AGE"), 
+                                 F.col("DLQ_STATUS").alias("MOD_DLQ"),
+                                 F.col("DLQ_LAG").alias("MOD_DLQ_LAG"),
+                                 F.col("DLQ_LAGs12").alias("MOD_DLQ_LAGs12"),
+                                 F.col("DLQ_NEXT12MAX").alias("MOD_POST_MAXDLQ_12"),
+                                 F.col("DLQ_NEXT24MAX").alias("MOD_POST_MAXDLQ_24"),
+                                 F.col("ZBCODE_NEXT12").alias("MOD_POST_ZBCODE_12"),
+                                 F.col("ZBCODE_NEXT24").alias("MOD_POST_ZBCODE_24")
+                                 )
+
+             F3Q_DF = per_df.filter(F.col("DLQ_STATUS")>2).withColumn("rn", F.row_number().over(windowInc)).where((F.col("rn") ==1)) \
+                        .select("LOAN_ID", 
+                                 F.col("ACT_DTE").alias("F3Q_DTE"), 
+                                 F.col("LOAN_AGE").alias("F3Q_AGE"), 
+                                 F.col("DLQ_LAGs12").alias("F3Q_DLQ_LAGs12"),
+                                 F.col("DLQ_NEXT12MAX").alias("F3Q_POST_MAXDLQ_12"),
+                                 F.col("DLQ_NEXT24MAX").alias("F3Q_POST_MAXDLQ_24"),
+                                 F.col("ZBCODE_NEXT12").alias("F3Q_POST_ZBCODE_12"),
+                                 F.col("ZBCODE_NEXT24").alias("F3Q_POST_ZBCODE_24")
+                                 )
+
+             ZB_DF = per_df.filter(F.col("ZB_CODE").isNotNull()) \
+                       .select("LOAN_ID", "ZB_CODE", "ZB_DTE",
+                                 F.col("LOAN_AGE").alias("ZB_AGE"), 
+                                 F.col("DLQ_LAGs12").alias("ZB_DLQ_LAGs12"),
+                                 F.col("DLQ_LAG").alias("ZB_DLQ_LAG"),
+                                 F.col("LAST_UPB").alias("ZB_LAST_UPB"),
+                                 "LPI_DTE",
+                                 "FCC_DTE",
+                                 "DISP_DTE", "DEFT_COST", "DEFT_PROCS"
+                       )
+
+          with metrics.stage("join_events", acq=self.acqYYYYQQ, backend="spark", lazy=True):
+             if self.Loan_Data is None:
+                loanLevelDF =  Mod_DF.select("LOAN_ID") \
+                        .union(F3Q_DF.select("LOAN_ID")) \
+                        .union( ZB_DF.select("LOAN_ID")).distinct()
+
+                loanLevelDF = loanLevelDF.join(Mod_DF, "LOAN_ID", how="left")
+                loanLevelDF = loanLevelDF.join(F3Q_DF, "LOAN_ID", how="left")
+                self.Loan_Data = loanLevelDF.join(ZB_DF,  "LOAN_ID",  how="left") 
+             else:
+                self.Loan_Data = self.Loan_Data.join(Mod_DF, "LOAN_ID", how="left") \
+                                            .join(F3Q_DF, "LOAN_ID", how="left") \
+                                            .join(ZB_DF,  "LOAN_ID",  how="left")
+             if sort_output:
+                self.Loan_Data = self.Loan_Data.orderBy(["LOAN_ID"])
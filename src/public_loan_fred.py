@@ -0,0 +1,210 @@
+'''
+Freddie Mac Single-Family Loan-Level Dataset on the FNMA pipeline.
+
+The origination (historical_data_<YYYYQn>.txt) and monthly performance
+(historical_data_time_<YYYYQn>.txt) files are read with schemas in Freddie's column order whose
+keys are the FNMA column names wherever Freddie reports the same quantity, so projection at
+read, the pyarrow engine, the parse cache, the compact representation, the streaming Parquet
+writer, the LOAN_ID index and the vectorized scheduled UPB of PUBLIC_LOAN_FNMA apply unchanged.
+conform then maps the remaining differences (sentinel values, 5-digit postal codes, "XX"
+delinquency, the UPB masked to 0 in the first months, the missing cost and proceeds columns)
+and orders the columns as the FNMA output, followed by the Freddie-only columns.
+
+The vintages are written to resultFolder/output/FRED/{Loan,LoanPerformance}.parquet/ACQ=<YYYYQn>,
+next to the FNMA ones; scan_agencies reads both as one table.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+class PUBLIC_LOAN_FRED(PUBLIC_LOAN_FNMA):
+    '''processing public loan data from Freddie Mac '''
+
+    # schema of the Origination Data, in file order; "missing" is Freddie's "not available" value
+    _AcquisitionSchema = {"CSCORE_B":        {"dtype": "float", "default": -1, "missing": 9999},
+                          "FRST_DTE":        {"dtype": "date", "format":"%Y%m", "format2":"yyyyMM"},
+                          "FTHB_FLG":        {"dtype": "string"},
+                          "MAT_DTE":         {"dtype": "date", "drop":True, "format":"%Y%m", "format2":"yyyyMM"},
+                          "MSA":             {"dtype": "string", "drop":True},
+                          "MI_PCT":          {"dtype": "int", "default": 0, "missing": 999},
+                          "NUM_UNIT":        {"dtype": "int", "default": -1, "missing": 99},
+                          "OCC_STAT":        {"dtype": "string"},
+                          "OCLTV":           {"dtype": "float", "default": 0, "missing": 999},
+                          "DTI":             {"dtype": "int", "default": -1, "missing": 999},
+                          "ORIG_AMT":        {"dtype": "double"},
+                          "OLTV":            {"dtype": "float", "default": 0, "missing": 999},
+                          "ORIG_RT":         {"dtype": "float"},
+                          "ORIG_CHN":        {"dtype": "string"},
+                          "PPM_FLG":         {"dtype": "string", "drop":True},
+                          "Product_Type":    {"dtype": "string"},
+                          "STATE":           {"dtype": "string"},
+                          "PROP_TYP":        {"dtype": "string"},
+                          "ZIP_3":           {"dtype": "string"},
+                          "LOAN_ID":         {"dtype": "string"},
+                          "PURPOSE":         {"dtype": "string"},
+                          "ORIG_TRM":        {"dtype": "int"},
+                          "NUM_BO":          {"dtype": "int", "default": -1, "missing": 99},
+                          "SellerName":      {"dtype": "string", "drop":True},
+                          "ServicerName":    {"dtype": "string", "drop":True},
+                          "SUPER_CONF_FLG":  {"dtype": "string", "drop":True},
+                          "PRE_HARP_LOAN_ID": {"dtype": "string", "drop":True},
+                          "PROGRAM_IND":     {"dtype": "string", "drop":True},
+                          "HARP_IND":        {"dtype": "string", "drop":True},
+                          "PROP_VAL_MTHD":   {"dtype": "string", "drop":True},
+                          "IO_IND":          {"dtype": "string", "drop":True},
+                          "MI_CNCL_IND":     {"dtype": "string", "drop":True},
+                          }
+
+    # schema of the Monthly Performance Data, in file order
+    _PerformanceSchema = {"LOAN_ID":         {"dtype": "string"},
+                          "ACT_DTE":         {"dtype": "date", "format":"%Y%m", "format2":"yyyyMM"},
+                          "LAST_UPB":        {"dtype": "double"},
+                          "DLQ_STATUS":      {"dtype": "string"},
+                          "LOAN_AGE":        {"dtype": "int"},
+                          "Months_To_Legal_Mat": {"dtype": "int", "default": -1},
+                          "DEFECT_STLMT_DTE": {"dtype": "date", "drop":True, "format":"%Y%m", "format2":"yyyyMM"},
+                          "MOD_FLAG":        {"dtype": "string", "drop":True},
+                          "ZB_CODE":         {"dtype": "string", "drop":True},
+                          "ZB_DTE":          {"dtype": "date",   "drop":True, "format":"%Y%m", "format2":"yyyyMM"},
+                          "LAST_RT":         {"dtype": "float"},
+                          "NON_INT_UPB":     {"dtype": "float"},
+                          "LPI_DTE":         {"dtype": "date",   "drop":True, "format":"%Y%m", "format2":"yyyyMM"},
+                          "CE_PROCS":        {"dtype": "float", "drop":True},
+                          # "C" (covered) or "U" (unknown) instead of an amount for some loans
+                          "NS_PROCS":        {"dtype": "string", "drop":True},
+                          "O_PROCS":         {"dtype": "float", "drop":True},
+                          "EXPENSES":        {"dtype": "float", "drop":True},
+                          "FCC_COST":        {"dtype": "float", "drop":True},
+                          "PP_COST":         {"dtype": "float", "drop":True},
+                          "TAX_COST":        {"dtype": "float", "drop":True},
+                          "IE_COST":         {"dtype": "float", "drop":True},
+                          "ACT_LOSS":        {"dtype": "float", "drop":True},
+                          "MOD_COST":        {"dtype": "float", "drop":True},
+                          "STEP_MOD_FLG":    {"dtype": "string", "drop":True},
+                          "DEFERRAL_FLG":    {"dtype": "string", "drop":True},
+                          "ELTV":            {"dtype": "float", "drop":True},
+                          "ZB_REMOVAL_UPB":  {"dtype": "float", "drop":True},
+                          "DLQ_ACCR_INT":    {"dtype": "float", "drop":True},
+                          "DLQ_DISASTER":    {"dtype": "string", "drop":True},
+                          "ASSIST_STATUS":   {"dtype": "string", "drop":True},
+                          "CURR_MOD_COST":   {"dtype": "float", "drop":True},
+                          "INT_UPB":         {"dtype": "float", "drop":True},
+                          }
+
+    _Agency = "FRED"
+    _UPBCubeFolder = "upb_cube_fred"
+
+    # Freddie reports the actual UPB as 0 for the loan ages below this
+    _MaskedUPBAges = 6
+
+    def outputSchema(self, schema):
+        '''the FNMA schema of the same data, followed by the Freddie-only columns'''
+        fnma_schema = PUBLIC_LOAN_FNMA._AcquisitionSchema if schema is self._AcquisitionSchema \
+            else PUBLIC_LOAN_FNMA._PerformanceSchema
+        out = dict(fnma_schema)
+        out.update({k: v for k, v in schema.items() if k not in fnma_schema})
+        return out
+
+    def outputColumns(self, schema, columns=None):
+        '''
+        the FNMA columns (only the non-"drop" ones and those read when projecting) in FNMA order,
+        then the Freddie-only columns read
+        '''
+        output_schema = self.outputSchema(schema)
+        read = set(schema.keys() if columns is None else columns)
+        return [k for k, v in output_schema.items()
+                if k in read or (k not in schema and (columns is None or not v.get('drop', False)))]
+
+    def conform(self, df, schema, columns=None):
+        '''the Freddie frame in the FNMA layout, see the module docstring'''
+        for k, v in schema.items():
+            if v.get('missing') is not None and k in df.columns:
+                df[k] = df[k].mask(df[k] == v['missing'])
+
+        if schema is self._AcquisitionSchema:
+            if "OCLTV" in df.columns:
+                df["OCLTV"] = df["OCLTV"].fillna(df["OLTV"])
+            if "ZIP_3" in df.columns:
+                df["ZIP_3"] = df["ZIP_3"].str[:3]
+        else:
+            if "DLQ_STATUS" in df.columns:
+                df["DLQ_STATUS"] = df["DLQ_STATUS"].mask(df["DLQ_STATUS"] == "XX", "X")
+            if "LAST_UPB" in df.columns:
+                masked = (df["LAST_UPB"] == 0) & (df["LOAN_AGE"] < self._MaskedUPBAges)
+                if "ZB_CODE" in df.columns:
+                    masked = masked & df["ZB_CODE"].isna()
+                df["LAST_UPB"] = df["LAST_UPB"].mask(masked)
+            if "NS_PROCS" in df.columns:
+                df["NS_PROCS"] = pd.to_numeric(df["NS_PROCS"], errors="coerce").astype(np.float32)
+            # no asset recovery cost / repurchase proceeds: 0 where the other costs / proceeds are
+            # reported, so that the DEFT_COST and DEFT_PROCS sums of the loan events are defined
+            if "FCC_COST" in df.columns:
+                df["AR_COST"] = np.where(df["FCC_COST"].notna(), 0, np.nan).astype(np.float32)
+            if "NS_PROCS" in df.columns:
+                df["RMW_PROCS"] = np.where(df["NS_PROCS"].notna(), 0, np.nan).astype(np.float32)
+
+        output_schema = self.outputSchema(schema)
+        output_columns = self.outputColumns(schema, columns)
+        added = {k: output_schema[k] for k in output_columns if k not in df.columns}
+        for k, v in added.items():
+            df[k] = _null_column(v, len(df))
+        if schema is self._PerformanceSchema:
+            # the performance frames are default-filled before conform
+            df = PUBLIC_LOAN_FNMA.fill_defaults(df, added)
+        return df[output_columns]
+
+
+def _null_column(v, length):
+    '''a column of missing values of the type read_csv gives the schema entry v'''
+    dtype = PUBLIC_LOAN_FNMA.columnType(v)
+    if dtype == "date":
+        return np.full(length, np.datetime64("NaT"), dtype="datetime64[ns]")
+    if dtype is str:
+        return np.full(length, None, dtype=object)
+    if dtype is np.int32:
+        # no default to fill, int columns without one are never missing in the FNMA files
+        return np.zeros(length, dtype=np.int32)
+    return np.full(length, np.nan, dtype=dtype)
+
+
+def scan_agencies(resultFolder, name="LoanPerformance", agencies=("FNMA", "FRED"), columns=None, filter=None):
+    '''
+    the <name>.parquet datasets of the agencies as one Arrow table with an AGENCY column
+
+    Parameters
+    ----------
+    resultFolder : root folder of the output tree
+    name : "Loan" or "LoanPerformance"
+    agencies : agency folders of resultFolder/output, those not written are skipped
+    columns : list, optional, columns returned (AGENCY is always added)
+    filter : pyarrow.dataset expression, optional, e.g. ds.field("ACQ") == "2000Q1"; it is
+             pushed down to the partitions and row-group statistics of every agency
+
+    Returns
+    -------
+    out : Arrow table; a column missing from an agency's files is null for its rows. The
+          agencies must be written with the same compact setting (string or encoded LOAN_ID).
+    '''
+    folders = {}
+    for agency in agencies:
+        folder = os.path.join(resultFolder, "output", agency, name + ".parquet")
+        if os.path.isdir(folder):
+            folders[agency] = folder
+    if not folders:
+        return None
+    schema = pa.unify_schemas([ds.dataset(f, format="parquet", partitioning="hive").schema
+                               for f in folders.values()], promote_options="permissive")
+    names = schema.names if columns is None else list(columns)
+    tables = []
+    for agency, folder in folders.items():
+        dataset = ds.dataset(folder, schema=schema, format="parquet", partitioning="hive")
+        projection = {k: ds.field(k) for k in names}
+        projection["AGENCY"] = ds.scalar(agency)
+        tables.append(dataset.to_table(columns=projection, filter=filter))
+    return pa.concat_tables(tables)
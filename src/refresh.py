@@ -0,0 +1,397 @@
+'''
+Incremental refresh of the Parquet output when a new performance release is published.
+
+    python -m src.refresh --input /data/fnma --output /data/out
+
+Every release re-publishes the Performance files with one more quarter of activity. A manifest
+next to the output tree (output/FNMA/manifest.json) records per vintage the fingerprint of the
+source files, the highest ACT_DTE written, the row count and a digest of the rows up to it
+(LOAN_ID, ACT_DTE, LAST_UPB and DLQ_STATUS as read from the source). On refresh
+
+* a vintage whose files have the fingerprint of the manifest is skipped,
+* a vintage without a manifest entry, or whose rows up to the mark changed (count or digest), is
+  rebuilt,
+* otherwise only the rows beyond the mark are appended, as part-<YYYYMM>.parquet named after
+  the new mark (a rerun overwrites the same file), and the loan events of Loan.parquet are
+  recomputed for the loans whose forward or history windows reach the new rows.
+'''
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src import metrics
+from src.batch import discover_vintages, enable_metrics, process_vintage
+from src.compact import encode_dlq_status
+from src.features import FEATURE_COLUMNS, derive_loan_events, loan_level_events
+from src.loan_index import build_loan_index
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+from src.utilities import showtime
+
+
+# rows after an event read by the forward windows (DLQ_NEXT24MAX, ZBCODE_NEXT24, ...)
+FORWARD_MONTHS = 24
+_FINGERPRINT_BYTES = 2 ** 20
+# columns of the performance rows covered by the digest of the manifest
+DIGEST_COLUMNS = ["LOAN_ID", "ACT_DTE", "LAST_UPB", "DLQ_STATUS"]
+
+
+def file_fingerprint(path):
+    '''size, mtime and sha1 of the first and last MiB of path'''
+    stat = os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        sha1.update(f.read(_FINGERPRINT_BYTES))
+        if stat.st_size > _FINGERPRINT_BYTES:
+            f.seek(max(_FINGERPRINT_BYTES, stat.st_size - _FINGERPRINT_BYTES))
+            sha1.update(f.read(_FINGERPRINT_BYTES))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": sha1.hexdigest()}
+
+
+def vintage_fingerprint(vintage):
+    return {"acquisition": file_fingerprint(vintage["acquisition_file"]),
+            "performance": file_fingerprint(vintage["performance_file"])}
+
+
+class RowDigest(object):
+    '''
+    digest of a set of performance rows over DIGEST_COLUMNS
+
+    The row hashes are combined by sum and xor, so the digest does not depend on the order or
+    the chunking of the rows and the digest up to a new mark extends the one up to the old mark.
+    '''
+
+    def __init__(self):
+        self.total = 0
+        self.xor = 0
+
+    def update(self, df):
+        if len(df) == 0:
+            return self
+        frame = pd.DataFrame({"LOAN_ID": df["LOAN_ID"].astype(str).values,
+                              "ACT_DTE": pd.to_datetime(df["ACT_DTE"]).values.astype("datetime64[ns]").view(np.int64),
+                              "LAST_UPB": pd.to_numeric(df["LAST_UPB"]).values.astype(np.float64),
+                              "DLQ_STATUS": df["DLQ_STATUS"].astype(str).values})
+        hashes = pd.util.hash_pandas_object(frame, index=False).values
+        # the uint64 sum wraps around as the digest should
+        self.total = (self.total + int(hashes.sum(dtype=np.uint64))) % 2 ** 64
+        self.xor = self.xor ^ int(np.bitwise_xor.reduce(hashes))
+        return self
+
+    def merge(self, other):
+        '''add the rows of other'''
+        self.total = (self.total + other.total) % 2 ** 64
+        self.xor = self.xor ^ other.xor
+        return self
+
+    def hexdigest(self):
+        return "{0:016x}{1:016x}".format(self.total, self.xor)
+
+
+class Manifest(object):
+    '''
+    per-vintage high-water marks of the output tree, persisted as JSON
+
+    Entries hold fingerprint, max_act_dte (ISO date), rows, digest (RowDigest of the rows up to
+    max_act_dte), mode, project and partition_by_year.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.vintages = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.vintages = json.load(f)
+
+    def get(self, acq):
+        return self.vintages.get(acq)
+
+    def set(self, acq, entry):
+        self.vintages[acq] = entry
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp." + str(os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(self.vintages, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def _fnma_folder(resultFolder, name, acq):
+    return os.path.join(resultFolder, "output", "FNMA", name, "ACQ=" + acq)
+
+
+def _performance_mark(resultFolder, acq):
+    '''max ACT_DTE (ISO date) and row count of the written performance rows of acq'''
+    dataset = ds.dataset(_fnma_folder(resultFolder, "LoanPerformance.parquet", acq), format="parquet",
+                         partitioning="hive")
+    dates = dataset.to_table(columns=["ACT_DTE"]).column("ACT_DTE")
+    max_date = pc.max(dates).as_py()
+    return (None if max_date is None else pd.Timestamp(max_date).date().isoformat()), len(dates)
+
+
+def _read_performance(fnma, engine, chunksize, columns):
+    for df in fnma.read_csv(fnma.performance_file, fnma._PerformanceSchema, engine=engine,
+                            chunksize=chunksize, columns=columns):
+        yield PUBLIC_LOAN_FNMA.fill_defaults(df, fnma._PerformanceSchema)
+
+
+def _source_digest(vintage, mark, engine, chunksize):
+    '''RowDigest hex of the source performance rows of vintage up to mark (ISO date)'''
+    fnma = PUBLIC_LOAN_FNMA(vintage["acq"], acquisition_file=vintage["acquisition_file"],
+                            performance_file=vintage["performance_file"])
+    digest = RowDigest()
+    if mark is None:
+        return digest.hexdigest()
+    mark = pd.Timestamp(mark)
+    for df in _read_performance(fnma, engine, chunksize, DIGEST_COLUMNS):
+        digest.update(df[(df["ACT_DTE"] <= mark).values])
+    return digest.hexdigest()
+
+
+def _append_rows(folder, df, mark, partition_by_year):
+    '''
+    write df, sorted by loan, as part-<YYYYMM>.parquet with the schema of the files already in folder
+    and rebuild the LOAN_ID index of folder
+    '''
+    df = df.sort_values(["LOAN_ID", "ACT_DTE"], kind="stable", ignore_index=True)
+    schema = ds.dataset(folder, format="parquet", partitioning="hive").schema
+    schema = pa.schema([f for f in schema if f.name in df.columns])
+    name = "part-" + mark[:4] + mark[5:7] + ".parquet"
+    if partition_by_year:
+        years = df["ACT_DTE"].dt.year.astype(str)
+        parts = [(os.path.join(folder, "ACT_YEAR=" + year), part) for year, part in df.groupby(years.values)]
+    else:
+        parts = [(folder, df)]
+    for part_folder, part in parts:
+        os.makedirs(part_folder, exist_ok=True)
+        table = pa.Table.from_pandas(part[schema.names], schema=schema, preserve_index=False)
+        pq.write_table(table, os.path.join(part_folder, name))
+    build_loan_index(folder)
+
+
+def _affected_loans(loans, new_rows, mark):
+    '''
+    loans of new_rows whose loan events can change: an event trigger among the new rows, or an
+    earlier first modification / 90+ delinquency whose forward windows reach past the mark
+    '''
+    trigger = (new_rows["MOD_FLAG"] == "Y").values | (encode_dlq_status(new_rows["DLQ_STATUS"]) > 2) | new_rows["ZB_CODE"].notna().values
+    affected = set(new_rows["LOAN_ID"].values[trigger])
+
+    cutoff = pd.Timestamp(mark) - pd.DateOffset(months=FORWARD_MONTHS)
+    recent = np.zeros(len(loans), dtype=bool)
+    for column in ("MOD_DTE", "F3Q_DTE"):
+        if column in loans.columns:
+            recent |= (pd.to_datetime(loans[column]) > cutoff).values
+    active = set(new_rows["LOAN_ID"].values)
+    affected.update(loan_id for loan_id in loans["LOAN_ID"].values[recent] if loan_id in active)
+    return affected
+
+
+def _refresh_events(resultFolder, acq, new_rows, mark):
+    '''recompute the loan events of Loan.parquet for the affected loans, returns their number'''
+    loan_folder = _fnma_folder(resultFolder, "Loan.parquet", acq)
+    loans = pq.read_table(loan_folder).to_pandas()
+    affected = _affected_loans(loans, new_rows, mark)
+    if not affected:
+        return 0
+
+    performance = ds.dataset(_fnma_folder(resultFolder, "LoanPerformance.parquet", acq), format="parquet",
+                             partitioning="hive")
+    columns = [c for c in ["LOAN_ID", "ACT_DTE", "LOAN_AGE", "DLQ_STATUS", "LAST_UPB"] + FEATURE_COLUMNS
+               if c in performance.schema.names]
+    # the appended file already holds the new rows
+    # date32 columns as datetime64, as in the frames the events were first derived from
+    rows = performance.to_table(columns=columns, filter=ds.field("LOAN_ID").isin(sorted(affected)))
+    rows = rows.to_pandas(date_as_object=False)
+    events = loan_level_events(derive_loan_events(rows))
+
+    event_columns = [c for c in events.columns if c != "LOAN_ID" and c in loans.columns]
+    is_affected = loans["LOAN_ID"].isin(affected).values
+    updated = loans[is_affected].drop(columns=event_columns).reset_index()
+    updated = updated.merge(events[["LOAN_ID"] + event_columns], on="LOAN_ID", how="left").set_index("index")
+    loans = pd.concat([loans[~is_affected], updated[loans.columns]]).sort_index(kind="stable")
+    PUBLIC_LOAN_FNMA._write_vintage_parquet(loans, loan_folder, row_group_size=500000,
+                                            schema=PUBLIC_LOAN_FNMA._AcquisitionSchema)
+    return len(affected)
+
+
+def refresh_vintage(vintage, resultFolder, entry=None, stageFolder=None, mode="stream", engine="pandas",
+                    chunksize=500000, project=False, partition_by_year=False):
+    '''
+    bring the output of one vintage up to date with its source files
+
+    Parameters
+    ----------
+    vintage : dict from discover_vintages
+    entry : manifest entry of the vintage, None when it was never written
+    mode, engine, chunksize, project, partition_by_year : see batch.process_vintage; a rebuild uses
+        them, an incremental refresh keeps the settings recorded in entry
+
+    Returns
+    -------
+    out : dict with acq, status ("skipped", "rebuilt", "appended" or "unchanged"), rows_added,
+          loans_recomputed, seconds, and the new manifest entry (None when skipped)
+    '''
+    with metrics.stage("refresh_vintage", acq=vintage["acq"]) as stage:
+        result = _refresh_vintage(vintage, resultFolder, entry, stageFolder, mode, engine, chunksize, project,
+                                  partition_by_year)
+        stage.set(status=result["status"], rows_out=result["rows_added"], loans_recomputed=result["loans_recomputed"])
+    return result
+
+
+def _refresh_vintage(vintage, resultFolder, entry, stageFolder, mode, engine, chunksize, project, partition_by_year):
+    ts = time.time()
+    fingerprint = vintage_fingerprint(vintage)
+    result = {"acq": vintage["acq"], "rows_added": 0, "loans_recomputed": 0, "entry": None}
+    if entry is not None and entry.get("fingerprint") == fingerprint:
+        result.update(status="skipped", seconds=time.time() - ts)
+        return result
+
+    if entry is not None and entry.get("max_act_dte") is not None:
+        status = _append_vintage(vintage, resultFolder, entry, stageFolder, engine, chunksize, result)
+    else:
+        status = "rebuild"
+
+    if status == "rebuild":
+        settings = {"mode": mode, "project": project, "partition_by_year": partition_by_year}
+        if entry is not None:
+            settings = {k: entry.get(k, v) for k, v in settings.items()}
+        process_vintage(vintage, resultFolder, stageFolder=stageFolder, engine=engine, chunksize=chunksize,
+                        **settings)
+        max_act_dte, rows = _performance_mark(resultFolder, vintage["acq"])
+        entry = dict(settings, max_act_dte=max_act_dte, rows=rows,
+                     digest=_source_digest(vintage, max_act_dte, engine, chunksize))
+        result.update(rows_added=rows)
+        status = "rebuilt"
+    else:
+        entry = dict(entry, **result.pop("mark"))
+
+    entry["fingerprint"] = fingerprint
+    result.update(status=status, entry=entry, seconds=time.time() - ts)
+    return result
+
+
+def _append_vintage(vintage, resultFolder, entry, stageFolder, engine, chunksize, result):
+    '''append the rows beyond the mark of entry, "rebuild" when the rows up to the mark changed'''
+    mark = pd.Timestamp(entry["max_act_dte"])
+    fnma = PUBLIC_LOAN_FNMA(vintage["acq"], stageFolder=stageFolder,
+                            acquisition_file=vintage["acquisition_file"],
+                            performance_file=vintage["performance_file"])
+    columns = PUBLIC_LOAN_FNMA.selectColumns(fnma._PerformanceSchema, entry.get("project", False),
+                                             (FEATURE_COLUMNS if entry.get("mode") == "memory" else []) + DIGEST_COLUMNS)
+    old_rows = 0
+    new_rows = []
+    old_digest, new_digest = RowDigest(), RowDigest()
+    for df in _read_performance(fnma, engine, chunksize, columns):
+        is_new = (df["ACT_DTE"] > mark).values
+        old_rows = old_rows + int((~is_new).sum())
+        old_digest.update(df[~is_new])
+        if is_new.any():
+            new_rows.append(df[is_new])
+            new_digest.update(df[is_new])
+    if old_rows != entry["rows"]:
+        print(f"refresh_vintage: {vintage['acq']} has {old_rows} rows up to {entry['max_act_dte']}, "
+              f"{entry['rows']} in the manifest; rebuilding")
+        return "rebuild"
+    # entries written before the digest was recorded only have the row count
+    if entry.get("digest") is not None and old_digest.hexdigest() != entry["digest"]:
+        print(f"refresh_vintage: {vintage['acq']} rows up to {entry['max_act_dte']} differ from the manifest "
+              f"digest; rebuilding")
+        return "rebuild"
+    if not new_rows:
+        result["mark"] = {}
+        return "unchanged"
+
+    df = pd.concat(new_rows, ignore_index=True)
+    new_mark = df["ACT_DTE"].max().date().isoformat()
+    if entry.get("mode") == "memory":
+        # as read_data_performance(features=True): LAST_UPB backfill and rows sorted by loan
+        fnma.read_data_acquisition(engine=engine, project=entry.get("project", False))
+        fnma.Performance_Data = df
+        fnma.fill_last_upb()
+        df = fnma.Performance_Data.sort_values(["LOAN_ID", "ACT_DTE"], kind="stable", ignore_index=True)
+
+    _append_rows(_fnma_folder(resultFolder, "LoanPerformance.parquet", vintage["acq"]), df, new_mark,
+                 entry.get("partition_by_year", False))
+    if entry.get("mode") == "memory":
+        result["loans_recomputed"] = _refresh_events(resultFolder, vintage["acq"], df, entry["max_act_dte"])
+    result["rows_added"] = len(df)
+    digest = old_digest.merge(new_digest).hexdigest()
+    result["mark"] = {"max_act_dte": new_mark, "rows": entry["rows"] + len(df), "digest": digest}
+    return "appended"
+
+
+def run_refresh(folder, resultFolder, workers=None, acqs=None, **kwargs):
+    '''
+    refresh every vintage of folder and update the manifest as each one finishes
+
+    Returns
+    -------
+    out : pandas dataframe indexed by acq with status, rows_added, loans_recomputed and seconds
+    '''
+    manifest = Manifest(os.path.join(resultFolder, "output", "FNMA", "manifest.json"))
+    vintages = discover_vintages(folder)
+    if acqs is not None:
+        vintages = [v for v in vintages if v["acq"] in set(acqs)]
+
+    ts = time.time()
+    report = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(refresh_vintage, v, resultFolder, manifest.get(v["acq"]), **kwargs): v
+                   for v in vintages}
+        for future in as_completed(futures):
+            vintage = futures[future]
+            try:
+                result = future.result()
+            except Exception as err:
+                print("run_refresh: {0} failed: {1}".format(vintage["acq"], err))
+                report.append({"acq": vintage["acq"], "status": "failed"})
+                continue
+            entry = result.pop("entry")
+            if entry is not None:
+                manifest.set(vintage["acq"], entry)
+            print(f"{result['acq']}: {result['status']}, {result['rows_added']:,} rows added, "
+                  f"{result['loans_recomputed']:,} loans recomputed in {result['seconds']:.1f}s")
+            report.append(result)
+
+    report = pd.DataFrame(report, columns=["acq", "status", "rows_added", "loans_recomputed", "seconds"])
+    print(f"run_refresh: {len(report)} vintages in {showtime(ts)}")
+    return report.set_index("acq").sort_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="folder with the Acquisition_/Performance_ files")
+    parser.add_argument("--output", required=True, help="root of the output tree")
+    parser.add_argument("--stage", default=None, help="stage folder, default to the output folder")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--mode", choices=["stream", "memory"], default="stream", help="mode of a rebuild")
+    parser.add_argument("--engine", choices=["pandas", "pyarrow"], default="pandas")
+    parser.add_argument("--chunksize", type=int, default=500000)
+    parser.add_argument("--project", action="store_true", help="skip the schema 'drop' columns at parse time")
+    parser.add_argument("--partition-by-year", action="store_true")
+    parser.add_argument("--acq", nargs="+", default=None, help="only these vintages")
+    parser.add_argument("--metrics", default=None, help="append the stage metrics of every vintage to this JSON lines file")
+    args = parser.parse_args()
+    if args.metrics:
+        enable_metrics(args.metrics)
+
+    report = run_refresh(args.input, args.output, workers=args.workers, acqs=args.acq,
+                         stageFolder=args.stage or args.output, mode=args.mode, engine=args.engine,
+                         chunksize=args.chunksize, project=args.project, partition_by_year=args.partition_by_year)
+    print(report.to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+'''
+Schemas of the FNMA files and the mapping of their types to pandas, Arrow and Spark.
+
+The core of the package: it needs numpy only, so workers that use the schemas (or the
+amortization of src.utilities) do not pay for importing pandas, pyarrow or pyspark. arrow_type
+and spark_type import their library on first call.
+
+A schema maps the column names, in file order, to
+    dtype: "string", "float" (float32), "double" (float64), "int" or "date"
+    default: value of the missing entries; an "int" column with a default is read as float32
+    format, format2: date format of pandas / Spark
+    drop: column not kept when projecting (see select_columns)
+'''
+import numpy as np
+
+
+# schema of Acquisition Data
+ACQUISITION_SCHEMA = {"LOAN_ID":         {"dtype": "string"},
+                      "ORIG_CHN":        {"dtype": "string"},
+                      "SellerName":      {"dtype": "string", "drop":True},
+                      "ORIG_RT":         {"dtype": "float"},
+                      "ORIG_AMT":        {"dtype": "double"},
+                      "ORIG_TRM":        {"dtype": "int" },
+                      "ORIG_DTE":        {"dtype": "date", "format":"%m/%Y", "format2":"MM/yyyy"},
+                      "FRST_DTE":        {"dtype": "date", "format":"%m/%Y", "format2":"MM/yyyy"},
+                      "OLTV":            {"dtype": "float", "default": 0},
+                      "OCLTV":           {"dtype": "float", "default": 0},
+                      "NUM_BO":          {"dtype": "int", "default": -1},
+                      "DTI":             {"dtype": "int", "default": -1},
+                      "CSCORE_B":        {"dtype": "float", "default": -1},
+                      "FTHB_FLG":        {"dtype": "string"},
+                      "PURPOSE":         {"dtype": "string"},
+                      "PROP_TYP":        {"dtype": "string"},
+                      "NUM_UNIT":        {"dtype": "int", "default": -1},
+                      "OCC_STAT":        {"dtype": "string"},
+                      "STATE":           {"dtype": "string"},
+                      "ZIP_3":           {"dtype": "string"},
+                      "MI_PCT":          {"dtype": "int", "default": 0},
+                      "Product_Type":    {"dtype": "string"},
+                      "CSCORE_C":        {"dtype": "int", "default": -1},
+                      "MI_TYPE":         {"dtype": "string", "default": "0"},
+                      "RELOCATION_FLG":  {"dtype": "string"}
+                      }
+
+# schema of Performance Data
+PERFORMANCE_SCHEMA = {"LOAN_ID":         {"dtype": "string"},
+                      "ACT_DTE":         {"dtype": "date", "format":"%m/%d/%Y", "format2":"MM/dd/yyyy"},
+                      "SERVICER":        {"dtype": "string", "drop":True},
+                      "LAST_RT":         {"dtype": "float"},
+                      "LAST_UPB":        {"dtype": "double"},
+                      "LOAN_AGE":        {"dtype": "int"},
+                      "Months_To_Legal_Mat": {"dtype": "int", "default": -1},
+                      "Adj_Month_To_Mat": {"dtype": "int", "default": -1},
+                      "Maturity_Date":   {"dtype": "date", "format":"%m/%Y",    "format2":"MM/yyyy"},
+                      "MSA":             {"dtype": "string", "drop":True},
+                      "DLQ_STATUS":      {"dtype": "string"},
+                      "MOD_FLAG":        {"dtype": "string", "drop":True},
+                      "ZB_CODE":         {"dtype": "string", "drop":True},
+                      "ZB_DTE":          {"dtype": "date",   "drop":True, "format":"%m/%Y",    "format2":"MM/yyyy"    },
+                      "LPI_DTE":         {"dtype": "date",   "drop":True, "format":"%m/%d/%Y", "format2":"MM/dd/yyyy" },
+                      "FCC_DTE":         {"dtype": "date",   "drop":True, "format":"%m/%d/%Y", "format2":"MM/dd/yyyy" },
+                      "DISP_DTE":        {"dtype": "date",   "drop":True, "format":"%m/%d/%Y", "format2":"MM/dd/yyyy" },
+                      "FCC_COST":        {"dtype": "float", "drop":True},
+                      "PP_COST":         {"dtype": "float", "drop":True},
+                      "AR_COST":         {"dtype": "float", "drop":True},
+                      "IE_COST":         {"dtype": "float", "drop":True},
+                      "TAX_COST":        {"dtype": "float", "drop":True},
+                      "NS_PROCS":        {"dtype": "float", "drop":True},
+                      "CE_PROCS":        {"dtype": "float", "drop":True},
+                      "RMW_PROCS":       {"dtype": "float", "drop":True},
+                      "O_PROCS":         {"dtype": "float", "drop":True},
+                      "NON_INT_UPB":     {"dtype": "float"},
+                      "PRIN_FORG_UPB_FHFA": {"dtype": "float"},
+                      "REPCH_FLAG":      {"dtype": "string"},
+                      "PRIN_FORG_UPB_OTH": {"dtype": "string"},
+                      "TRANSFER_FLG":    {"dtype": "string"},
+                      }
+
+
+def column_type(v):
+    '''pandas type of the schema entry v: str, np.float32, np.float64, np.int32, "date" or "other"'''
+    vout = str
+    dtype = v.get('dtype')
+    if dtype == "float":
+        vout = np.float32
+    elif dtype == "double":
+        vout = np.float64
+    elif dtype == "int":
+        value = v.get('default')
+        if value is None:
+            vout = np.int32
+        else:
+            vout = np.float32
+    elif dtype == "string":
+        vout = str
+    elif dtype == "date":
+        vout = "date"
+    else:
+        vout = "other"
+    return vout
+
+
+def arrow_type(v):
+    '''Arrow type of the schema entry v in the Parquet output'''
+    import pyarrow as pa
+
+    dtype = v.get('dtype')
+    if dtype == "float":
+        vout = pa.float32()
+    elif dtype == "double":
+        vout = pa.float64()
+    elif dtype == "int":
+        vout = pa.int32()
+    elif dtype == "date":
+        vout = pa.date32()
+    else:
+        vout = pa.string()
+    return vout
+
+
+def spark_type(v):
+    '''Spark type of the schema entry v when reading the csv, dates are parsed afterwards'''
+    from pyspark.sql.types import DoubleType, FloatType, IntegerType, StringType
+
+    dtype = v.get('dtype')
+    if dtype == "float":
+        vout = FloatType()
+    elif dtype == "double":
+        vout = DoubleType()
+    elif dtype == "int":
+        vout = IntegerType()
+    else:
+        vout = StringType()
+    return vout
+
+
+def select_columns(schema, project=False, keep_columns=None):
+    '''
+    columns to read, in file order
+
+    project: skip the columns flagged "drop" in the schema
+    keep_columns: columns read even when flagged "drop", e.g. the inputs of derived features
+    '''
+    if not project:
+        return None
+    keep_columns = set(keep_columns or [])
+    unknown = keep_columns - set(schema.keys())
+    if unknown:
+        raise ValueError("unknown columns: {0}".format(sorted(unknown)))
+    return [k for k, v in schema.items() if not v.get('drop', False) or k in keep_columns]
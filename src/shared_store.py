@@ -0,0 +1,185 @@
+'''
+Processed vintages shared between the processes of one machine.
+
+A publisher (a batch job, a notebook) writes Loan_Data and Performance_Data of a vintage as
+Arrow IPC files to a memory-backed folder (/dev/shm when there is one). Any other process
+attaches to them with a memory map: the pages live once in shared memory whatever the number of
+readers, and the Arrow buffers are not copied; to_pandas keeps the numeric columns without
+missing values and the Arrow-backed strings as views of the map.
+
+Every attached entry holds a shared lock (flock, see src.file_lock) on its file until released,
+so the count of readers is kept by the kernel (the locks of a crashed process go with it) and
+the eviction skips the entries in use. Entries are evicted least recently attached first when the
+store exceeds its quota or when the available memory of the machine drops below min_free_bytes;
+the limits are checked on every publish, attach and release, so the memory a release frees (or
+that other programs took) is reclaimed without waiting for the next publish.
+'''
+import os
+import tempfile
+
+import pyarrow as pa
+
+from src import file_lock, metrics
+
+
+def default_folder():
+    '''the store folder of the machine: in /dev/shm when available, the temporary folder otherwise'''
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(root, "publoan_store")
+
+
+def available_memory():
+    '''bytes of memory available to new allocations (MemAvailable of /proc/meminfo when there is one)'''
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def vintage_key(agency, acqYYYYQQ, name, compact=False):
+    '''entry name of a frame of a vintage, e.g. FNMA_2000Q1_Loan'''
+    return "_".join([agency, acqYYYYQQ, name] + (["compact"] if compact else []))
+
+
+class VintageStore(object):
+    '''
+    Arrow IPC files in folder shared by the processes of the machine
+
+    Parameters
+    ----------
+    folder : store folder, default to default_folder()
+    quota_bytes : size of the store, the least recently attached entries not in use are removed beyond it
+    min_free_bytes : the entries not in use are also removed while less memory is available
+    '''
+
+    _Suffix = ".arrow"
+
+    def __init__(self, folder=None, quota_bytes=None, min_free_bytes=0):
+        self.folder = default_folder() if folder is None else folder
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        # key -> [file descriptor holding the shared lock, number of attachments in this process]
+        self._leases = {}
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + self._Suffix)
+
+    def publish(self, key, table):
+        '''write table under key (replacing an entry not in use) and evict beyond the limits'''
+        if not isinstance(table, pa.Table):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        path = self._path(key)
+        with metrics.stage("store_publish", key=key, rows_in=table.num_rows) as stage:
+            tmp = path + ".tmp." + str(os.getpid())
+            with pa.OSFile(tmp, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            # readers of a replaced entry keep the pages of the old file until they release it
+            os.replace(tmp, path)
+            stage.set(bytes_written=os.path.getsize(path))
+        self.evict(keep=path)
+        return path
+
+    def attach(self, key):
+        '''
+        the memory-mapped table of key, None when it is not published; the entry is in use by
+        this process until release(key) (once per attach). Other entries not in use are evicted
+        beyond the limits.
+        '''
+        path = self._path(key)
+        with metrics.stage("store_attach", key=key) as stage:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                stage.set(hit=False)
+                return None
+            try:
+                file_lock.lock(fd, shared=True)
+                table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            except (OSError, pa.ArrowInvalid):
+                os.close(fd)
+                stage.set(hit=False)
+                return None
+            lease = self._leases.get(key)
+            if lease is None:
+                self._leases[key] = [fd, 1]
+            else:
+                os.close(fd)
+                lease[1] = lease[1] + 1
+            # the modification time orders the entries for eviction
+            os.utime(path)
+            stage.set(hit=True, rows_out=table.num_rows, bytes_read=table.nbytes)
+        self.evict(keep=path)
+        return table
+
+    def release(self, key):
+        '''end one attachment of key by this process, evicting beyond the limits once the last one ends'''
+        lease = self._leases.get(key)
+        if lease is None:
+            return
+        lease[1] = lease[1] - 1
+        if lease[1] <= 0:
+            os.close(lease[0])
+            del self._leases[key]
+            self.evict()
+
+    def in_use(self, path):
+        '''True when a process holds the entry at path'''
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            if not file_lock.lock(fd, blocking=False):
+                return True
+            file_lock.unlock(fd)
+            return False
+        finally:
+            os.close(fd)
+
+    def entries(self):
+        '''(key, bytes, mtime) of the entries, least recently attached first'''
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(self._Suffix):
+                try:
+                    stat = os.stat(os.path.join(self.folder, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((name[:-len(self._Suffix)], stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda e: e[2])
+
+    def _pressure(self, total):
+        return (self.quota_bytes is not None and total > self.quota_bytes) or \
+            (self.min_free_bytes > 0 and available_memory() < self.min_free_bytes)
+
+    def evict(self, keep=None):
+        '''remove the least recently attached entries not in use while the store is over its limits'''
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        if not self._pressure(total):
+            return total
+        with metrics.stage("store_evict", bytes_in=total) as stage:
+            evicted = 0
+            for key, size, _ in entries:
+                if not self._pressure(total):
+                    break
+                path = self._path(key)
+                if path == keep or self.in_use(path):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except PermissionError:
+                    # Windows: still open in a reader
+                    continue
+                total = total - size
+                evicted = evicted + 1
+            stage.set(entries=evicted, bytes_out=total)
+        return total
@@ -0,0 +1,183 @@
+'''
+Persistent loan x age cube of the scheduled UPB of a vintage.
+
+The cube is a .npy file (row i is the loan at position i of the stored LOAN_IDs, column j is
+age j, 0 through the longest term) opened as a read-only NumPy memmap. It is built once per
+vintage; slices are views on the mapped file and lookups only touch the pages they need.
+
+The matrix and the LOAN_IDs of a build are written under names carrying the key of its inputs
+and never change; <path>.json (shape, dtype, key) names the current build and is replaced last,
+so concurrent builders and readers only ever see a complete set.
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from src import file_lock
+from src.utilities import _annuity_balance, _annuity_coefficients
+
+
+def _loan_id_array(loan_ids):
+    loan_ids = np.asarray(loan_ids)
+    if loan_ids.dtype == object:
+        loan_ids = loan_ids.astype(str)
+    return loan_ids
+
+
+def cube_key(loan_ids, principals, monthly_rates, terms):
+    '''sha1 of the inputs, a cube built from other inputs is stale'''
+    sha1 = hashlib.sha1()
+    sha1.update(_loan_id_array(loan_ids).tobytes())
+    for values in (principals, monthly_rates, terms):
+        sha1.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return sha1.hexdigest()
+
+
+class UPBCube(object):
+    '''
+    scheduled UPB per loan and age, memory-mapped from the build named by <path>.json
+
+    The build of key k and dtype d is <path without .npy>.<k>.<d>.npy (the matrix) and
+    <path without .npy>.<k>.<d>.loans.npy (LOAN_ID of each row).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # a build replaced (and removed) between reading the json and opening its files is retried
+        for attempt in range(3):
+            with open(path + ".json") as f:
+                self.meta = json.load(f)
+            try:
+                self.data = np.load(_build_path(path, self.key, self.meta["dtype"]), mmap_mode="r")
+                self.loan_ids = np.load(_build_path(path, self.key, self.meta["dtype"], ".loans.npy"))
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        self._index = None
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def key(self):
+        return self.meta["key"]
+
+    @classmethod
+    def build(cls, path, loan_ids, principals, monthly_rates, terms, dtype=np.float64, chunk_size=100000):
+        '''
+        evaluate the cube chunk by chunk into path and open it
+
+        Parameters
+        ----------
+        loan_ids, principals, monthly_rates, terms : array_like of shape (M, )
+        dtype : np.float64 or np.float32
+        chunk_size : loans evaluated per block
+        '''
+        loan_ids = _loan_id_array(loan_ids)
+        principals = np.asarray(principals, dtype=np.float64)
+        monthly_rates = np.asarray(monthly_rates, dtype=np.float64)
+        terms = np.asarray(terms, dtype=np.float64)
+        num_month = int(terms.max()) + 1 if len(terms) else 1
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        key = cube_key(loan_ids, principals, monthly_rates, terms)
+        suffix = ".tmp." + str(os.getpid())
+        data_path = _build_path(path, key, dtype)
+        data = np.lib.format.open_memmap(data_path + suffix, mode="w+", dtype=dtype, shape=(len(loan_ids), num_month))
+        ages = np.arange(num_month)[np.newaxis, :]
+        for i in range(0, len(loan_ids), chunk_size):
+            j = min(i + chunk_size, len(loan_ids))
+            coefficients = _annuity_coefficients(principals[i:j], monthly_rates[i:j], terms[i:j])
+            coefficients = tuple(c[:, np.newaxis] for c in coefficients)
+            data[i:j, :] = _annuity_balance(coefficients, terms[i:j, np.newaxis], ages, dtype)
+        data.flush()
+        del data
+
+        loans_path = _build_path(path, key, dtype, ".loans.npy")
+        with open(loans_path + suffix, "wb") as f:
+            np.save(f, loan_ids)
+        with open(path + ".json" + suffix, "w") as f:
+            json.dump({"shape": [len(loan_ids), num_month], "dtype": np.dtype(dtype).name, "key": key}, f)
+        # the files of the build first, the json naming it last; the lock keeps another builder
+        # from removing them as stale in between
+        with open(path + ".lock", "w") as lock:
+            file_lock.lock(lock)
+            os.replace(data_path + suffix, data_path)
+            os.replace(loans_path + suffix, loans_path)
+            os.replace(path + ".json" + suffix, path + ".json")
+            _remove_stale_builds(path, key, dtype)
+        return cls(path)
+
+    def loan_index(self, loan_ids):
+        '''row of each LOAN_ID, -1 when the loan is not in the cube'''
+        if self._index is None:
+            self._index = pd.Index(self.loan_ids)
+        return self._index.get_indexer(_loan_id_array(loan_ids))
+
+    def slice(self, loans=slice(None), start_age=0, end_age=None):
+        '''
+        balances of loans (slice or index array of rows) for ages start_age..end_age-1
+
+        A slice of rows returns a view on the mapped file; an index array copies the rows.
+        '''
+        end_age = self.shape[1] if end_age is None else min(end_age, self.shape[1])
+        return self.data[loans, start_age:end_age]
+
+    def at(self, loan_index, ages):
+        '''
+        balance of each (loan_index, age) pair, NaN for a negative index or age, -999 beyond the cube
+
+        Pairs are read in row order so that only the pages holding them are touched.
+        '''
+        loan_index = np.asarray(loan_index, dtype=np.int64)
+        ages = np.asarray(ages, dtype=np.int64)
+        out = np.full(len(ages), np.nan)
+        beyond = (loan_index >= 0) & (ages >= self.shape[1])
+        out[beyond] = -999
+        valid = (loan_index >= 0) & (ages >= 0) & ~beyond
+        rows = np.flatnonzero(valid)
+        rows = rows[np.lexsort((ages[rows], loan_index[rows]))]
+        out[rows] = self.data[loan_index[rows], ages[rows]]
+        return out
+
+
+def _base(path):
+    return path[:-len(".npy")] if path.endswith(".npy") else path
+
+
+def _build_path(path, key, dtype, suffix=".npy"):
+    '''file of the build of key and dtype: <path without .npy>.<key>.<dtype><suffix>'''
+    return _base(path) + "." + key + "." + np.dtype(dtype).name + suffix
+
+
+def _remove_stale_builds(path, key, dtype):
+    '''remove the files of the other builds of path (readers keep the files they mapped)'''
+    folder = os.path.dirname(path) or "."
+    prefix = os.path.basename(_base(path)) + "."
+    keep = {os.path.basename(_build_path(path, key, dtype)),
+            os.path.basename(_build_path(path, key, dtype, ".loans.npy"))}
+    for name in os.listdir(folder):
+        if name.startswith(prefix) and name.endswith(".npy") and ".tmp." not in name and name not in keep:
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+
+
+def open_or_build(path, loan_ids, principals, monthly_rates, terms, dtype=np.float64):
+    '''the cube at path, rebuilt when it is missing or was built from other inputs'''
+    if os.path.exists(path + ".json"):
+        try:
+            cube = UPBCube(path)
+        except FileNotFoundError:
+            return UPBCube.build(path, loan_ids, principals, monthly_rates, terms, dtype=dtype)
+        if cube.key == cube_key(loan_ids, principals, monthly_rates, terms) and cube.meta["dtype"] == np.dtype(dtype).name:
+            return cube
+    return UPBCube.build(path, loan_ids, principals, monthly_rates, terms, dtype=dtype)
@@ -1,22 +1,26 @@
 import time
-from datetime import datetime
-import pandas as pd
+import numpy as np
+from src import metrics
 
 # Show runtime duration since tsart
 def showtime(tstart):
     te = time.time()
     return f"{int((te - tstart) * 1000)} ms"
 
-# Can be used as the function decorator
+# Can be used as the function decorator; the call is a metrics stage named after the method.
+# log_time (dict) and log_name are taken out of the keyword arguments: the duration is stored
+# in log_time[log_name]. Without log_time and with no metrics sink enabled the duration is printed.
 def decorator_time(method):
     def timed(*args, **kw):
+        log_time = kw.pop('log_time', None)
+        name = kw.pop('log_name', method.__name__.upper())
         ts = time.time()
-        result = method(*args, **kw)
+        with metrics.stage(method.__name__):
+            result = method(*args, **kw)
         te = time.time()
-        if 'log_time' in kw:
-            name = kw.get('log_name', method.__name__.upper())
-            kw['log_time'][name] = f"{int((te - ts) * 1000)} ms"
-        else:
+        if log_time is not None:
+            log_time[name] = f"{int((te - ts) * 1000)} ms"
+        elif not metrics.enabled():
             print('%r  %2.2f ms' % \
                   (method.__name__, (te - ts) * 1000)
                   )
@@ -24,10 +28,64 @@ def decorator_time(method):
     return timed
 
 
-def compute_amortization(principals, monthly_rates, terms,  start_period = 0, end_period = None):
+def _as_array(values, dtype=None):
+    # a pandas Series, without importing pandas
+    if hasattr(values, "index") and hasattr(values, "values"):
+        values = values.values
+    return np.atleast_1d(np.asarray(values, dtype=dtype))
+
+
+def _annuity_coefficients(principals, monthly_rates, terms):
+    """
+    Loan level coefficients of the closed-form schedule.
+
+    B(k) = P * ((1 + r)^n - (1 + r)^k) / ((1 + r)^n - 1) is written as A - C * exp(k * log(1 + r)),
+    so only one exp per (loan, age) is left; for r == 0 the schedule is linear, A - C * k.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_growth = np.log1p(np.asarray(monthly_rates, dtype=np.float64))
+        growth_n = np.exp(terms * log_growth)
+        coef_c = principals / (growth_n - 1)
+        coef_a = coef_c * growth_n
+        zero_rate = log_growth == 0
+        if zero_rate.any():
+            coef_c = np.where(zero_rate, principals / terms, coef_c)
+            coef_a = np.where(zero_rate, principals, coef_a)
+    return log_growth, coef_a, coef_c, zero_rate
+
+
+def _annuity_balance(coefficients, terms, ages, dtype):
+    """
+    Evaluate the schedule for broadcastable coefficients/terms and ages.
+
+    Balances are 0 at k == n, -999 beyond the term (same flags as the original loop)
+    and NaN for negative ages.
+    """
+    log_growth, coef_a, coef_c, zero_rate = coefficients
+    ages = ages.astype(dtype, copy=False)
+    balance = np.multiply(ages, log_growth.astype(dtype, copy=False))
+    np.exp(balance, out=balance)
+    if zero_rate.any():
+        balance = np.where(zero_rate, ages, balance).astype(dtype, copy=False)
+    balance *= coef_c.astype(dtype, copy=False)
+    np.subtract(coef_a.astype(dtype, copy=False), balance, out=balance)
+
+    if ages.size and ages.max() >= terms.min():
+        balance[np.broadcast_to(ages == terms, balance.shape)] = 0
+        balance[np.broadcast_to(ages > terms, balance.shape)] = -999
+    if ages.size and ages.min() < 0:
+        balance[np.broadcast_to(ages < 0, balance.shape)] = np.nan
+    return balance
+
+
+def compute_amortization(principals, monthly_rates, terms,  start_period = 0, end_period = None,
+                         dtype=np.float64, chunk_size=250000):
     """
     Compute amortization of loans
 
+    The balance at each age is evaluated directly from the annuity closed form,
+    so no month-by-month loop (or warm-up loop for start_period) is needed.
+
     Parameters
     ----------
     principals : scalar or array_like of shape(M, )
@@ -36,67 +94,227 @@ def compute_amortization(principals, monthly_rates, terms,  start_period = 0, en
                    or
                    array_like or matrix_like if principals is an array_like
         For FRM, one Rate for each loan
-        For ARM, one full time series for each loan
-    
+        For ARM, one full time series for each loan: a matrix (M, T), see compute_amortization_path
+
     terms:  scalar or array_like of shape(M, )
     loan terms, type should match that of principals
+    start_period: int, age of the first column
+    end_period: int, optional, the columns stop before this age
+    dtype: np.float64 or np.float32, output precision
+    chunk_size: int, loans evaluated per block, bounds temporary memory
 
     Returns
     -------
     out : ndarray (M, N)
+        out[i, j] is the scheduled UPB of loan i at age start_period + j;
+        0 at the end of term and -999 beyond it.
 
     """
-    
-   
-        
-    num_loans = len(principals)
-    print("num of loans:", num_loans)
-    
-    print(type(principals))
-    
-    if isinstance(principals, pd.Series):
-       principals = principals.values
-    elif np.ndim(principals) == 0:
-       principals = [principals]
-       
-    #assume principals is np.array
+    if np.ndim(monthly_rates) == 2:
+        return compute_amortization_path(principals, monthly_rates, terms, start_period, end_period,
+                                         dtype=dtype)
+    principals = _as_array(principals)
+    monthly_rates = np.broadcast_to(_as_array(monthly_rates), principals.shape)
+    terms = np.broadcast_to(_as_array(terms), principals.shape)
     num_loans = len(principals)
 
-    if isinstance(monthly_rates, pd.Series):
-       monthly_rates = monthly_rates.values
-    elif np.ndim(principals) == 0:
-       monthly_rates = [monthly_rates]
-
-    if isinstance(terms, pd.Series):
-       terms = terms.values
-    elif np.ndim(terms) == 0:
-       terms = [terms]
-    
-    num_month = terms.max()
-    mini_term = terms.min()
+    num_month = int(terms.max())
     if end_period is not None:
-      num_month = min(num_month, max(1, (end_period - start_period)))
-    
-    upb_matrix = np.zeros((num_month, num_loans))
-    the_payment = principals * (monthly_rates / (1 - (1 + monthly_rates) ** (-terms)))
-    
-    current_upb = principals
-    if start_period > 0:
-       current_upb = principals
-       for t in range(1, start_period+1):
-          pp_payment = the_payment - current_upb * monthly_rates
-          current_upb = current_upb - pp_payment
-    
-    upb_matrix[0, :] = current_upb
-      
-    i = 1
-    for t in range(start_period+1, start_period +num_month ):
-       isbeyondTerm = np.greater(t , terms)
-       pp_payment = the_payment - upb_matrix[i-1, :] * monthly_rates
-       upb_matrix[i, :] = (upb_matrix[i-1, :] - pp_payment) 
-       if t >= mini_term:
-          iswithinTerm = np.greater( terms, t).astype(int)
-          isbeyondTerm = np.greater(t , terms).astype(int)
-          upb_matrix[i, :] = upb_matrix[i, :] * np.array(iswithinTerm) + (-999) * isbeyondTerm
-       i = i +  1
-    return upb_matrix.T
+        num_month = min(num_month, max(1, (end_period - start_period)))
+
+    ages = np.arange(start_period, start_period + num_month)[np.newaxis, :]
+    upb_matrix = np.empty((num_loans, num_month), dtype=dtype)
+    for i in range(0, num_loans, chunk_size):
+        j = min(i + chunk_size, num_loans)
+        coefficients = _annuity_coefficients(principals[i:j], monthly_rates[i:j], terms[i:j])
+        coefficients = tuple(c[:, np.newaxis] for c in coefficients)
+        upb_matrix[i:j, :] = _annuity_balance(coefficients, terms[i:j, np.newaxis], ages, dtype)
+    return upb_matrix
+
+
+def compute_amortization_at(principals, monthly_rates, terms, ages, loan_index=None,
+                            dtype=np.float64, chunk_size=1000000):
+    """
+    Compute scheduled UPB only for the requested (loan, age) pairs
+
+    Parameters
+    ----------
+    principals, monthly_rates, terms : array_like of shape(M, )
+        loan level inputs, as in compute_amortization
+    ages : array_like of shape(K, )
+        age of each requested pair
+    loan_index : array_like of shape(K, ), optional
+        position of each pair's loan in principals; when None the inputs
+        are already aligned with ages. Negative positions give NaN.
+    dtype: np.float64 or np.float32, output precision
+    chunk_size: int, pairs evaluated per block, bounds temporary memory
+
+    Returns
+    -------
+    out : ndarray (K, )
+
+    """
+    principals = _as_array(principals)
+    monthly_rates = np.broadcast_to(_as_array(monthly_rates), principals.shape)
+    terms = np.broadcast_to(_as_array(terms), principals.shape)
+    ages = _as_array(ages)
+    if loan_index is not None:
+        loan_index = _as_array(loan_index, dtype=np.int64)
+
+    coefficients = _annuity_coefficients(principals, monthly_rates, terms)
+    out = np.empty(len(ages), dtype=dtype)
+    for i in range(0, len(ages), chunk_size):
+        j = min(i + chunk_size, len(ages))
+        if loan_index is None:
+            out[i:j] = _annuity_balance(tuple(c[i:j] for c in coefficients), terms[i:j],
+                                        ages[i:j], dtype)
+        else:
+            idx = loan_index[i:j]
+            missing = idx < 0
+            idx = np.where(missing, 0, idx)
+            out[i:j] = _annuity_balance(tuple(c[idx] for c in coefficients), terms[idx],
+                                        ages[i:j], dtype)
+            out[i:j][missing] = np.nan
+    return out
+
+
+def _month_matrix(values, num_loans, num_month, name):
+    """
+    (num_loans, num_month) view of per-month inputs: a scalar, a vector over the months, or a
+    matrix (num_loans, T); months beyond the given ones repeat the last one
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 0:
+        return np.broadcast_to(values, (num_loans, num_month))
+    if values.ndim == 1:
+        values = values[np.newaxis, :]
+    if values.ndim != 2 or values.shape[0] not in (1, num_loans) or values.shape[1] == 0:
+        raise ValueError("{0}: expected a scalar, a vector over the months or a matrix (loans, months), "
+                         "got shape {1}".format(name, values.shape))
+    if values.shape[1] < num_month:
+        pad = np.repeat(values[:, -1:], num_month - values.shape[1], axis=1)
+        values = np.concatenate([values, pad], axis=1)
+    return np.broadcast_to(values[:, :num_month], (num_loans, num_month))
+
+
+def cpr_to_smm(cpr):
+    """single monthly mortality of annual conditional prepayment rates (fractions, not percent)"""
+    return 1 - (1 - np.asarray(cpr, dtype=np.float64)) ** (1 / 12)
+
+
+def rate_matrix(initial_rates, num_month, loan_index=None, ages=None, rates=None):
+    """
+    Dense (M, num_month) rate path from sparse rate-change events
+
+    Parameters
+    ----------
+    initial_rates : array_like of shape(M, ), rate of each loan before its first event
+    num_month : int, columns (ages 0 .. num_month - 1)
+    loan_index, ages, rates : array_like of shape(K, ), optional
+        the rate in effect from age ages[k] of loan loan_index[k] on, e.g. the LAST_RT reported
+        at LOAN_AGE; missing rates and ages outside the matrix are skipped
+
+    Returns
+    -------
+    out : ndarray (M, num_month), each event carried forward to the next one of its loan
+    """
+    initial_rates = _as_array(initial_rates, dtype=np.float64)
+    out = np.full((len(initial_rates), num_month), np.nan)
+    out[:, 0] = initial_rates
+    if loan_index is not None:
+        loan_index = _as_array(loan_index, dtype=np.int64)
+        ages = _as_array(ages, dtype=np.int64)
+        rates = _as_array(rates, dtype=np.float64)
+        keep = (loan_index >= 0) & (ages >= 0) & (ages < num_month) & ~np.isnan(rates)
+        out[loan_index[keep], ages[keep]] = rates[keep]
+    # forward fill along the months: column of the last known value at or before each month
+    filled = np.where(np.isnan(out), 0, np.arange(num_month)[np.newaxis, :])
+    np.maximum.accumulate(filled, axis=1, out=filled)
+    return np.take_along_axis(out, filled, axis=1)
+
+
+def compute_amortization_path(principals, monthly_rates, terms, start_period=0, end_period=None,
+                              smm=None, curtailments=None, dtype=np.float64, chunk_size=20000):
+    """
+    Compute amortization of loans under time-varying rates and prepayments
+
+    The payment is re-amortized every month over the remaining term at the rate of that month
+    (an ARM reset, a no-op under a constant rate), so one month takes the balance B(k) to
+    B(k + 1) = B(k) * f(k) * (1 - smm(k)) - curtailment(k), with the scheduled factor
+    f(k) = ((1 + r)^(n - k) - (1 + r)) / ((1 + r)^(n - k) - 1). The balances are the
+    cumulative product of the factors (and a cumulative sum for the curtailments), evaluated
+    over blocks of chunk_size loans. With a constant rate and no prepayment it equals
+    compute_amortization.
+
+    Parameters
+    ----------
+    principals : array_like of shape(M, ), balances at age 0
+    monthly_rates : array_like of shape(M, ), or matrix (M, T): column k is the rate of the month
+                    from age k to k + 1; later months repeat column T - 1 (see rate_matrix)
+    terms : array_like of shape(M, ), terms in months at age 0
+    start_period : int, age of the first column
+    end_period : int, optional, the columns stop before this age
+    smm : optional, single monthly mortality (see cpr_to_smm): a scalar, a vector over the
+          months (column k for the month from age k to k + 1) or a matrix (M, T)
+    curtailments : optional, principal paid ahead of schedule in each month, in amount,
+                   shaped like smm
+    dtype : np.float64 or np.float32, output precision
+    chunk_size : int, loans evaluated per block, bounds temporary memory
+
+    Returns
+    -------
+    out : ndarray (M, N)
+        out[i, j] is the balance of loan i at age start_period + j;
+        0 at the end of term (or once prepaid) and -999 beyond the term.
+    """
+    principals = _as_array(principals, dtype=np.float64)
+    terms = np.broadcast_to(_as_array(terms), principals.shape)
+    num_loans = len(principals)
+    num_month = int(terms.max())
+    if end_period is not None:
+        num_month = min(num_month, max(1, (end_period - start_period)))
+    last_age = start_period + num_month
+
+    rates = np.asarray(monthly_rates, dtype=np.float64)
+    if rates.ndim < 2:
+        rates = np.broadcast_to(_as_array(rates), principals.shape)[:, np.newaxis]
+    rates = _month_matrix(rates, num_loans, max(last_age - 1, 1), "monthly_rates")
+    if smm is not None:
+        smm = _month_matrix(smm, num_loans, max(last_age - 1, 1), "smm")
+    if curtailments is not None:
+        curtailments = _month_matrix(curtailments, num_loans, max(last_age - 1, 1), "curtailments")
+
+    ages = np.arange(last_age)
+    upb_matrix = np.empty((num_loans, num_month), dtype=dtype)
+    for i in range(0, num_loans, chunk_size):
+        j = min(i + chunk_size, num_loans)
+        n = terms[i:j, np.newaxis]
+        # scheduled factor of the months k -> k + 1, k = 0 .. last_age - 2
+        remaining = (n - ages[np.newaxis, :-1]).astype(np.float64)
+        rate = rates[i:j, :last_age - 1]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            growth = 1 + rate
+            growth_n = np.exp(remaining * np.log1p(rate))
+            factor = (growth_n - growth) / (growth_n - 1)
+            factor = np.where(rate == 0, (remaining - 1) / remaining, factor)
+        factor[remaining <= 1] = 0
+        if smm is not None:
+            factor *= 1 - smm[i:j, :last_age - 1]
+
+        growth = np.empty((j - i, last_age))
+        growth[:, 0] = 1
+        np.cumprod(factor, axis=1, out=growth[:, 1:])
+        balance = principals[i:j, np.newaxis] * growth
+        if curtailments is not None:
+            # B(k) = G(k) * (P - sum_{m < k} c(m) / G(m + 1)), 0 once the balance is gone
+            with np.errstate(divide='ignore', invalid='ignore'):
+                paid = np.where(growth[:, 1:] > 0, curtailments[i:j, :last_age - 1] / growth[:, 1:], 0)
+            balance[:, 1:] -= growth[:, 1:] * np.cumsum(paid, axis=1)
+            np.maximum(balance, 0, out=balance)
+
+        balance = balance[:, start_period:]
+        out_ages = ages[np.newaxis, start_period:]
+        balance[np.broadcast_to(out_ages == n, balance.shape)] = 0
+        balance[np.broadcast_to(out_ages > n, balance.shape)] = -999
+        upb_matrix[i:j, :] = balance
+    return upb_matrix
@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.synthetic import write_vintage
+
+
+@pytest.fixture(scope="session")
+def vintage_files(tmp_path_factory):
+    '''Acquisition_2001Q1.txt and Performance_2001Q1.txt of 300 synthetic loans'''
+    return write_vintage(str(tmp_path_factory.mktemp("fnma")), "2001Q1", 300, seed=3)
@@ -0,0 +1,68 @@
+'''
+The closed-form schedule of src.utilities against the month-by-month annuity recursion.
+'''
+import numpy as np
+
+from src.utilities import compute_amortization, compute_amortization_at
+
+
+def schedule_loop(principal, monthly_rate, term, num_month):
+    '''balance at ages 0 .. num_month - 1 paying the level annuity payment every month'''
+    if monthly_rate == 0:
+        payment = principal / term
+    else:
+        payment = principal * monthly_rate / (1 - (1 + monthly_rate) ** -term)
+    out = np.empty(num_month)
+    balance = principal
+    for age in range(num_month):
+        if age == term:
+            out[age] = 0
+        elif age > term:
+            out[age] = -999
+        else:
+            out[age] = balance
+        balance = balance * (1 + monthly_rate) - payment
+    return out
+
+
+PRINCIPALS = np.array([100000.0, 250000.0, 80000.0, 120000.0])
+RATES = np.array([0.06, 0.035, 0.0, 0.0725]) / 12
+TERMS = np.array([360, 180, 120, 240])
+
+
+def test_closed_form_matches_the_loop():
+    out = compute_amortization(PRINCIPALS, RATES, TERMS)
+    assert out.shape == (4, 360)
+    for i in range(4):
+        np.testing.assert_allclose(out[i], schedule_loop(PRINCIPALS[i], RATES[i], TERMS[i], 360),
+                                   rtol=1e-9, atol=1e-6)
+
+
+def test_start_and_end_period():
+    full = compute_amortization(PRINCIPALS, RATES, TERMS)
+    out = compute_amortization(PRINCIPALS, RATES, TERMS, start_period=100, end_period=200, chunk_size=3)
+    np.testing.assert_allclose(out, full[:, 100:200])
+
+
+def test_float32():
+    out = compute_amortization(PRINCIPALS, RATES, TERMS, dtype=np.float32)
+    assert out.dtype == np.float32
+    np.testing.assert_allclose(out, compute_amortization(PRINCIPALS, RATES, TERMS), rtol=1e-5, atol=0.5)
+
+
+def test_at_pairs():
+    full = compute_amortization(PRINCIPALS, RATES, TERMS)
+    loan_index = np.array([0, 1, 2, 3, 1, 2, -1, 0])
+    ages = np.array([0, 57, 119, 239, 180, 200, 10, -1])
+    out = compute_amortization_at(PRINCIPALS, RATES, TERMS, ages, loan_index=loan_index, chunk_size=3)
+    np.testing.assert_allclose(out[:4], full[loan_index[:4], ages[:4]])
+    # 0 at the end of term, -999 beyond, NaN for an unknown loan or a negative age
+    assert out[4] == 0 and out[5] == -999
+    assert np.isnan(out[6]) and np.isnan(out[7])
+
+
+def test_at_aligned():
+    ages = np.array([12, 24, 36, 48])
+    out = compute_amortization_at(PRINCIPALS, RATES, TERMS, ages)
+    full = compute_amortization(PRINCIPALS, RATES, TERMS)
+    np.testing.assert_allclose(out, full[np.arange(4), ages])
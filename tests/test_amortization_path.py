@@ -0,0 +1,124 @@
+'''
+Time-varying rates and prepayments of src.utilities.compute_amortization_path, and the rate
+paths and projections of PUBLIC_LOAN_FNMA built on them.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+from src.utilities import compute_amortization, compute_amortization_path, cpr_to_smm, rate_matrix
+from tests.test_amortization import PRINCIPALS, RATES, TERMS
+
+
+def reset_loop(principal, rates, term, num_month):
+    '''balance at ages 0 .. num_month - 1, the payment re-amortized whenever the rate changes'''
+    out = np.empty(num_month)
+    balance = principal
+    payment = None
+    for age in range(num_month):
+        out[age] = balance
+        r = rates[age]
+        if payment is None or r != rates[age - 1]:
+            remaining = term - age
+            payment = balance / remaining if r == 0 else balance * r / (1 - (1 + r) ** -remaining)
+        balance = balance * (1 + r) - payment
+    return out
+
+
+def test_constant_rate_matches_compute_amortization():
+    full = compute_amortization(PRINCIPALS, RATES, TERMS)
+    np.testing.assert_allclose(compute_amortization_path(PRINCIPALS, RATES, TERMS, chunk_size=3), full,
+                               rtol=1e-9, atol=1e-6)
+    # the same rates as a matrix, shorter than the terms: the last column repeats
+    matrix = np.repeat(RATES[:, np.newaxis], 12, axis=1)
+    np.testing.assert_allclose(compute_amortization(PRINCIPALS, matrix, TERMS), full, rtol=1e-9, atol=1e-6)
+    out = compute_amortization_path(PRINCIPALS, matrix, TERMS, start_period=100, end_period=200)
+    np.testing.assert_allclose(out, full[:, 100:200], rtol=1e-9, atol=1e-6)
+
+
+def test_rate_reset():
+    # 6% for the first year, then 4% re-amortized over the remaining 348 months
+    rates = np.where(np.arange(360) < 12, 0.06, 0.04) / 12
+    out = compute_amortization_path([100000.0], rates[np.newaxis, :], [360])[0]
+    np.testing.assert_allclose(out, reset_loop(100000.0, rates, 360, 360), rtol=1e-9, atol=1e-6)
+    # a year of 599.55 payments at 6% leaves 98771.99, re-amortized at 4% over 348 months: 480.01
+    assert out.shape == (360,)
+    assert out[12] == pytest.approx(98771.99, abs=0.005)
+    assert out[13] == pytest.approx(98621.22, abs=0.005)
+    assert out[359] == pytest.approx(480.01 / (1 + 0.04 / 12), abs=0.01)
+
+
+def test_cpr_to_smm():
+    smm = cpr_to_smm([0.0, 0.06, 1.0])
+    np.testing.assert_allclose((1 - smm) ** 12, [1.0, 0.94, 0.0], atol=1e-12)
+
+
+def test_prepayments_reduce_the_balance():
+    scheduled = compute_amortization_path(PRINCIPALS, RATES, TERMS)
+    smm = cpr_to_smm(0.1)
+    prepaid = compute_amortization_path(PRINCIPALS, RATES, TERMS, smm=smm)
+    ages = np.arange(scheduled.shape[1])
+    running = scheduled > 0
+    np.testing.assert_allclose(prepaid[running], (scheduled * (1 - smm) ** ages)[running], rtol=1e-9)
+    np.testing.assert_array_equal(prepaid[~running], scheduled[~running])
+
+    curtailed = compute_amortization_path(PRINCIPALS, RATES, TERMS, curtailments=1000.0)
+    np.testing.assert_allclose(curtailed[:, 1], scheduled[:, 1] - 1000, rtol=1e-9)
+    assert (curtailed[running] <= scheduled[running] + 1e-6).all()
+    assert (curtailed[:, 1:][running[:, 1:]] < scheduled[:, 1:][running[:, 1:]]).all()
+    # paying more than the balance ends the loan at 0
+    gone = compute_amortization_path(PRINCIPALS, RATES, TERMS, curtailments=PRINCIPALS.max())
+    assert (gone[:, 1:][running[:, 1:]] == 0).all()
+
+
+def test_rate_matrix():
+    out = rate_matrix([0.05, 0.04], 6, loan_index=[0, 0, 1, 1, 1, -1], ages=[2, 4, 3, 9, 1, 1],
+                      rates=[0.06, 0.07, np.nan, 0.08, 0.03, 0.09])
+    np.testing.assert_allclose(out, [[0.05, 0.05, 0.06, 0.06, 0.07, 0.07],
+                                     [0.04, 0.03, 0.03, 0.03, 0.03, 0.03]])
+
+
+@pytest.fixture(scope="module")
+def fnma(vintage_files):
+    acquisition_file, performance_file = vintage_files
+    fnma = PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+    fnma.read_data_acquisition()
+    fnma.read_data_performance(keep_columns=["ZB_CODE"])
+    return fnma
+
+
+def test_rate_path(fnma):
+    path = fnma.rate_path()
+    loans, perf = fnma.Loan_Data, fnma.Performance_Data
+    assert path.shape == (len(loans), int(loans["ORIG_TRM"].max()))
+    np.testing.assert_allclose(path[:, 0], loans["ORIG_RT"].values / 1200)
+    reported = perf[perf["LAST_RT"].notna() & (perf["LOAN_AGE"] > 0) & (perf["LOAN_AGE"] < path.shape[1])]
+    reported = reported.drop_duplicates(["LOAN_ID", "LOAN_AGE"], keep=False)
+    rows = fnma.loan_index(reported["LOAN_ID"])
+    np.testing.assert_allclose(path[rows, reported["LOAN_AGE"].values], reported["LAST_RT"].values / 1200)
+
+
+def test_project_upb(fnma):
+    out = fnma.project_upb(monthCount=24, cpr=0.06)
+    loans, perf = fnma.Loan_Data, fnma.Performance_Data
+    assert out.shape == (len(loans), 25)
+    # the zero-balanced loans project to 0
+    closed = fnma.loan_index(perf.loc[perf["ZB_CODE"].notna(), "LOAN_ID"].unique())
+    assert len(closed) > 0
+    assert (out[closed] == 0).all()
+    # the others start from their last reported balance and only go down
+    open_ = np.setdiff1d(np.arange(len(loans)), closed)
+    reported = perf[perf["LAST_UPB"].notna()].sort_values(["LOAN_ID", "LOAN_AGE"])
+    last = reported.drop_duplicates("LOAN_ID", keep="last").set_index("LOAN_ID")["LAST_UPB"]
+    start = last.reindex(loans["LOAN_ID"].values[open_]).values
+    known = ~np.isnan(start)
+    np.testing.assert_allclose(out[open_[known], 0], start[known])
+    running = out[open_[known]]
+    assert (np.diff(np.where(running < 0, 0, running), axis=1) <= 1e-6).all()
+
+    frame = fnma.project_upb(monthCount=24, cpr=0.06, outAsMatrix=False)
+    assert isinstance(frame, pd.DataFrame)
+    assert list(frame.columns) == ["LOAN_ID", "LOAN_AGE", "PROJ_UPB"]
+    with pytest.raises(ValueError, match="project_upb"):
+        fnma.project_upb(cpr=0.06, smm=0.01)
@@ -0,0 +1,109 @@
+'''
+Vintage discovery, memory estimates and the process pool of src.batch.
+'''
+import os
+import shutil
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from benchmarks.synthetic import write_vintage
+from src import batch
+
+
+@pytest.fixture(scope="module")
+def vintage_folder(tmp_path_factory):
+    '''2001Q1 (300 loans) and 2001Q2 (100 loans), and an acquisition file without performance'''
+    folder = str(tmp_path_factory.mktemp("batch"))
+    write_vintage(folder, "2001Q1", 300, seed=3)
+    write_vintage(folder, "2001Q2", 100, seed=4)
+    with open(os.path.join(folder, "Acquisition_2001Q3.txt"), "w"):
+        pass
+    with open(os.path.join(folder, "notes.txt"), "w"):
+        pass
+    return folder
+
+
+def _read(resultFolder, name, acq):
+    folder = os.path.join(resultFolder, "output", "FNMA", name + ".parquet", "ACQ=" + acq)
+    return ds.dataset(folder, format="parquet").to_table().to_pandas()
+
+
+def test_discover_vintages(vintage_folder):
+    vintages = batch.discover_vintages(vintage_folder)
+    assert [v["acq"] for v in vintages] == ["2001Q1", "2001Q2"]
+    assert vintages[0]["bytes"] > vintages[1]["bytes"]
+    assert vintages[1]["performance_file"] == os.path.join(vintage_folder, "Performance_2001Q2.txt")
+
+
+def test_estimate_memory(vintage_folder):
+    vintage = batch.discover_vintages(vintage_folder)[0]
+    acquisition = os.path.getsize(vintage["acquisition_file"]) * batch.IN_MEMORY_FACTOR
+    assert batch.estimate_memory(vintage, "stream", chunksize=1000) == \
+        acquisition + 3 * 1000 * batch.STREAM_ROW_BYTES
+    assert batch.estimate_memory(vintage, "memory") == acquisition + vintage["bytes"] * batch.IN_MEMORY_FACTOR
+
+
+def test_process_vintage_modes(vintage_folder, tmp_path):
+    vintage = batch.discover_vintages(vintage_folder)[1]
+    stream = batch.process_vintage(vintage, str(tmp_path / "stream"), mode="stream", chunksize=500)
+    memory = batch.process_vintage(vintage, str(tmp_path / "memory"), mode="memory")
+    assert stream["loans"] == memory["loans"] == 100
+    assert stream["rows"] == memory["rows"] > 0
+
+    keys = ["LOAN_ID", "ACT_DTE"]
+    streamed = _read(str(tmp_path / "stream"), "LoanPerformance", "2001Q2")
+    loaded = _read(str(tmp_path / "memory"), "LoanPerformance", "2001Q2")
+    assert len(streamed) == len(loaded) == stream["rows"]
+    pd.testing.assert_frame_equal(streamed[keys].sort_values(keys, ignore_index=True),
+                                  loaded[keys].sort_values(keys, ignore_index=True))
+    assert len(_read(str(tmp_path / "stream"), "Loan", "2001Q2")) == 100
+
+    with pytest.raises(ValueError, match="unknown mode"):
+        batch.process_vintage(vintage, str(tmp_path / "other"), mode="other")
+
+
+def _count_running(monkeypatch):
+    '''the number of vintages running each time run_batch waits'''
+    counts = []
+    wait = batch.wait
+
+    def counting_wait(fs, **kwargs):
+        counts.append(len(fs))
+        return wait(fs, **kwargs)
+    monkeypatch.setattr(batch, "wait", counting_wait)
+    return counts
+
+
+@pytest.mark.parametrize("mode", ["stream", "memory"])
+def test_run_batch(vintage_folder, tmp_path, monkeypatch, mode):
+    counts = _count_running(monkeypatch)
+    report = batch.run_batch(vintage_folder, str(tmp_path), workers=2, mode=mode, chunksize=500)
+    assert list(report.index) == ["2001Q1", "2001Q2"]
+    assert report["error"].isna().all()
+    assert list(report["loans"]) == [300, 100]
+    assert max(counts) == 2
+    for acq, rows in report["rows"].items():
+        assert len(_read(str(tmp_path), "LoanPerformance", acq)) == rows
+
+
+def test_memory_budget_serializes(vintage_folder, tmp_path, monkeypatch):
+    counts = _count_running(monkeypatch)
+    # every vintage is over the budget: they run one at a time
+    report = batch.run_batch(vintage_folder, str(tmp_path), workers=2, memory_gb=1e-9, chunksize=500)
+    assert counts == [1, 1]
+    assert list(report["loans"]) == [300, 100]
+
+
+def test_failed_vintage(vintage_folder, tmp_path, monkeypatch):
+    folder = str(tmp_path / "in")
+    shutil.copytree(vintage_folder, folder)
+    # the performance file of 2001Q2 cannot be read
+    os.remove(os.path.join(folder, "Performance_2001Q2.txt"))
+    os.makedirs(os.path.join(folder, "Performance_2001Q2.txt"))
+    report = batch.run_batch(folder, str(tmp_path / "out"), workers=2, chunksize=500, acqs=["2001Q1", "2001Q2"])
+    assert pd.isna(report.loc["2001Q1", "error"])
+    assert report.loc["2001Q1", "loans"] == 300
+    assert isinstance(report.loc["2001Q2", "error"], str)
+    assert pd.isna(report.loc["2001Q2", "rows"])
@@ -0,0 +1,42 @@
+'''
+LOAN_ID encoding of src.compact.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import file_lock
+from src.compact import CategoryDictionary, encode_loan_id
+
+
+def test_fnma_and_freddie_ids():
+    out = encode_loan_id(pd.Series(["100000000001", "F01Q10000001", "F105Q1000000", "F01Q20000001"]))
+    assert out.dtype == np.int64
+    assert list(out) == [100000000001, 6 * 10 ** 12 + 11 * 10 ** 7 + 1, 6 * 10 ** 12 + 11051 * 10 ** 7,
+                         6 * 10 ** 12 + 12 * 10 ** 7 + 1]
+    assert len(set(out)) == len(out)
+
+
+def test_numeric_and_empty():
+    assert list(encode_loan_id(np.array([100000000001, 2]))) == [100000000001, 2]
+    assert len(encode_loan_id(pd.Series([], dtype=str))) == 0
+
+
+@pytest.mark.parametrize("loan_id", ["F00Q1000001", "F01Q50000001", "f01Q10000001", "", "ABC", None])
+def test_invalid_ids(loan_id):
+    with pytest.raises(ValueError, match="encode_loan_id"):
+        encode_loan_id(["100000000001", loan_id])
+
+
+@pytest.mark.parametrize("portable", [False, True])
+def test_category_dictionary_file(tmp_path, monkeypatch, portable):
+    if portable:
+        # a platform with neither fcntl nor msvcrt: the locks are no-ops
+        monkeypatch.setattr(file_lock, "_fcntl", lambda: None)
+        monkeypatch.setattr(file_lock, "_msvcrt", lambda: None)
+    path = str(tmp_path / "categories.json")
+    first = CategoryDictionary(path)
+    assert list(first.encode("STATE", ["CA", "NY"]).codes) == [0, 1]
+    second = CategoryDictionary(path)
+    assert list(second.encode("STATE", ["TX", "CA"]).codes) == [2, 0]
+    assert list(first.encode("STATE", ["WA", "TX"]).codes) == [3, 2]
@@ -0,0 +1,27 @@
+'''
+The packed 12-month delinquency history of src.features.
+'''
+import numpy as np
+import pandas as pd
+
+from src.features import DLQ_HISTORY_MAX, dlq_history_lists, pack_dlq_history, unpack_dlq_history
+
+
+def test_pack_dlq_history_round_trip():
+    empty = np.iinfo(np.int16).min
+    lags = np.array([[empty] * 10 + [-2, -1],
+                     list(range(12)),
+                     [empty] * 12], dtype=np.int16)
+    matrix = unpack_dlq_history(pack_dlq_history(lags))
+    assert np.isnan(matrix[0, :10]).all() and list(matrix[0, 10:]) == [-2, -1]
+    # delinquencies beyond DLQ_HISTORY_MAX months are capped
+    assert list(matrix[1]) == [min(v, DLQ_HISTORY_MAX) for v in range(12)]
+    assert np.isnan(matrix[2]).all()
+
+
+def test_history_lists():
+    empty = np.iinfo(np.int16).min
+    lags = np.array([[empty] * 9 + [0, 3, -2]], dtype=np.int16)
+    packed = pd.array(pack_dlq_history(lags), dtype="Int64")
+    assert dlq_history_lists(packed) == [[0, 3, -2]]
+    assert dlq_history_lists(pd.array([None], dtype="Int64")) == [None]
@@ -0,0 +1,133 @@
+'''
+derive_loan_events against a per-loan Python reference on a small synthetic vintage.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.features import dlq_history_lists, derive_loan_events
+
+
+def synthetic_performance(num_loans=60, seed=1):
+    '''performance rows of num_loans loans of 1..40 months, shuffled'''
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(num_loans):
+        loan_id = str(100000000000 + i)
+        for age in range(int(rng.integers(1, 41))):
+            rows.append({"LOAN_ID": loan_id,
+                         "ACT_DTE": pd.Timestamp("2001-01-01") + pd.DateOffset(months=age),
+                         "LOAN_AGE": age,
+                         "DLQ_STATUS": rng.choice(["0", "0", "0", "1", "2", "3", "5", "X", None]),
+                         "LAST_UPB": 1000.0 - age,
+                         "MOD_FLAG": rng.choice(["N", "N", "N", "Y"]),
+                         "ZB_CODE": rng.choice([None] * 12 + ["01", "03", "09"])})
+    df = pd.DataFrame(rows)
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _dlq_code(status):
+    if pd.isna(status):
+        return -1
+    return -2 if status == "X" else int(status)
+
+
+def _window(values, i, start, stop):
+    '''the present values of rows i + start .. i + stop'''
+    return [v for v in values[i + start:i + stop + 1] if v is not None]
+
+
+def reference_rows(df):
+    '''row features loan by loan, in (LOAN_ID, ACT_DTE) order'''
+    out = []
+    for loan_id, loan in df.sort_values(["LOAN_ID", "ACT_DTE"]).groupby("LOAN_ID", sort=True):
+        dlq = [_dlq_code(s) for s in loan["DLQ_STATUS"]]
+        zb = [None if pd.isna(v) else v for v in loan["ZB_CODE"]]
+        for i in range(len(loan)):
+            next12, next24 = _window(dlq, i, 1, 12), _window(dlq, i, 1, 24)
+            zb12, zb24 = _window(zb, i, 1, 12), _window(zb, i, 1, 24)
+            out.append({"LOAN_ID": loan_id,
+                        "LOAN_AGE": loan["LOAN_AGE"].iloc[i],
+                        "DLQ_LAG": dlq[i - 1] if i else None,
+                        "DLQ_NEXT12MAX": max(next12) if next12 else None,
+                        "DLQ_NEXT24MAX": max(next24) if next24 else None,
+                        "ZBCODE_NEXT12": max(zb12) if zb12 else None,
+                        "ZBCODE_NEXT24": max(zb24) if zb24 else None,
+                        "HISTORY": dlq[max(0, i - 12):i]})
+    return pd.DataFrame(out)
+
+
+def _values(column):
+    return [None if pd.isna(v) else v for v in column]
+
+
+@pytest.fixture(scope="module")
+def performance():
+    return synthetic_performance()
+
+
+@pytest.fixture(scope="module")
+def events(performance):
+    return derive_loan_events(performance, row_features=True)
+
+
+@pytest.fixture(scope="module")
+def reference(performance):
+    return reference_rows(performance)
+
+
+def test_row_features(events, reference):
+    rows = events["Performance"]
+    assert list(rows["LOAN_ID"]) == list(reference["LOAN_ID"])
+    assert list(rows["LOAN_AGE"]) == list(reference["LOAN_AGE"])
+    for column in ("DLQ_LAG", "DLQ_NEXT12MAX", "DLQ_NEXT24MAX", "ZBCODE_NEXT12", "ZBCODE_NEXT24"):
+        assert _values(rows[column]) == _values(reference[column]), column
+
+
+def _event_reference(reference, performance, mask):
+    rows = reference.merge(performance[["LOAN_ID", "LOAN_AGE", "MOD_FLAG", "DLQ_STATUS", "ZB_CODE"]],
+                           on=["LOAN_ID", "LOAN_AGE"])
+    return rows[mask(rows)]
+
+
+def test_mod_events(events, reference, performance):
+    expected = _event_reference(reference, performance, lambda r: r["MOD_FLAG"] == "Y")
+    expected = expected.groupby("LOAN_ID", sort=True).head(1)
+    mod = events["Mod"]
+    assert list(mod["LOAN_ID"]) == list(expected["LOAN_ID"])
+    assert list(mod["MOD_AGE"]) == list(expected["LOAN_AGE"])
+    assert _values(mod["MOD_DLQ_LAG"]) == _values(expected["DLQ_LAG"])
+    assert _values(mod["MOD_POST_MAXDLQ_12"]) == _values(expected["DLQ_NEXT12MAX"])
+    assert _values(mod["MOD_POST_MAXDLQ_24"]) == _values(expected["DLQ_NEXT24MAX"])
+    assert _values(mod["MOD_POST_ZBCODE_12"]) == _values(expected["ZBCODE_NEXT12"])
+    assert _values(mod["MOD_POST_ZBCODE_24"]) == _values(expected["ZBCODE_NEXT24"])
+    assert dlq_history_lists(mod["MOD_DLQ_LAGs12"]) == list(expected["HISTORY"])
+
+
+def test_f3q_events(events, reference, performance):
+    expected = _event_reference(reference, performance, lambda r: r["DLQ_STATUS"].map(
+        lambda s: _dlq_code(s) > 2))
+    expected = expected.groupby("LOAN_ID", sort=True).head(1)
+    f3q = events["F3Q"]
+    assert list(f3q["LOAN_ID"]) == list(expected["LOAN_ID"])
+    assert list(f3q["F3Q_AGE"]) == list(expected["LOAN_AGE"])
+    assert _values(f3q["F3Q_POST_MAXDLQ_24"]) == _values(expected["DLQ_NEXT24MAX"])
+    assert _values(f3q["F3Q_POST_ZBCODE_12"]) == _values(expected["ZBCODE_NEXT12"])
+    assert dlq_history_lists(f3q["F3Q_DLQ_LAGs12"]) == list(expected["HISTORY"])
+
+
+def test_zb_events(events, reference, performance):
+    expected = _event_reference(reference, performance, lambda r: r["ZB_CODE"].notna())
+    zb = events["ZB"]
+    assert list(zb["LOAN_ID"]) == list(expected["LOAN_ID"])
+    assert list(zb["ZB_AGE"]) == list(expected["LOAN_AGE"])
+    assert list(zb["ZB_CODE"]) == list(expected["ZB_CODE"])
+    assert _values(zb["ZB_DLQ_LAG"]) == _values(expected["DLQ_LAG"])
+    assert dlq_history_lists(zb["ZB_DLQ_LAGs12"]) == list(expected["HISTORY"])
+
+
+def test_sorted_input_gives_the_same_events(performance, events):
+    sorted_events = derive_loan_events(performance.sort_values(["LOAN_ID", "ACT_DTE"], ignore_index=True),
+                                       row_features=True)
+    for name in ("Mod", "F3Q", "ZB", "Performance"):
+        pd.testing.assert_frame_equal(sorted_events[name], events[name])
@@ -0,0 +1,66 @@
+'''
+Plans of src.lazy against the same operations in pandas.
+'''
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.lazy import LazyFrame, scan
+
+
+@pytest.fixture
+def frames():
+    loans = pd.DataFrame({"LOAN_ID": ["1", "2", "3", "4"], "STATE": ["CA", "TX", "CA", "NY"],
+                          "ORIG_AMT": [100.0, 200.0, 300.0, 400.0]})
+    performance = pd.DataFrame({"LOAN_ID": ["1", "1", "2", "3", "3", "5"], "LOAN_AGE": [0, 1, 0, 0, 1, 0],
+                                "LAST_UPB": [99.0, 98.0, 199.0, 299.0, 298.0, 1.0]})
+    return loans, performance
+
+
+@pytest.fixture
+def performance_folder(frames, tmp_path):
+    pq.write_table(pa.Table.from_pandas(frames[1], preserve_index=False), str(tmp_path / "part-0.parquet"))
+    return str(tmp_path)
+
+
+def _sorted(df):
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+@pytest.mark.parametrize("source", ["pandas", "parquet"])
+def test_select_joined_columns(frames, performance_folder, source):
+    loans, performance = frames
+    plan = LazyFrame(performance) if source == "pandas" else scan(performance_folder)
+    plan = plan.join(LazyFrame(loans).filter([("STATE", "==", "CA")])).select("LAST_UPB", "STATE")
+    assert plan.columns == ["LAST_UPB", "STATE"]
+    assert "select: LAST_UPB, STATE" in plan.explain()
+    expected = performance.merge(loans[loans["STATE"] == "CA"], on="LOAN_ID")[["LAST_UPB", "STATE"]]
+    pd.testing.assert_frame_equal(_sorted(plan.collect()), _sorted(expected))
+    assert plan.count() == len(expected)
+
+
+def test_select_then_join(frames):
+    loans, performance = frames
+    plan = LazyFrame(performance).select("LOAN_ID", "LAST_UPB").join(LazyFrame(loans).select("LOAN_ID", "ORIG_AMT"),
+                                                                      how="left")
+    assert plan.columns == ["LOAN_ID", "LAST_UPB", "ORIG_AMT"]
+    expected = performance[["LOAN_ID", "LAST_UPB"]].merge(loans[["LOAN_ID", "ORIG_AMT"]], on="LOAN_ID", how="left")
+    pd.testing.assert_frame_equal(_sorted(plan.collect()), _sorted(expected))
+
+
+def test_join_after_a_projection(frames):
+    loans, performance = frames
+    states = LazyFrame(loans).select("LOAN_ID", "STATE")
+    plan = LazyFrame(performance).join(states).select("LOAN_AGE", "STATE").join(
+        LazyFrame(loans).select("LOAN_ID", "ORIG_AMT"))
+    assert plan.columns == ["LOAN_AGE", "STATE", "LOAN_ID", "ORIG_AMT"]
+    assert list(plan.collect().columns) == plan.columns
+
+
+def test_unknown_columns(frames):
+    loans, performance = frames
+    with pytest.raises(ValueError, match="ORIG_AMT"):
+        LazyFrame(performance).select("LOAN_ID", "ORIG_AMT")
+    with pytest.raises(ValueError, match="CSCORE_B"):
+        LazyFrame(performance).join(LazyFrame(loans)).select("STATE", "CSCORE_B")
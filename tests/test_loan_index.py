@@ -0,0 +1,37 @@
+'''
+Index-driven loan reads of src.loan_index against dataset scans.
+'''
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from src.loan_index import build_loan_index, read_loans
+
+
+@pytest.fixture
+def partition(tmp_path):
+    loan_ids = np.repeat([str(100000000000 + i) for i in range(40)], 5)
+    table = pa.table({"LOAN_ID": loan_ids, "LOAN_AGE": np.tile(np.arange(5), 40),
+                      "LAST_UPB": np.arange(200, dtype=np.float64)})
+    pq.write_table(table.slice(0, 120), str(tmp_path / "part-0.parquet"), row_group_size=32)
+    pq.write_table(table.slice(120), str(tmp_path / "part-1.parquet"), row_group_size=32)
+    build_loan_index(str(tmp_path))
+    return str(tmp_path)
+
+
+def test_read_loans_matches_a_scan(partition):
+    loan_ids = ["100000000003", "100000000006", "100000000023", "100000000039"]
+    out = read_loans(partition, loan_ids, columns=["LAST_UPB"])
+    expected = ds.dataset(partition).to_table(columns=["LOAN_ID", "LAST_UPB"],
+                                              filter=ds.field("LOAN_ID").isin(loan_ids))
+    assert out.equals(expected)
+
+
+def test_no_match_gives_an_empty_table(partition):
+    out = read_loans(partition, ["999999999999"], columns=["LOAN_AGE"])
+    assert out.num_rows == 0
+    assert out.schema.names == ["LOAN_ID", "LOAN_AGE"]
+    assert out.schema.field("LOAN_AGE").type == pa.int64()
+    assert read_loans(partition, []).schema == ds.dataset(partition).schema
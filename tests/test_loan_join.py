@@ -0,0 +1,66 @@
+'''
+The streaming merge-join of src.loan_join against pandas merges.
+'''
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from src.loan_join import LoanWindow
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _chunks(df, size):
+    return [df.iloc[i:i + size] for i in range(0, len(df), size)]
+
+
+@pytest.fixture
+def loans():
+    ids = np.array([str(100000000000 + 3 * i) for i in range(50)])
+    return pd.DataFrame({"LOAN_ID": ids, "OLTV": np.arange(50.0), "STATE": ["CA", "TX"] * 25})
+
+
+def test_lookup_matches_a_merge(loans):
+    rng = np.random.default_rng(0)
+    ids = np.sort(rng.choice([str(100000000000 + i) for i in range(150)], 400))
+    window = LoanWindow(_chunks(loans, 7))
+    parts = [window.lookup(chunk) for chunk in np.array_split(ids, 9)]
+    out = pd.concat(parts, ignore_index=True)
+    expected = pd.DataFrame({"LOAN_ID": ids}).merge(loans, on="LOAN_ID", how="left")
+    pd.testing.assert_frame_equal(out, expected[["OLTV", "STATE"]], check_dtype=False)
+    assert window.rows_read == len(loans)
+    assert window.peak_rows < len(loans)
+
+
+def test_lookup_out_of_order(loans):
+    window = LoanWindow(_chunks(loans, 10))
+    window.lookup(loans["LOAN_ID"].values[20:30])
+    with pytest.raises(ValueError):
+        window.lookup(loans["LOAN_ID"].values[:5])
+    with pytest.raises(ValueError):
+        LoanWindow([loans]).lookup(loans["LOAN_ID"].values[::-1])
+
+
+def test_unordered_loans(loans):
+    window = LoanWindow([loans.iloc[25:], loans.iloc[:25]])
+    # the second chunk is read for an id past the first one
+    with pytest.raises(ValueError):
+        window.lookup(np.array(["199999999999"]))
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_joined_performance(vintage_files, tmp_path, engine):
+    acquisition_file, performance_file = vintage_files
+    fnma = PUBLIC_LOAN_FNMA("2001Q1", stageFolder=str(tmp_path), acquisition_file=acquisition_file,
+                            performance_file=performance_file)
+    fnma.read_data_performance_chunk(chunksize=1000, loan_chunksize=40, engine=engine, loan_columns=["OLTV", "STATE"])
+    joined = ds.dataset(str(tmp_path / "output" / "FNMA" / "LoanPerformanceJoined.parquet"), format="parquet",
+                        partitioning="hive").to_table().to_pandas()
+
+    fnma.read_data_acquisition()
+    fnma.read_data_performance()
+    expected = fnma.Performance_Data.merge(fnma.Loan_Data[["LOAN_ID", "OLTV", "STATE"]], on="LOAN_ID", how="left")
+    assert len(joined) == len(expected)
+    assert (joined["LOAN_ID"].values == expected["LOAN_ID"].values).all()
+    np.testing.assert_array_equal(joined["OLTV"].values, expected["OLTV"].values)
+    assert list(joined["STATE"]) == list(expected["STATE"])
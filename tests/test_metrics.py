@@ -0,0 +1,44 @@
+'''
+Stage records of src.metrics.
+'''
+import pytest
+
+from src import metrics
+
+
+def test_stage_record(tmp_path):
+    path = tmp_path / "part-0.parquet"
+    path.write_bytes(b"x" * 100)
+    with metrics.collect() as records:
+        with metrics.stage("outer", acq="2000Q1"):
+            with metrics.stage("write_parquet", read_path=str(path)) as stage:
+                stage.set(rows_out=3, written_path=str(tmp_path))
+    inner, outer = records.records
+    assert inner["stage"] == "write_parquet" and inner["parent"] == "outer" and outer["acq"] == "2000Q1"
+    assert inner["bytes_read"] == 100 and inner["bytes_written"] == 100 and inner["rows_out"] == 3
+    assert "read_path" not in inner and "written_path" not in inner
+
+
+def test_disabled_stage_does_not_measure(monkeypatch, tmp_path):
+    def fail(path):
+        raise AssertionError("file_bytes called with metrics disabled")
+    monkeypatch.setattr(metrics, "file_bytes", fail)
+    assert not metrics.enabled()
+    with metrics.stage("write_parquet", read_path=str(tmp_path)) as stage:
+        stage.set(written_path=str(tmp_path))
+
+
+def test_without_resource(monkeypatch):
+    monkeypatch.setattr(metrics, "resource", None)
+    with metrics.collect() as records:
+        with metrics.stage("read_csv"):
+            pass
+    assert records.records[0]["peak_rss_bytes"] is None
+
+
+def test_error_is_recorded():
+    with metrics.collect() as records:
+        with pytest.raises(ValueError):
+            with metrics.stage("read_csv"):
+                raise ValueError("bad row")
+    assert records.records[0]["error"] == "ValueError('bad row')"
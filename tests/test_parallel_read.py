@@ -0,0 +1,51 @@
+'''
+Parallel parsing of src.parallel_read against the single-process parse.
+'''
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.parallel_read import byte_ranges, read_ranges
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _lines(data):
+    return pa.table({"line": pa.array(data.decode().splitlines())})
+
+
+def test_byte_ranges(tmp_path):
+    path = str(tmp_path / "lines.txt")
+    with open(path, "w") as f:
+        f.write("aaaa\nbb\ncccccc\nd\n")
+    ranges = byte_ranges(path, 4)
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+    assert all(a[1] == b[0] for a, b in zip(ranges[:-1], ranges[1:]))
+    with open(path, "rb") as f:
+        data = f.read()
+    # every range starts a line; a split point inside a line moves to the next one
+    assert all(start == 0 or data[start - 1:start] == b"\n" for start, _ in ranges)
+    assert byte_ranges(path, 1) == [(0, len(data))]
+
+
+def test_lines_straddling_the_ranges(vintage_files, tmp_path):
+    _, performance_file = vintage_files
+    with open(performance_file, "rb") as f:
+        data = f.read()
+    size = len(data)
+    # the raw split points of 2 workers x 4 ranges fall inside lines
+    assert any(data[size * i // 8 - 1:size * i // 8] != b"\n" for i in range(1, 8))
+    table = read_ranges(performance_file, _lines, workers=2, folder=str(tmp_path))
+    assert table.column("line").to_pylist() == data.decode().splitlines()
+    assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_parallel_read_data_performance(vintage_files, engine):
+    acquisition_file, performance_file = vintage_files
+    single = PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+    parallel = PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+    single.read_data_performance(engine=engine)
+    parallel.read_data_performance(engine=engine, workers=2)
+    pd.testing.assert_frame_equal(parallel.Performance_Data, single.Performance_Data)
@@ -0,0 +1,76 @@
+'''
+Keys, hits and LRU eviction of src.parse_cache, and the cached reads of PUBLIC_LOAN_FNMA.
+'''
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+
+from src import metrics
+from src.parse_cache import ParseCache, cache_key
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _table(n):
+    return pa.table({"x": pa.array(range(n), pa.int64())})
+
+
+def test_cache_key(tmp_path):
+    path = str(tmp_path / "source.txt")
+    with open(path, "w") as f:
+        f.write("1|2\n")
+    key = cache_key(path, {"a": "int"}, ["a"])
+    assert cache_key(path, {"a": "int"}, ["a"]) == key
+    assert cache_key(path, {"a": "int"}, ["a", "b"]) != key
+    assert cache_key(path, {"a": "float"}, ["a"]) != key
+    assert cache_key(path, {"a": "int"}, ["a"], engine="pyarrow") != key
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache_key(path, {"a": "int"}, ["a"]) != key
+
+
+def test_get_put(tmp_path):
+    cache = ParseCache(str(tmp_path), 2 ** 20)
+    assert cache.get("a") is None
+    cache.put("a", _table(3))
+    assert cache.get("a").equals(_table(3))
+    assert len(cache.entries()) == 1
+
+
+def test_lru_eviction(tmp_path):
+    cache = ParseCache(str(tmp_path), 2 ** 20)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, _table(1000))
+        os.utime(cache._path(key), ns=((i + 1) * 10 ** 9, (i + 1) * 10 ** 9))
+    size = cache.entries()[0][1]
+    # a hit makes "a" the most recently used
+    assert cache.get("a") is not None
+    cache.quota_bytes = 3 * size
+    cache.put("d", _table(1000))
+    assert sorted(os.path.basename(e[0]) for e in cache.entries()) == ["a.arrow", "c.arrow", "d.arrow"]
+
+
+def test_read_data_performance_cached(vintage_files, tmp_path):
+    folder = str(tmp_path / "in")
+    os.makedirs(folder)
+    files = [shutil.copy(f, folder) for f in vintage_files]
+
+    def read(**kwargs):
+        fnma = PUBLIC_LOAN_FNMA("2001Q1", stageFolder=str(tmp_path), acquisition_file=files[0],
+                                performance_file=files[1], parse_cache_gb=1)
+        with metrics.collect() as collector:
+            fnma.read_data_performance(**kwargs)
+        hits = [r["hit"] for r in collector.records if r["stage"] == "parse_cache_get"]
+        return fnma.Performance_Data, hits
+
+    miss, hits = read()
+    assert hits == [False]
+    hit, hits = read()
+    assert hits == [True]
+    pd.testing.assert_frame_equal(hit, miss)
+    # other columns and a modified file are misses
+    assert read(project=True)[1] == [False]
+    stat = os.stat(files[1])
+    os.utime(files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert read()[1] == [False]
@@ -0,0 +1,100 @@
+'''
+The pool cubes of src.pool_cube against pandas group-bys.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.pool_cube import ALL, NA, build_cubes, merge_cubes
+from tests.test_features import synthetic_performance
+
+
+@pytest.fixture(scope="module")
+def vintage():
+    performance = synthetic_performance(num_loans=80, seed=2)
+    loan_ids = np.sort(performance["LOAN_ID"].unique())
+    rng = np.random.default_rng(2)
+    loans = pd.DataFrame({"LOAN_ID": loan_ids,
+                          "STATE": rng.choice(["CA", "TX", "NY"], len(loan_ids)),
+                          "CSCORE_B": rng.choice([590.0, 619.0, 620.0, 700.0, 790.0, np.nan], len(loan_ids)),
+                          "OLTV": rng.choice([50.0, 80.0, 80.5, 97.0], len(loan_ids))})
+    performance["LAST_UPB"] = performance["LAST_UPB"].where(performance["LOAN_AGE"] >= 3)
+    return loans, performance
+
+
+def _dlq_class(status):
+    if pd.isna(status) or status == "X":
+        return "X"
+    months = int(status)
+    return ["C", "30", "60"][months] if months < 3 else "90+"
+
+
+def _zb_class(code):
+    if pd.isna(code):
+        return None
+    return {"01": "PREPAID", "09": "DEFAULT", "03": "DEFAULT"}.get(code, "ZB_OTHER")
+
+
+def reference_rows(loans, performance):
+    '''one row per performance row with the previous report of the loan'''
+    rows = performance.sort_values(["LOAN_ID", "ACT_DTE"], ignore_index=True).merge(loans, on="LOAN_ID")
+    rows["UPB"] = rows["LAST_UPB"].fillna(0)
+    previous = rows.groupby("LOAN_ID")
+    rows["HAS_LAG"] = previous.cumcount() > 0
+    rows["BEG_UPB"] = previous["UPB"].shift(1).fillna(0)
+    rows["DLQ"] = rows["DLQ_STATUS"].map(_dlq_class)
+    rows["DLQ_FROM"] = previous["DLQ"].shift(1)
+    rows["ZB"] = rows["ZB_CODE"].map(_zb_class)
+    rows["DLQ_TO"] = rows["ZB"].fillna(rows["DLQ"])
+    return rows
+
+
+def test_pool_cube_by_state(vintage):
+    loans, performance = vintage
+    cube = build_cubes(loans, performance, acq="2001Q1", rollups=[("FICO_BKT", "OLTV_BKT")])["PoolCube"]
+    cube = cube[(cube["FICO_BKT"] == ALL) & (cube["OLTV_BKT"] == ALL)]
+    cube = cube.sort_values(["STATE", "LOAN_AGE"], ignore_index=True)
+
+    rows = reference_rows(loans, performance)
+    rows["PREPAY_UPB"] = rows["BEG_UPB"].where(rows["ZB"] == "PREPAID", 0)
+    rows["DEFAULT_UPB"] = rows["BEG_UPB"].where(rows["ZB"] == "DEFAULT", 0)
+    rows["DLQ90P_UPB"] = rows["UPB"].where(rows["DLQ"] == "90+", 0)
+    expected = rows.groupby(["STATE", "LOAN_AGE"]).agg(
+        LOANS=("LOAN_ID", "size"), UPB=("UPB", "sum"), BEG_UPB=("BEG_UPB", "sum"), PREPAY_UPB=("PREPAY_UPB", "sum"),
+        DEFAULT_UPB=("DEFAULT_UPB", "sum"), DLQ90P_UPB=("DLQ90P_UPB", "sum")).reset_index()
+
+    assert (cube["ACQ"] == "2001Q1").all()
+    assert list(cube["STATE"]) == list(expected["STATE"])
+    assert list(cube["LOAN_AGE"]) == list(expected["LOAN_AGE"])
+    for column in ("LOANS", "UPB", "BEG_UPB", "PREPAY_UPB", "DEFAULT_UPB", "DLQ90P_UPB"):
+        np.testing.assert_allclose(cube[column], expected[column], err_msg=column)
+
+
+def test_transitions(vintage):
+    loans, performance = vintage
+    cube = build_cubes(loans, performance, rollups=[("STATE", "FICO_BKT", "OLTV_BKT")])["DlqTransition"]
+    cube = cube[cube["STATE"] == ALL].groupby(["DLQ_FROM", "DLQ_TO"])["LOANS"].sum()
+
+    rows = reference_rows(loans, performance)
+    expected = rows[rows["HAS_LAG"]].groupby(["DLQ_FROM", "DLQ_TO"])["LOAN_ID"].size()
+    assert cube.to_dict() == expected.to_dict()
+
+
+def test_fico_buckets(vintage):
+    loans, performance = vintage
+    cube = build_cubes(loans, performance, rollups=[("STATE", "OLTV_BKT")])["PoolCube"]
+    counts = cube[cube["STATE"] == ALL].groupby("FICO_BKT")["LOANS"].sum()
+    rows = reference_rows(loans, performance)
+    bucket = rows["CSCORE_B"].map({590.0: "<620", 619.0: "<620", 620.0: "620-659", 700.0: "700-739",
+                                   790.0: "780+"}).fillna(NA)
+    assert counts.to_dict() == bucket.value_counts().to_dict()
+
+
+def test_merge_partial_cubes(vintage):
+    loans, performance = vintage
+    half = loans["LOAN_ID"].iloc[len(loans) // 2]
+    parts = [build_cubes(loans, performance[performance["LOAN_ID"] < half], acq="2001Q1")["PoolCube"],
+             build_cubes(loans, performance[performance["LOAN_ID"] >= half], acq="2001Q1")["PoolCube"]]
+    merged = merge_cubes(parts)
+    full = merge_cubes([build_cubes(loans, performance, acq="2001Q1")["PoolCube"]])
+    pd.testing.assert_frame_equal(merged, full)
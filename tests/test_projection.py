@@ -0,0 +1,51 @@
+'''
+Parse-time projection (project, keep_columns) of PUBLIC_LOAN_FNMA against the full parse.
+'''
+import pandas as pd
+import pytest
+
+from src.features import FEATURE_COLUMNS
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _fnma(vintage_files):
+    acquisition_file, performance_file = vintage_files
+    return PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+
+
+def test_select_columns():
+    schema = PUBLIC_LOAN_FNMA._PerformanceSchema
+    assert PUBLIC_LOAN_FNMA.selectColumns(schema) is None
+    columns = PUBLIC_LOAN_FNMA.selectColumns(schema, project=True)
+    dropped = [k for k, v in schema.items() if v.get("drop", False)]
+    assert dropped and not set(dropped) & set(columns)
+    assert columns == [k for k in schema if k not in dropped]
+    kept = PUBLIC_LOAN_FNMA.selectColumns(schema, project=True, keep_columns=dropped[:1])
+    assert dropped[0] in kept
+    with pytest.raises(ValueError, match="unknown columns"):
+        PUBLIC_LOAN_FNMA.selectColumns(schema, project=True, keep_columns=["NOT_A_COLUMN"])
+
+
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_projection_matches_the_full_parse(vintage_files, engine):
+    full, projected = _fnma(vintage_files), _fnma(vintage_files)
+    for fnma, project in [(full, False), (projected, True)]:
+        fnma.read_data_acquisition(engine=engine, project=project)
+        fnma.read_data_performance(engine=engine, project=project)
+    for name in ["Loan_Data", "Performance_Data"]:
+        out, expected = getattr(projected, name), getattr(full, name)
+        assert len(out.columns) <= len(expected.columns)
+        pd.testing.assert_frame_equal(out, expected[list(out.columns)])
+    assert set(projected.Performance_Data.columns) == \
+        set(PUBLIC_LOAN_FNMA.selectColumns(PUBLIC_LOAN_FNMA._PerformanceSchema, project=True))
+
+
+def test_projection_keeps_the_feature_inputs(vintage_files):
+    full, projected = _fnma(vintage_files), _fnma(vintage_files)
+    full.read_data_acquisition()
+    full.read_data_performance(features=True)
+    projected.read_data_acquisition(project=True)
+    projected.read_data_performance(project=True, features=True)
+    out, expected = projected.Performance_Data, full.Performance_Data
+    assert set(FEATURE_COLUMNS) & set(PUBLIC_LOAN_FNMA._PerformanceSchema) <= set(out.columns)
+    pd.testing.assert_frame_equal(out, expected[list(out.columns)])
@@ -0,0 +1,34 @@
+'''
+The pyarrow parse engine of PUBLIC_LOAN_FNMA.read_csv against the pandas one.
+'''
+import pandas as pd
+import pytest
+
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _read(vintage_files, engine, **kwargs):
+    acquisition_file, performance_file = vintage_files
+    fnma = PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+    fnma.read_data_acquisition(engine=engine)
+    fnma.read_data_performance(engine=engine, **kwargs)
+    return fnma
+
+
+@pytest.mark.parametrize("features", [False, True])
+def test_pyarrow_engine_matches_pandas(vintage_files, features):
+    expected = _read(vintage_files, "pandas", features=features)
+    out = _read(vintage_files, "pyarrow", features=features)
+    pd.testing.assert_frame_equal(out.Loan_Data, expected.Loan_Data)
+    pd.testing.assert_frame_equal(out.Performance_Data, expected.Performance_Data)
+
+
+def test_chunked_engines(vintage_files):
+    _, performance_file = vintage_files
+    fnma = PUBLIC_LOAN_FNMA("2001Q1")
+    schema = PUBLIC_LOAN_FNMA._PerformanceSchema
+    expected = fnma.read_csv(performance_file, schema)
+    for engine in ["pandas", "pyarrow"]:
+        chunks = list(fnma.read_csv(performance_file, schema, engine=engine, chunksize=1000, block_size=1 << 16))
+        assert len(chunks) > 1
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
@@ -0,0 +1,84 @@
+'''
+Publish, attach, release and eviction of src.shared_store.VintageStore.
+'''
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from src.shared_store import VintageStore, vintage_key
+
+
+def _table(n):
+    return pa.table({"LOAN_ID": pa.array([str(i) for i in range(n)]), "LAST_UPB": pa.array(range(n), pa.float64())})
+
+
+def _touch(store, key, ns):
+    # orders the entries deterministically, the mtime resolution of the folder may be coarse
+    os.utime(store._path(key), ns=(ns, ns))
+
+
+def test_publish_attach_release(tmp_path):
+    store = VintageStore(str(tmp_path))
+    key = vintage_key("FNMA", "2001Q1", "Loan")
+    assert key == "FNMA_2001Q1_Loan"
+    assert store.attach(key) is None
+
+    path = store.publish(key, _table(5).to_pandas())
+    assert os.path.exists(path)
+    table = store.attach(key)
+    pd.testing.assert_frame_equal(table.to_pandas(), _table(5).to_pandas())
+    assert store.in_use(path)
+    store.attach(key)
+    store.release(key)
+    assert store.in_use(path)
+    store.release(key)
+    assert not store.in_use(path)
+    store.release(key)
+    assert [e[0] for e in store.entries()] == [key]
+
+
+def test_evict_skips_entries_in_use(tmp_path):
+    store = VintageStore(str(tmp_path))
+    for i, key in enumerate(["a", "b", "c"]):
+        store.publish(key, _table(1000))
+        _touch(store, key, (i + 1) * 10 ** 9)
+    size = store.entries()[0][1]
+
+    held = store.attach("a")
+    _touch(store, "a", 10 ** 9)
+    store.quota_bytes = 2 * size
+    # "a" is the least recently attached but held: "b" goes instead
+    assert store.evict() == 2 * size
+    assert [e[0] for e in store.entries()] == ["a", "c"]
+
+    store.quota_bytes = size
+    store.evict()
+    assert [e[0] for e in store.entries()] == ["a"]
+    assert held.to_pandas()["LAST_UPB"].sum() == sum(range(1000))
+
+    # releasing the last lease lets the store go back under its quota
+    store.quota_bytes = 0
+    store.release("a")
+    assert store.entries() == []
+
+
+def test_attach_evicts_beyond_quota(tmp_path):
+    store = VintageStore(str(tmp_path))
+    for i, key in enumerate(["a", "b"]):
+        store.publish(key, _table(1000))
+        _touch(store, key, (i + 1) * 10 ** 9)
+    store.quota_bytes = store.entries()[0][1]
+    # the attached entry is kept, the other one is evicted
+    table = store.attach("a")
+    assert [e[0] for e in store.entries()] == ["a"]
+    assert table.num_rows == 1000
+    store.release("a")
+
+
+def test_publish_replaces(tmp_path):
+    store = VintageStore(str(tmp_path))
+    store.publish("a", _table(3))
+    store.publish("a", pd.DataFrame({"LOAN_ID": ["9"], "LAST_UPB": [1.0]}))
+    assert store.attach("a").to_pandas()["LOAN_ID"].tolist() == ["9"]
+    store.release("a")
@@ -0,0 +1,63 @@
+'''
+The streamed LoanPerformance partitions of read_data_performance_chunk against those of
+the in-memory save_as_parquet.
+'''
+import os
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from src.public_loan_fnma import PUBLIC_LOAN_FNMA
+
+
+def _fnma(vintage_files):
+    acquisition_file, performance_file = vintage_files
+    return PUBLIC_LOAN_FNMA("2001Q1", acquisition_file=acquisition_file, performance_file=performance_file)
+
+
+def _partition(resultFolder):
+    return os.path.join(resultFolder, "output", "FNMA", "LoanPerformance.parquet", "ACQ=2001Q1")
+
+
+@pytest.mark.parametrize("partition_by_year", [False, True])
+@pytest.mark.parametrize("engine", ["pandas", "pyarrow"])
+def test_stream_matches_save_as_parquet(vintage_files, tmp_path, engine, partition_by_year):
+    memory_folder, stream_folder = str(tmp_path / "memory"), str(tmp_path / "stream")
+    os.makedirs(memory_folder)
+    os.makedirs(stream_folder)
+    # without Loan_Data nothing is backfilled, as in the stream
+    memory = _fnma(vintage_files)
+    memory.read_data_performance(engine=engine)
+    memory.save_as_parquet(memory_folder, raise_errors=True)
+    out = _fnma(vintage_files).read_data_performance_chunk(resultFolder=stream_folder, chunksize=1000,
+                                                           row_group_size=700, engine=engine,
+                                                           partition_by_year=partition_by_year)
+    assert out["rows"] == len(memory.Performance_Data)
+
+    expected = ds.dataset(_partition(memory_folder), format="parquet").to_table()
+    streamed = ds.dataset(_partition(stream_folder), format="parquet", partitioning="hive").to_table()
+    if partition_by_year:
+        years = pd.to_datetime(streamed.column("ACT_DTE").to_pandas()).dt.year
+        assert (streamed.column("ACT_YEAR").to_pandas() == years).all()
+        assert len(os.listdir(_partition(stream_folder))) > 1
+        streamed = streamed.drop_columns(["ACT_YEAR"])
+    else:
+        # the LOAN_ID index (src.loan_index) sits beside the data file
+        assert sorted(os.listdir(_partition(stream_folder))) == ["_loan_index.parquet", "part-0.parquet"]
+    assert streamed.schema.remove_metadata() == expected.schema.remove_metadata()
+
+    keys = ["LOAN_ID", "ACT_DTE"]
+    pd.testing.assert_frame_equal(streamed.to_pandas().sort_values(keys, ignore_index=True),
+                                  expected.to_pandas().sort_values(keys, ignore_index=True))
+
+
+def test_loan_data_round_trip(vintage_files, tmp_path):
+    fnma = _fnma(vintage_files)
+    fnma.read_data_acquisition()
+    fnma.save_as_parquet(str(tmp_path), Performance_Data=False, raise_errors=True)
+    path = os.path.join(str(tmp_path), "output", "FNMA", "Loan.parquet", "ACQ=2001Q1", "part-0.parquet")
+    # the dates are written as date32
+    pd.testing.assert_frame_equal(pq.read_table(path).to_pandas(date_as_object=False), fnma.Loan_Data,
+                                  check_dtype=False)
@@ -0,0 +1,43 @@
+'''
+The memory-mapped UPB cube of src.upb_cube against compute_amortization.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from src.upb_cube import UPBCube, open_or_build
+from src.utilities import compute_amortization
+
+
+PRINCIPALS = np.array([100000.0, 250000.0, 80000.0])
+RATES = np.array([0.06, 0.035, 0.0]) / 12
+TERMS = np.array([360.0, 180.0, 120.0])
+LOAN_IDS = np.array(["100000000003", "100000000001", "100000000002"])
+
+
+def test_upb_cube(tmp_path):
+    path = str(tmp_path / "cube.npy")
+    cube = UPBCube.build(path, LOAN_IDS, PRINCIPALS, RATES, TERMS, chunk_size=2)
+    full = compute_amortization(PRINCIPALS, RATES, TERMS)
+    assert cube.shape == (3, 361)
+    np.testing.assert_allclose(cube.slice(end_age=360), full)
+
+    index = cube.loan_index(["100000000001", "999", "100000000002", "100000000003"])
+    assert list(index) == [1, -1, 2, 0]
+    out = cube.at(np.array([1, -1, 2, 0, 0]), np.array([12, 12, 120, 400, -1]))
+    assert out[0] == pytest.approx(full[1, 12]) and out[2] == 0 and out[3] == -999
+    assert np.isnan(out[1]) and np.isnan(out[4])
+
+
+def test_open_or_build(tmp_path):
+    path = str(tmp_path / "cube.npy")
+    first = open_or_build(path, LOAN_IDS, PRINCIPALS, RATES, TERMS)
+    assert open_or_build(path, LOAN_IDS, PRINCIPALS, RATES, TERMS).key == first.key
+
+    # other inputs replace the build and remove the stale files
+    second = open_or_build(path, LOAN_IDS, PRINCIPALS * 2, RATES, TERMS)
+    assert second.key != first.key
+    np.testing.assert_allclose(second.slice(end_age=1)[:, 0], PRINCIPALS * 2)
+    builds = sorted(name for name in os.listdir(tmp_path) if name.endswith(".npy"))
+    assert builds == sorted(["cube." + second.key + ".float64.npy", "cube." + second.key + ".float64.loans.npy"])